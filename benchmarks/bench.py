@@ -0,0 +1,162 @@
+"""
+Benchmarks of the blocking client. By default they run against bundled
+fake server, so results are reproducible without Memcached installed:
+
+    python -m benchmarks.bench --threads 1 16 --sizes 10 100000
+
+Results are printed as JSON, one object per scenario, with throughput and
+latency percentiles in microseconds.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import math
+import sys
+import threading
+from timeit import default_timer
+
+from dsmcache.client import Client
+from dsmcache.testing import FakeMemcachedServer
+
+
+SCENARIOS = ('get', 'set', 'get_many')
+VALUE_SIZES = (10, 1000, 100000, 1000000)
+THREADS = (1, 16)
+POOL_SIZES = (1, 8)
+# number of keys fetched by one `get_many`
+FAN_OUT = 100
+# values transferred by one scenario are capped, so runs with large values
+# and `get_many` finish in seconds
+MAX_BYTES = 256 * 1024 * 1024
+
+
+def percentile(latencies, percent):
+    """
+    Return percentile of sorted `latencies` using nearest rank.
+    :type: list
+    :rtype: float
+    """
+    if not latencies:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(latencies))) - 1
+    return latencies[min(max(rank, 0), len(latencies) - 1)]
+
+
+def make_op(client, scenario, value):
+    """
+    Return function running single operation of the scenario.
+    """
+    if scenario == 'get':
+        return lambda i: client.get('bench:{}'.format(i % FAN_OUT))
+    elif scenario == 'set':
+        return lambda i: client.set('bench:{}'.format(i % FAN_OUT), value)
+    elif scenario == 'get_many':
+        keys = ['bench:{}'.format(i) for i in range(FAN_OUT)]
+        return lambda i: client.get_many(keys)
+    raise ValueError('Unknown scenario: {}'.format(scenario))
+
+
+def run(address, scenario, value_size, threads, pool_size, ops,
+        max_bytes=MAX_BYTES):
+    """
+    Run `ops` operations of the scenario split between `threads`, or
+    fewer if they would transfer more than `max_bytes` of values.
+    :return: result of the scenario
+    :rtype: dict
+    """
+    client = Client(address, pool_size=pool_size, socket_timeout=30)
+    value = b'x' * value_size
+    client.set_many(dict(('bench:{}'.format(i), value)
+                         for i in range(FAN_OUT)))
+    op = make_op(client, scenario, value)
+    op_bytes = value_size * (FAN_OUT if scenario == 'get_many' else 1)
+    ops = min(ops, max(max_bytes // max(op_bytes, 1), threads))
+    per_thread = max(ops // threads, 1)
+    latencies = [[] for _ in range(threads)]
+
+    def worker(samples):
+        for i in range(per_thread):
+            start = default_timer()
+            op(i)
+            samples.append(default_timer() - start)
+
+    workers = [threading.Thread(target=worker, args=(samples,))
+               for samples in latencies]
+    start = default_timer()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = default_timer() - start
+    client.disconnect()
+
+    latencies = sorted(sample * 1e6 for samples in latencies
+                       for sample in samples)
+    return {
+        'scenario': scenario,
+        'value_size': value_size,
+        'threads': threads,
+        'pool_size': pool_size,
+        'ops': len(latencies),
+        'seconds': elapsed,
+        'ops_per_sec': len(latencies) / elapsed if elapsed else None,
+        'p50_us': percentile(latencies, 50),
+        'p99_us': percentile(latencies, 99),
+        'p999_us': percentile(latencies, 99.9),
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--server', help='host:port of real Memcached. '
+                        'Bundled fake server is used by default')
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS,
+                        choices=SCENARIOS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=VALUE_SIZES,
+                        help='value sizes in bytes')
+    parser.add_argument('--threads', nargs='+', type=int, default=THREADS)
+    parser.add_argument('--pool-sizes', nargs='+', type=int,
+                        default=POOL_SIZES)
+    parser.add_argument('--ops', type=int, default=1000,
+                        help='operations per scenario')
+    parser.add_argument('--max-bytes', type=int, default=MAX_BYTES,
+                        help='max bytes of values transferred per scenario')
+    parser.add_argument('--output', help='write results to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    address = args.server
+    if address is None:
+        server = FakeMemcachedServer()
+        server.start()
+        address = server.address
+
+    results = []
+    try:
+        for scenario in args.scenarios:
+            for value_size in args.sizes:
+                for threads in args.threads:
+                    for pool_size in args.pool_sizes:
+                        result = run(address, scenario, value_size, threads,
+                                     pool_size, args.ops, args.max_bytes)
+                        results.append(result)
+                        print(json.dumps(result), file=sys.stderr)
+    finally:
+        if server:
+            server.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+"""
+asyncio client for Memcached. It shares command templates and response
+parsing with the blocking `Client`, but does all I/O on asyncio streams.
+"""
+import asyncio
+import logging
+import time
+
+from .client import BaseClient
+from .connection import Host, DEFAULT_SOCKET_TIMEOUT, join_commands
+from .exceptions import EmptyPoolError, ClosedPoolError, CASConflictError
+from .response import Response, ResponseParser, ERROR
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnection(object):
+    """
+    Class representing asyncio connection to Memcached server
+    """
+
+    def __init__(self, host, socket_timeout=DEFAULT_SOCKET_TIMEOUT,
+                 retry_timeout=10, parser_cls=ResponseParser):
+        self._host = host
+        self._socket_timeout = socket_timeout
+        self._retry_timeout = retry_timeout
+        self._reader = None
+        self._writer = None
+        self._dead_ts = 0
+        self._parser = parser_cls()
+
+    async def connect(self):
+        """
+        Open connection to the server
+        :return: True if connected
+        :rtype: bool
+        """
+        if self._check_dead():
+            return False
+        if self._writer:
+            return True
+
+        self._parser.reset()
+        if self._host.port is None:
+            opening = asyncio.open_unix_connection(self._host.address)
+        else:
+            opening = asyncio.open_connection(*self._host.address)
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                opening, self._socket_timeout)
+        except (asyncio.TimeoutError, OSError) as exc:
+            self._mark_socket_dead(str(exc))
+            return False
+
+        return True
+
+    async def send(self, cmd):
+        self._parser.reset()
+        try:
+            if isinstance(cmd, list):
+                self._writer.writelines(cmd)
+            else:
+                self._writer.write(cmd)
+            await asyncio.wait_for(self._writer.drain(), self._socket_timeout)
+        except (AttributeError, asyncio.TimeoutError, OSError) as exc:
+            self._mark_socket_dead(str(exc))
+
+    async def _recv(self):
+        """
+        Receive data from the server and feed it to the parser.
+        :return: number of received bytes, 0 on error
+        :rtype: int
+        """
+        try:
+            data = await asyncio.wait_for(
+                self._reader.read(len(self._parser.get_buffer())),
+                self._socket_timeout)
+        except (AttributeError, asyncio.TimeoutError, OSError) as exc:
+            self._mark_socket_dead(str(exc))
+            return 0
+
+        if not data:
+            self._mark_socket_dead('Server error')
+        else:
+            self._parser.feed(data)
+        return len(data)
+
+    async def read(self, quiet=False):
+        """
+        Read response to one command. See `Connection.read`.
+        """
+        response = Response()
+        while True:
+            result = self._parser.next_result()
+            if result is None:
+                if not await self._recv():
+                    return response
+                continue
+
+            if quiet and result.type == ERROR:
+                result = result._replace(opaque=len(response.quiet))
+            response.add(result)
+            if result.final:
+                return response
+
+    def is_alive(self):
+        return not self._check_dead()
+
+    def _check_dead(self):
+        """
+        Return True if connection is marked as dead
+        """
+        return self._dead_ts > time.time()
+
+    def _mark_socket_dead(self, reason):
+        self._dead_ts = time.time() + self._retry_timeout
+        logger.debug('Connection is dead with reason: {}'.format(reason))
+        self.close()
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+
+class AsyncConnectionPool(object):
+    """
+    Pool of asyncio connections. Coroutines wait for a free connection, so
+    any number of them can share `pool_size` sockets. Connections are opened
+    lazily on first use.
+    """
+
+    ConnectionCls = AsyncConnection
+
+    def __init__(self, host, pool_size=20, timeout=DEFAULT_SOCKET_TIMEOUT,
+                 parser_cls=ResponseParser):
+        self._host = host
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._parser_cls = parser_cls
+        self._pool = asyncio.LifoQueue(pool_size)
+
+        for _ in range(self._pool_size):
+            self._pool.put_nowait(self._new_connection())
+
+    def __repr__(self):
+        return '<AsyncConnectionPool: {}>'.format(self._host)
+
+    def _new_connection(self):
+        return self.ConnectionCls(self._host, socket_timeout=self._timeout,
+                                  parser_cls=self._parser_cls)
+
+    async def _get_connection(self):
+        if self._pool is None:
+            raise ClosedPoolError('Pool is already closed')
+        try:
+            return await asyncio.wait_for(self._pool.get(), self._timeout)
+        except asyncio.TimeoutError:
+            raise EmptyPoolError('Pool is empty')
+
+    def _put_connection(self, conn):
+        if self._pool is None:
+            conn.close()
+        else:
+            self._pool.put_nowait(conn)
+
+    def close(self):
+        """
+        Close all connections and make pool unusable.
+        """
+        pool = self._pool
+        self._pool = None
+
+        while pool and not pool.empty():
+            pool.get_nowait().close()
+
+    async def request(self, cmd):
+        """
+        Wait for a free connection and send `cmd` through it
+        :param cmd: command to send
+        :type: bytes
+        :return: Response instance
+        :rtype: Response
+        """
+        return (await self.request_many([cmd]))[0]
+
+    async def request_many(self, cmds, noreply=False, quiet=False):
+        """
+        Wait for a free connection, send all `cmds` through it in a single
+        write and read their responses back in order.
+        :param cmds: commands to send
+        :type: list
+        :param noreply: do not read any responses
+        :type: bool
+        :param quiet: read a single response to `noreply` commands ending
+        with `mn`, see `ConnectionPool.request_many`
+        :type: bool
+        :return: list of Response instances
+        :rtype: list
+        """
+        connection = await self._get_connection()
+
+        try:
+            await connection.connect()  # if not already connected
+            await connection.send(join_commands(cmds))
+            if noreply:
+                return []
+            if quiet:
+                return [await connection.read(quiet=True)]
+            return [await connection.read() for _ in cmds]
+        except BaseException:
+            # a cancelled request leaves unread replies in the stream
+            connection.close()
+            raise
+        finally:
+            self._put_connection(connection)
+
+
+class AsyncClient(BaseClient):
+    """
+    asyncio Memcached client with the same command set as `Client`.
+    """
+
+    def __init__(self, host, pool_size=20, socket_timeout=None,
+                 protocol='text', serializer=None, compressor=None):
+        """
+        :param host: host/port string. Eg. '127.0.0.1:11211'
+        :type: str
+        :param pool_size: Number of sockets shared by all coroutines
+        :type: int
+        :param socket_timeout:
+        :type: int
+        :param protocol: 'text', 'binary' or protocol engine instance
+        :param serializer: converts values to bytes and back, using flags
+        to record value type
+        :type: Serializer
+        :param compressor: compresses large values, disabled by default
+        :type: Compressor
+        """
+        self._init_options(protocol, serializer=serializer,
+                           compressor=compressor)
+        self._pool = AsyncConnectionPool(
+            Host(host), pool_size=pool_size, timeout=socket_timeout,
+            parser_cls=self._protocol.parser_cls)
+
+    async def get(self, key):
+        """
+        Get data for given key from Memcached.
+        :param key: key to fetch
+        :type: str
+        """
+        return await self._send_cmd('get', key=self._check_key(key))
+
+    async def get_many(self, keys):
+        """
+        Get data for multiple keys from Memcached in a single round trip.
+        :param keys: keys to fetch
+        :type: list
+        :return: dict of found keys and their values
+        :rtype: dict
+        """
+        checked, requests = self._get_many_requests(keys)
+
+        responses = []
+        for pool_responses in await asyncio.gather(
+                *[pool.request_many(cmds) for pool, cmds in requests]):
+            responses.extend(pool_responses)
+        return self._get_many_result(checked, responses)
+
+    async def set(self, key, value, time=0, flags=0):
+        """
+        Store data in Memcached.
+        :param key:
+        :param value:
+        :param time: TTL. If 0 then cache forever
+        :param flags:
+        """
+        return await self._send_cmd(
+            'set', **self._set_args(key, value, time, flags))
+
+    async def gets(self, key):
+        """
+        Get data for given key with its CAS unique, used by `cas`.
+        :param key: key to fetch
+        :return: value and CAS unique, (None, None) if key was not found
+        :rtype: tuple
+        """
+        return await self._send_cmd('gets', key=self._check_key(key))
+
+    async def gat(self, key, time=0):
+        """
+        Get data for given key and update its TTL.
+        :param key: key to fetch
+        :param time: new TTL. If 0 then cache forever
+        """
+        return await self._send_cmd(
+            'gat', key=self._check_key(key), time=time)
+
+    async def gats(self, key, time=0):
+        """
+        Get data for given key with its CAS unique and update its TTL.
+        :return: value and CAS unique, (None, None) if key was not found
+        :rtype: tuple
+        """
+        return await self._send_cmd(
+            'gats', key=self._check_key(key), time=time)
+
+    async def add(self, key, value, time=0, flags=0):
+        """
+        Store data in Memcached only if the key doesn't exist yet.
+        :return: True if value was stored
+        """
+        return await self._send_cmd(
+            'add', **self._set_args(key, value, time, flags))
+
+    async def replace(self, key, value, time=0, flags=0):
+        """
+        Store data in Memcached only if the key already exists.
+        :return: True if value was stored
+        """
+        return await self._send_cmd(
+            'replace', **self._set_args(key, value, time, flags))
+
+    async def append(self, key, value):
+        """
+        Append data to the existing value. Value is serialized, but not
+        compressed, so use it with bytes or text only.
+        :return: True if value was stored
+        """
+        return await self._concat('append', key, value)
+
+    async def prepend(self, key, value):
+        """
+        Prepend data to the existing value. See `append`.
+        :return: True if value was stored
+        """
+        return await self._concat('prepend', key, value)
+
+    async def cas(self, key, value, cas, time=0, flags=0):
+        """
+        Store data only if it was not changed since it was fetched with
+        `gets`.
+        :param cas: CAS unique returned by `gets`
+        :type: int
+        :return: True if value was stored, False if it was changed
+        meanwhile and None if key was not found
+        """
+        cmd_args = self._set_args(key, value, time, flags)
+        cmd_args['cas'] = cas
+        return await self._send_cmd('cas', **cmd_args)
+
+    async def cas_update(self, key, fn, retries=10, time=0, flags=0):
+        """
+        Update value atomically, see `Client.cas_update`. `fn` is a plain
+        function, not a coroutine.
+        :return: stored value
+        :raises: CASConflictError if all retries failed
+        """
+        for _ in range(retries + 1):
+            value, cas = await self.gets(key)
+            value = fn(value)
+            if cas is None:
+                stored = await self.add(key, value, time, flags)
+            else:
+                stored = await self.cas(key, value, cas, time, flags)
+            if stored:
+                return value
+        raise CASConflictError(
+            'Value changed during {} attempts'.format(retries + 1))
+
+    async def set_many(self, mapping, time=0, flags=0, noreply=False):
+        """
+        Store multiple values in Memcached using pipelined commands.
+        :return: list of keys which were not stored
+        :rtype: list
+        """
+        keys = list(mapping)
+        results = await self._send_many('set', [
+            self._set_args(key, mapping[key], time, flags) for key in keys
+        ], noreply=noreply)
+        return self._failed_keys(keys, results)
+
+    async def delete(self, key):
+        """
+        Delete given key from Memcached.
+        :return: True if key was deleted
+        """
+        return await self._send_cmd('delete', key=self._check_key(key))
+
+    async def delete_many(self, keys, noreply=False):
+        """
+        Delete multiple keys from Memcached using pipelined commands.
+        :return: list of keys which were not deleted
+        :rtype: list
+        """
+        keys = list(keys)
+        results = await self._send_many('delete', [
+            dict(key=self._check_key(key)) for key in keys
+        ], noreply=noreply)
+        return self._failed_keys(keys, results)
+
+    async def touch(self, key, time=0):
+        """
+        Update TTL of given key.
+        :return: True if key was touched
+        """
+        return await self._send_cmd(
+            'touch', key=self._check_key(key), time=time)
+
+    async def touch_many(self, keys, time=0, noreply=False):
+        """
+        Update TTL of multiple keys using pipelined commands.
+        :return: list of keys which were not touched
+        :rtype: list
+        """
+        keys = list(keys)
+        results = await self._send_many('touch', [
+            dict(key=self._check_key(key), time=time) for key in keys
+        ], noreply=noreply)
+        return self._failed_keys(keys, results)
+
+    async def incr(self, key, delta=1):
+        """
+        Increment counter stored as decimal digits, eg. an integer value.
+        :param delta: non-negative number to add
+        :type: int
+        :return: new value or None if key was not found
+        :rtype: int | None
+        """
+        return await self._send_cmd(
+            'incr', key=self._check_key(key), delta=delta)
+
+    async def decr(self, key, delta=1):
+        """
+        Decrement counter. Memcached never decrements it below 0.
+        :return: new value or None if key was not found
+        :rtype: int | None
+        """
+        return await self._send_cmd(
+            'decr', key=self._check_key(key), delta=delta)
+
+    async def flush_all(self):
+        return await self._send_cmd('flush_all')
+
+    def disconnect(self):
+        logger.info('Disconnecting connection pool')
+        for pool in self._pools:
+            pool.close()
+
+    async def _send_cmd(self, cmd_name, **kwargs):
+        cmd = self._protocol.encode(cmd_name, kwargs)
+        response = await self._get_pool(kwargs.get('key')).request(cmd)
+        return self._parse_response(cmd_name, response)
+
+    async def _concat(self, cmd_name, key, value):
+        data, _ = self._serializer.serialize(value)
+        return await self._send_cmd(
+            cmd_name, key=self._check_key(key), value=data, flags=0, time=0,
+            size=len(data))
+
+    async def _send_many(self, cmd_name, cmds_args, noreply=False):
+        """
+        Pipeline many `cmd_name` commands. Pipelines run concurrently.
+        :return: list of parsed results in order of `cmds_args`
+        :rtype: list
+        """
+        requests = self._many_requests(cmd_name, cmds_args, noreply=noreply)
+        options = self._protocol.read_options(noreply)
+        all_responses = await asyncio.gather(*[
+            pool.request_many(cmds, **options)
+            for pool, _, cmds in requests
+        ])
+
+        results = [None] * len(cmds_args)
+        for (_, positions, _), responses in zip(requests, all_responses):
+            parsed = self._parse_responses(
+                cmd_name, responses, len(positions), noreply)
+
+            for i, result in zip(positions, parsed):
+                results[i] = result
+        return results
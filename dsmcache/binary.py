@@ -0,0 +1,340 @@
+"""
+Memcached binary protocol. Every packet starts with a fixed 24 byte header.
+Multi-key operations use quiet opcodes terminated with NOOP, so the server
+replies only with hits and failures, matched to requests by opaque.
+"""
+from __future__ import unicode_literals
+
+import struct
+
+import six
+
+from .exceptions import UnsupportedCommandError
+from .response import (
+    Response, ResponseParser, Result, VALUE, END, STORED, NOT_STORED, EXISTS,
+    NOT_FOUND, DELETED, TOUCHED, OK, NUMERIC, ERROR)
+
+
+REQUEST_MAGIC = 0x80
+RESPONSE_MAGIC = 0x81
+
+HEADER = struct.Struct('!BBHBBHIIQ')
+FLAGS = struct.Struct('!I')
+SET_EXTRAS = struct.Struct('!II')
+TOUCH_EXTRAS = struct.Struct('!I')
+COUNTER = struct.Struct('!Q')
+# delta, initial value and TTL of counter, no TTL means no auto-creation
+COUNTER_EXTRAS = struct.Struct('!QQI')
+NO_AUTO_CREATE = 0xffffffff
+
+OP_GET = 0x00
+OP_SET = 0x01
+OP_ADD = 0x02
+OP_REPLACE = 0x03
+OP_DELETE = 0x04
+OP_INCREMENT = 0x05
+OP_DECREMENT = 0x06
+OP_FLUSH = 0x08
+OP_GETQ = 0x09
+OP_NOOP = 0x0a
+OP_GETK = 0x0c
+OP_GETKQ = 0x0d
+OP_APPEND = 0x0e
+OP_PREPEND = 0x0f
+OP_SETQ = 0x11
+OP_ADDQ = 0x12
+OP_REPLACEQ = 0x13
+OP_DELETEQ = 0x14
+OP_INCREMENTQ = 0x15
+OP_DECREMENTQ = 0x16
+OP_FLUSHQ = 0x18
+OP_APPENDQ = 0x19
+OP_PREPENDQ = 0x1a
+OP_TOUCH = 0x1c
+OP_GAT = 0x1d
+OP_GATQ = 0x1e
+OP_GATK = 0x23
+OP_GATKQ = 0x24
+
+STATUS_OK = 0x00
+STATUS_KEY_NOT_FOUND = 0x01
+STATUS_KEY_EXISTS = 0x02
+STATUS_ITEM_NOT_STORED = 0x05
+
+QUIET_OPS = frozenset([
+    OP_GETQ, OP_GETKQ, OP_SETQ, OP_ADDQ, OP_REPLACEQ, OP_DELETEQ,
+    OP_INCREMENTQ, OP_DECREMENTQ, OP_FLUSHQ, OP_APPENDQ, OP_PREPENDQ,
+    OP_GATQ, OP_GATKQ])
+GET_OPS = frozenset([
+    OP_GET, OP_GETQ, OP_GETK, OP_GETKQ, OP_GAT, OP_GATQ, OP_GATK, OP_GATKQ])
+STORAGE_OPS = frozenset([
+    OP_SET, OP_ADD, OP_REPLACE, OP_APPEND, OP_PREPEND, OP_SETQ, OP_ADDQ,
+    OP_REPLACEQ, OP_APPENDQ, OP_PREPENDQ])
+
+# result of successful request by opcode
+SUCCESS = {
+    OP_DELETE: DELETED,
+    OP_DELETEQ: DELETED,
+    OP_TOUCH: TOUCHED,
+    OP_FLUSH: OK,
+    OP_FLUSHQ: OK,
+    OP_NOOP: END,
+}
+SUCCESS.update((op, STORED) for op in STORAGE_OPS)
+
+# quiet opcodes used for pipelined commands
+QUIET_OPCODES = {
+    'set': OP_SETQ,
+    'delete': OP_DELETEQ,
+}
+# commands without a quiet opcode are pipelined with normal ones
+OPCODES = {
+    'get': OP_GET,
+    'gets': OP_GET,
+    'gat': OP_GAT,
+    'gats': OP_GAT,
+    'set': OP_SET,
+    'add': OP_ADD,
+    'replace': OP_REPLACE,
+    'append': OP_APPEND,
+    'prepend': OP_PREPEND,
+    'cas': OP_SET,
+    'delete': OP_DELETE,
+    'touch': OP_TOUCH,
+    'incr': OP_INCREMENT,
+    'decr': OP_DECREMENT,
+}
+
+
+def packet(opcode, key=b'', extras=b'', value=b'', opaque=0, cas=0):
+    """
+    Build request packet.
+    :rtype: bytes
+    """
+    return HEADER.pack(
+        REQUEST_MAGIC, opcode, len(key), len(extras), 0, 0,
+        len(extras) + len(key) + len(value), opaque, cas
+    ) + extras + key + value
+
+
+class BinaryResponseParser(ResponseParser):
+    """
+    Incremental parser of binary protocol responses. Responses are
+    translated into the same results as text protocol responses, so a hit
+    of non-quiet get gives VALUE and END, and NOOP gives END.
+    """
+
+    VALUE_TRAILER = 0
+
+    def _parse(self):
+        while True:
+            if self._value is not None:
+                if self._value_end < self._length:
+                    return
+                self._emit_value(self._value.value)
+                self._value = None
+
+            if self._header is not None:
+                if not self._parse_value():
+                    return
+                continue
+
+            if not self._parse_header():
+                return
+
+    def _parse_header(self):
+        """
+        Parse packet header with extras and key.
+        :return: False if more data is needed
+        :rtype: bool
+        """
+        available = self._end - self._start
+        if available < HEADER.size:
+            if self._start + HEADER.size > len(self._buffer):
+                self._compact()
+            return False
+
+        (_, opcode, key_length, extras_length, _, status, body_length,
+         opaque, cas) = HEADER.unpack_from(self._buffer, self._start)
+
+        needed = HEADER.size + extras_length + key_length
+        if available < needed:
+            if self._start + needed > len(self._buffer):
+                self._compact()
+            return False
+
+        offset = self._start + HEADER.size
+        view = memoryview(self._buffer)
+        extras = bytes(view[offset:offset + extras_length])
+        offset += extras_length
+        key = bytes(view[offset:offset + key_length])
+
+        self._start += needed
+        self._header = (opcode, status, opaque, cas, key, extras)
+        self._length = body_length - extras_length - key_length
+        return True
+
+    def _streams_value(self):
+        opcode, status = self._header[:2]
+        return opcode in GET_OPS and status == STATUS_OK
+
+    def _emit_value(self, value):
+        opcode, status, opaque, cas, key, extras = self._header
+        self._header = None
+        quiet_opaque = opaque if opcode in QUIET_OPS else None
+
+        if status == STATUS_OK and opcode in GET_OPS:
+            flags = FLAGS.unpack(extras)[0] if extras else 0
+            self._results.append(
+                Result(VALUE, key, value, flags, cas, quiet_opaque))
+            if quiet_opaque is None:
+                self._results.append(Result(END))
+            return
+
+        if status == STATUS_OK:
+            if opcode in (OP_INCREMENT, OP_DECREMENT,
+                          OP_INCREMENTQ, OP_DECREMENTQ):
+                result = Result(NUMERIC, value=COUNTER.unpack(value)[0])
+            else:
+                result = Result(SUCCESS.get(opcode, OK), cas=cas or None)
+        elif status == STATUS_KEY_NOT_FOUND:
+            if opcode in GET_OPS:
+                result = Result(END)
+            elif opcode in (OP_REPLACE, OP_REPLACEQ):
+                result = Result(NOT_STORED)
+            else:
+                result = Result(NOT_FOUND)
+        elif status == STATUS_KEY_EXISTS:
+            result = Result(NOT_STORED if opcode in (OP_ADD, OP_ADDQ)
+                            else EXISTS)
+        elif status == STATUS_ITEM_NOT_STORED:
+            result = Result(NOT_STORED)
+        else:
+            result = Result(ERROR, value=bytes(value))
+
+        self._results.append(result._replace(opaque=quiet_opaque))
+
+
+class BinaryProtocol(object):
+    """
+    Memcached binary protocol engine. Binary protocol has no meta commands,
+    so `meta_get`, `meta_get_many`, `meta_set`, `meta_delete` and
+    `meta_arithmetic` raise UnsupportedCommandError with this engine, as
+    does `stats`.
+    """
+
+    parser_cls = BinaryResponseParser
+
+    def encode(self, cmd_name, cmd_args):
+        """
+        Build request packet of a single command.
+        :param cmd_name: command name like 'set' or 'get'
+        :type: str
+        :param cmd_args: dict of command arguments
+        :type: dict
+        :rtype: bytes
+        :raises: UnsupportedCommandError if there is no opcode for the
+        command
+        """
+        if cmd_name == 'flush_all':
+            return packet(OP_FLUSH)
+        return self._packet(self._opcode(cmd_name), cmd_args)
+
+    def encode_stream(self, cmd_name, cmd_args):
+        """
+        Build request packet without its value, which is sent separately.
+        Body length in the header includes `size` of the value.
+        :return: bytes sent before and after the value
+        :rtype: tuple
+        """
+        key = cmd_args['key']
+        extras = SET_EXTRAS.pack(cmd_args['flags'], cmd_args['time'])
+        header = HEADER.pack(
+            REQUEST_MAGIC, self._opcode(cmd_name), len(key), len(extras), 0, 0,
+            len(extras) + len(key) + cmd_args['size'], 0, 0)
+        return header + extras + key, b''
+
+    def encode_get_many(self, keys):
+        """
+        Build GETKQ packets for all `keys` terminated with NOOP.
+        :rtype: bytes
+        """
+        return b''.join(
+            [packet(OP_GETKQ, key) for key in keys] + [packet(OP_NOOP)])
+
+    def encode_many(self, cmd_name, cmds_args, noreply=False):
+        """
+        Build one pipeline of quiet `cmd_name` packets terminated with NOOP.
+        Position of the command is sent as opaque. Commands without quiet
+        opcode are sent as separate packets, each with its own reply.
+        :rtype: list
+        """
+        if cmd_name not in QUIET_OPCODES:
+            opcode = self._opcode(cmd_name)
+            return [self._packet(opcode, args) for args in cmds_args]
+
+        opcode = QUIET_OPCODES[cmd_name]
+        return [b''.join(
+            [self._packet(opcode, args, opaque=i)
+             for i, args in enumerate(cmds_args)] + [packet(OP_NOOP)])]
+
+    def read_options(self, noreply):
+        """
+        Return arguments of `request_many` reading replies to a pipeline.
+        Pipelines end with NOOP, so its reply is read even with `noreply`
+        to keep the connection clean.
+        :rtype: dict
+        """
+        return {}
+
+    def split_responses(self, cmd_name, responses, count):
+        """
+        Translate reply to a pipeline into `count` responses, one for each
+        command. Commands without quiet reply succeeded.
+        :rtype: list
+        """
+        if cmd_name not in QUIET_OPCODES:
+            return responses
+
+        response = responses[0] if responses else Response()
+        success = Result(SUCCESS[OPCODES[cmd_name]])
+        split = []
+
+        for i in range(count):
+            single = Response()
+            if response.status == END:
+                result = response.quiet.get(i, success)
+                single.add(result._replace(opaque=None))
+            split.append(single)
+        return split
+
+    @staticmethod
+    def _opcode(cmd_name):
+        try:
+            return OPCODES[cmd_name]
+        except KeyError:
+            raise UnsupportedCommandError(
+                '{} is not supported by binary protocol'.format(cmd_name))
+
+    @staticmethod
+    def _packet(opcode, cmd_args, opaque=0):
+        key = cmd_args['key']
+        if opcode in (OP_APPEND, OP_PREPEND):
+            # append and prepend don't take extras
+            return packet(opcode, key, value=bytes(cmd_args['value']),
+                          opaque=opaque)
+        elif opcode in STORAGE_OPS:
+            value = cmd_args['value']
+            if isinstance(value, six.text_type):
+                value = value.encode('utf-8')
+            return packet(
+                opcode, key, SET_EXTRAS.pack(cmd_args['flags'],
+                                             cmd_args['time']),
+                value, opaque=opaque, cas=cmd_args.get('cas', 0))
+        elif opcode in (OP_TOUCH, OP_GAT):
+            return packet(opcode, key, TOUCH_EXTRAS.pack(cmd_args['time']),
+                          opaque=opaque)
+        elif opcode in (OP_INCREMENT, OP_DECREMENT):
+            return packet(opcode, key, COUNTER_EXTRAS.pack(
+                cmd_args['delta'], 0, NO_AUTO_CREATE), opaque=opaque)
+        return packet(opcode, key, opaque=opaque)
@@ -0,0 +1,171 @@
+"""
+Circuit breaker tracking health of a server. It's shared by all
+connections of a pool, so once the server is known to be down, requests
+fail fast instead of waiting for connect timeout on every connection.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from collections import deque
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """
+    Opens after `failure_threshold` failures in a row or when share of
+    failures among the last `window` requests reaches `error_rate`. While
+    open, requests are refused. After `reset_timeout` one probe request is
+    let through: its success closes the breaker, its failure opens it again
+    for twice as long, up to `max_reset_timeout`.
+
+    Listeners are called on every state change with name of the breaker,
+    old and new state.
+    """
+
+    def __init__(self, name='', failure_threshold=5, error_rate=0.5,
+                 window=20, reset_timeout=1.0, max_reset_timeout=60.0,
+                 listeners=None):
+        """
+        :param name: name passed to listeners, eg. address of the server
+        :type: str
+        :param failure_threshold: failures in a row opening the breaker
+        :type: int
+        :param error_rate: share of failed requests opening the breaker,
+        None disables it
+        :type: float
+        :param window: number of last requests the error rate is computed
+        from
+        :type: int
+        :param reset_timeout: seconds before the first probe
+        :type: float
+        :param max_reset_timeout: max seconds between probes
+        :type: float
+        :param listeners: functions called on state changes
+        :type: list
+        """
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._error_rate = error_rate
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+        self._listeners = list(listeners or [])
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        # outcomes of the last requests, True for failures
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._timeout = reset_timeout
+        self._opened_at = 0
+
+    def __repr__(self):
+        return '<CircuitBreaker: {} {}>'.format(self.name, self._state)
+
+    @property
+    def state(self):
+        return self._state
+
+    def add_listener(self, listener):
+        """
+        :param listener: function of breaker name, old and new state
+        :type: callable
+        """
+        self._listeners.append(listener)
+
+    def allow(self):
+        """
+        Return True if request may be sent. When the reset timeout of open
+        breaker passes, the first caller gets True and sends the probe.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if (self._state == HALF_OPEN or
+                    time.time() < self._opened_at + self._timeout):
+                return False
+            old = self._set_state(HALF_OPEN)
+        self._notify(old, HALF_OPEN)
+        return True
+
+    def record(self, success):
+        """
+        Record outcome of an allowed request.
+        :param success: False if the server didn't respond
+        :type: bool
+        """
+        with self._lock:
+            if success:
+                old = self._on_success()
+            else:
+                old = self._on_failure()
+            new = self._state
+        if old != new:
+            self._notify(old, new)
+
+    def release(self):
+        """
+        Give up allowed request without recording its outcome, eg. when no
+        connection was free. Unfinished probe is retried after the timeout.
+        """
+        with self._lock:
+            if self._state != HALF_OPEN:
+                return
+            self._opened_at = time.time()
+            old = self._set_state(OPEN)
+        self._notify(old, OPEN)
+
+    def _on_success(self):
+        old = self._state
+        self._failures = 0
+        self._outcomes.append(False)
+        if old == HALF_OPEN:
+            self._outcomes.clear()
+            self._timeout = self._reset_timeout
+            self._set_state(CLOSED)
+        return old
+
+    def _on_failure(self):
+        old = self._state
+        self._failures += 1
+        self._outcomes.append(True)
+        if old == HALF_OPEN:
+            self._timeout = min(self._timeout * 2, self._max_reset_timeout)
+            self._open()
+        elif old == CLOSED and self._tripped():
+            self._open()
+        return old
+
+    def _tripped(self):
+        if self._failures >= self._failure_threshold:
+            return True
+        outcomes = self._outcomes
+        return (self._error_rate is not None and
+                len(outcomes) == outcomes.maxlen and
+                float(sum(outcomes)) / len(outcomes) >= self._error_rate)
+
+    def _open(self):
+        self._opened_at = time.time()
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        old = self._state
+        self._state = state
+        return old
+
+    def _notify(self, old, new):
+        logger.info('Circuit breaker {} changed from {} to {}'.format(
+            self.name, old, new))
+        for listener in self._listeners:
+            try:
+                listener(self.name, old, new)
+            except Exception as exc:
+                logger.warning('Circuit breaker listener failed: {}'.format(
+                    exc))
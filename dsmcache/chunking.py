@@ -0,0 +1,125 @@
+"""
+Chunking of values larger than the item size limit of Memcached, 1 MB by
+default. Chunks are stored under sub-keys and the key itself holds a
+manifest marked with `FLAG_CHUNKED` bit of flags.
+
+Every write uses new version in the sub-keys, so chunks of a value are
+never overwritten by a concurrent write. Values whose chunks are missing
+or don't match the checksum of the manifest are treated as misses.
+"""
+from __future__ import unicode_literals
+
+import binascii
+import hashlib
+import os
+import zlib
+from collections import namedtuple
+
+
+# Bit of flags marking manifest of a chunked value
+FLAG_CHUNKED = 1 << 9
+
+# Leaves room for the key and item header below the 1 MB limit
+DEFAULT_CHUNK_SIZE = 1000 * 1000
+
+# Longer keys are replaced with their hash in sub-keys of chunks
+MAX_BASE_KEY_LENGTH = 200
+
+
+class Manifest(namedtuple('Manifest', 'version count size checksum flags')):
+    """
+    Description of chunked value: version used in sub-keys, number of
+    chunks, size and crc32 checksum of the value and its original flags.
+    """
+
+    __slots__ = ()
+
+    def chunk_keys(self, key):
+        """
+        Return sub-keys of all chunks of the value.
+        :param key: checked key of the value
+        :type: bytes
+        :rtype: list
+        """
+        if len(key) > MAX_BASE_KEY_LENGTH:
+            key = hashlib.md5(key).hexdigest().encode('ascii')
+        return [b':'.join([key, self.version, str(i).encode('ascii')])
+                for i in range(self.count)]
+
+    def encode(self):
+        """
+        :return: manifest stored under the key of the value
+        :rtype: bytes
+        """
+        return b' '.join([self.version] + [
+            str(field).encode('ascii')
+            for field in (self.count, self.size, self.checksum)])
+
+    @classmethod
+    def decode(cls, data, flags):
+        """
+        Parse stored manifest.
+        :return: Manifest or None if data is malformed
+        :rtype: Manifest | None
+        """
+        try:
+            version, count, size, checksum = bytes(data).split(b' ')
+            return cls(version, int(count), int(size), int(checksum),
+                       flags & ~FLAG_CHUNKED)
+        except ValueError:
+            return None
+
+    def join(self, chunks):
+        """
+        Join chunks of the value in order of `chunk_keys`.
+        :param chunks: chunks or None for missing ones
+        :type: list
+        :return: value or None if chunks don't match the manifest
+        :rtype: bytes | None
+        """
+        if any(chunk is None for chunk in chunks):
+            return None
+        data = b''.join(chunks)
+        if (len(data) != self.size or
+                zlib.crc32(data) & 0xffffffff != self.checksum):
+            return None
+        return data
+
+
+class Chunker(object):
+    """
+    Splits values larger than `chunk_size` bytes into chunks.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param chunk_size: max size of stored item in bytes, keep it below
+        the item size limit of the server
+        :type: int
+        """
+        self._chunk_size = chunk_size
+
+    def split(self, key, data, flags):
+        """
+        Split serialized value into chunks.
+        :param key: checked key of the value
+        :type: bytes
+        :param data: serialized value
+        :type: bytes
+        :param flags: flags of the value
+        :type: int
+        :return: Manifest and list of (sub-key, chunk) tuples or None if
+        the value is small enough to be stored as it is
+        :rtype: tuple | None
+        """
+        size = self._chunk_size
+        if len(data) <= size:
+            return None
+
+        data = bytes(data)
+        manifest = Manifest(
+            binascii.hexlify(os.urandom(4)), (len(data) + size - 1) // size,
+            len(data), zlib.crc32(data) & 0xffffffff, flags)
+        return manifest, [
+            (chunk_key, data[i * size:(i + 1) * size])
+            for i, chunk_key in enumerate(manifest.chunk_keys(key))]
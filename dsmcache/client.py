@@ -2,78 +2,486 @@ from __future__ import unicode_literals
 
 import logging
 import re
+import time as _time
+import zlib
+from collections import OrderedDict
+from functools import partial
+from timeit import default_timer
+
 import six
 
-from .exceptions import ServerError, InvalidKeyError
-from .connection import Host
+from .exceptions import (
+    ServerError, InvalidKeyError, NoServersError, CASConflictError)
+from .binary import BinaryProtocol
+from .chunking import FLAG_CHUNKED, Manifest
+from .compression import FLAG_COMPRESSED
+from .connection import Host, FileBody
+from .counters import CounterBuffer, MAX_ATTEMPTS
+from .hashring import HashRing
+from .metrics import NULL_MEASUREMENT
 from .pool import ConnectionPool
+from .serializers import Serializer, TYPE_MASK
+from .workers import Task, WorkerPool
+from .stampede import (
+    FLAG_STAMPED, stamp, unstamp, expires_at, should_recompute, lease_key)
+from .response import (
+    ResponseParser, Result, BufferSink, FileSink, VALUE, STORED, NOT_STORED,
+    EXISTS, NOT_FOUND, DELETED, TOUCHED, NUMERIC, META_VALUE, META_MISS,
+    ERROR)
 
 
+# Commands storing data are followed by the value and `\r\n`
 METHOD_TO_TEMPLATE = {
     'get': 'get {key}\r\n',
-    'set': 'set {key} {flags} {time} {size}\r\n{value}\r\n',
-    'flush_all': 'flush_all\r\n'
+    'gets': 'gets {key}\r\n',
+    'gat': 'gat {time} {key}\r\n',
+    'gats': 'gats {time} {key}\r\n',
+    'get_many': 'get {keys}\r\n',
+    'set': 'set {key} {flags} {time} {size}{noreply}\r\n',
+    'add': 'add {key} {flags} {time} {size}{noreply}\r\n',
+    'replace': 'replace {key} {flags} {time} {size}{noreply}\r\n',
+    'append': 'append {key} {flags} {time} {size}{noreply}\r\n',
+    'prepend': 'prepend {key} {flags} {time} {size}{noreply}\r\n',
+    'cas': 'cas {key} {flags} {time} {size} {cas}{noreply}\r\n',
+    'delete': 'delete {key}{noreply}\r\n',
+    'touch': 'touch {key} {time}{noreply}\r\n',
+    'incr': 'incr {key} {delta}{noreply}\r\n',
+    'decr': 'decr {key} {delta}{noreply}\r\n',
+    'flush_all': 'flush_all\r\n',
+    # meta commands. `flags` are rendered with a leading space
+    'mg': 'mg {key}{flags}\r\n',
+    'ms': 'ms {key} {size}{flags}\r\n',
+    'md': 'md {key}{flags}\r\n',
+    'ma': 'ma {key}{flags}\r\n',
+    'mn': 'mn\r\n',
+}
+
+META_COMMANDS = frozenset(['mg', 'ms', 'md', 'ma'])
+# values of `mode` argument of `meta_set` and their `M` flags
+META_SET_MODES = {
+    'set': 'S',
+    'add': 'E',
+    'append': 'A',
+    'prepend': 'P',
+    'replace': 'R',
 }
 
-STORED_RE = re.compile(b'^STORED\r\n$')
+# Bits of flags used for value type and encoding, not available to users
+RESERVED_FLAGS = TYPE_MASK | FLAG_COMPRESSED | FLAG_CHUNKED | FLAG_STAMPED
+
 MAX_KEY_LENGTH = 250
+# Spaces and control characters end the key in the text protocol
+INVALID_KEY_CHARS = re.compile(b'[\\x00-\\x20\\x7f]')
+# Max number of keys sent in one `get` command
+MAX_GET_KEYS = 100
+# Max number of commands written to a connection before reading replies
+MAX_PIPELINE_SIZE = 1000
+# Values from this size are sent as separate buffers instead of being
+# copied into the command
+VECTORED_VALUE_SIZE = 16 * 1024
 
 logger = logging.getLogger(__name__)
 
 
-class Client(object):
+def _to_bytes(arg):
+    if isinstance(arg, six.binary_type):
+        return arg
+    if isinstance(arg, six.integer_types):
+        return str(arg).encode('ascii')
+    return arg.encode('utf-8')
+
+
+class CommandEncoder(object):
+    """
+    Renders command template straight to bytes. The template is split into
+    literal bytes and fields once, so rendering is a single join.
+    """
 
-    def __init__(self, host, pool_size=20, socket_timeout=None):
+    __slots__ = ('_head', '_fields')
+
+    def __init__(self, template):
         """
-        :param host: host/port string. Eg. '127.0.0.1:11211'
+        :param template: template like 'get {key}\\r\\n'
         :type: str
-        :param pool_size: Size of the connection pool
-        :type: int
-        :param socket_timeout:
+        """
+        parts = re.split(r'\{(\w+)\}', template)
+        self._head = parts[0].encode('ascii')
+        # fields and literals following them
+        self._fields = [
+            (field, literal.encode('ascii'))
+            for field, literal in zip(parts[1::2], parts[2::2])]
+
+    def encode(self, cmd_args):
+        """
+        :param cmd_args: dict of variables to set in template. `noreply`
+        is optional
+        :type: dict
+        :rtype: bytes
+        """
+        parts = [self._head]
+        for field, literal in self._fields:
+            if field == 'noreply':
+                parts.append(_to_bytes(cmd_args.get('noreply', b'')))
+            else:
+                parts.append(_to_bytes(cmd_args[field]))
+            parts.append(literal)
+        return b''.join(parts)
+
+
+COMMAND_ENCODERS = dict(
+    (cmd_name, CommandEncoder(template))
+    for cmd_name, template in METHOD_TO_TEMPLATE.items())
+
+
+class TextProtocol(object):
+    """
+    Memcached text protocol engine. Commands are rendered from
+    `METHOD_TO_TEMPLATE` by precompiled `COMMAND_ENCODERS`.
+    """
+
+    parser_cls = ResponseParser
+
+    def encode(self, cmd_name, cmd_args):
+        """
+        Render a single command. Value is appended as it is.
+        :param cmd_name: command name like 'set' or 'get'
+        :type: str
+        :param cmd_args: dict of variables to set in template
+        :type: dict
+        :return: command or, if its value has `VECTORED_VALUE_SIZE` bytes or
+        more, list of the head, value and `\\r\\n` to avoid copying the
+        value
+        :rtype: bytes | list
+        """
+        cmd = COMMAND_ENCODERS[cmd_name].encode(cmd_args)
+        if 'value' not in cmd_args:
+            return cmd
+        value = cmd_args['value']
+        if len(value) >= VECTORED_VALUE_SIZE:
+            return [cmd, value, b'\r\n']
+        return b''.join([cmd, value, b'\r\n'])
+
+    def encode_stream(self, cmd_name, cmd_args):
+        """
+        Render storage command without its value, which is sent separately.
+        :param cmd_args: dict of variables to set in template, with `size`
+        of the value
+        :type: dict
+        :return: bytes sent before and after the value
+        :rtype: tuple
+        """
+        return COMMAND_ENCODERS[cmd_name].encode(cmd_args), b'\r\n'
+
+    def encode_get_many(self, keys):
+        """
+        Render one `get` command for all `keys`.
+        :rtype: bytes
+        """
+        return self.encode('get_many', {'keys': b' '.join(keys)})
+
+    def encode_many(self, cmd_name, cmds_args, noreply=False):
+        """
+        Render `cmd_name` command for each of `cmds_args`. Commands sent
+        with `noreply` are followed by `mn`, whose reply ends the pipeline.
+        :rtype: list
+        """
+        if not noreply:
+            return [self.encode(cmd_name, args) for args in cmds_args]
+        return [self.encode(cmd_name, dict(args, noreply=b' noreply'))
+                for args in cmds_args] + [self.encode('mn', {})]
+
+    def read_options(self, noreply):
+        """
+        Return arguments of `request_many` reading replies to a pipeline.
+        Memcached still answers some failed `noreply` commands with errors,
+        so they are read up to the reply of the final `mn` instead of being
+        left in the connection.
+        :rtype: dict
+        """
+        return {'quiet': noreply}
+
+    def split_responses(self, cmd_name, responses, count):
+        """
+        Return one response for each of `count` pipelined commands.
+        """
+        return responses
+
+
+class BaseClient(object):
+    """
+    Protocol logic shared by blocking and asyncio clients: key validation,
+    command rendering and response parsing. Subclasses do the I/O.
+    """
+
+    _pool = None
+    _near_cache = None
+    _serializer = Serializer()
+    _compressor = None
+    _metrics = None
+    _chunker = None
+    _single_flight = None
+    _counter_buffers = ()
+    _workers = None
+
+    @staticmethod
+    def _make_protocol(protocol):
+        """
+        Return protocol engine for given name or engine instance.
+        :param protocol: 'text', 'binary' or protocol engine
+        """
+        if isinstance(protocol, six.string_types):
+            try:
+                return PROTOCOLS[protocol]()
+            except KeyError:
+                raise ValueError('Unknown protocol: {}'.format(protocol))
+        return protocol
+
+    def _init_options(self, protocol='text', near_cache=None,
+                      serializer=None, compressor=None, metrics=None,
+                      chunker=None, single_flight=None):
+        """
+        Set up options shared by all clients. See `Client` for arguments.
+        """
+        self._protocol = self._make_protocol(protocol)
+        self._near_cache = near_cache
+        self._serializer = serializer or Serializer()
+        self._compressor = compressor
+        self._metrics = metrics
+        self._chunker = chunker
+        self._single_flight = single_flight
+        self._counter_buffers = []
+
+    @property
+    def _pools(self):
+        return [self._pool] if self._pool is not None else []
+
+    @property
+    def metrics(self):
+        """
+        Metrics instance or None if metrics are disabled
+        """
+        return self._metrics
+
+    def _measure(self, cmd_name, key=None):
+        """
+        Return context manager measuring the command.
+        """
+        if self._metrics is None:
+            return NULL_MEASUREMENT
+        return self._metrics.measure(cmd_name, key)
+
+    def _get_pool(self, key):
+        """
+        Return connection pool responsible for given key.
+        :param key: checked key or None for commands without a key
+        :rtype: ConnectionPool
+        """
+        return self._pool
+
+    def _group_by_pool(self, items, key=None):
+        """
+        Group items by connection pool responsible for their keys.
+        :param items: checked keys or other items
+        :type: list
+        :param key: function returning checked key of an item
+        :type: callable
+        :return: dict of pools and lists of their items
+        :rtype: OrderedDict
+        """
+        groups = OrderedDict()
+        for item in items:
+            pool = self._get_pool(key(item) if key else item)
+            groups.setdefault(pool, []).append(item)
+        return groups
+
+    def _set_args(self, key, value, time, flags):
+        """
+        Return template variables of `set` command. Value is serialized
+        and its type is added to `flags`.
+        :rtype: dict
+        """
+        data, flags = self._encode_value(value, flags)
+        return dict(key=self._check_key(key), value=data, flags=flags,
+                    time=time, size=len(data))
+
+    def _encode_value(self, value, flags=0):
+        """
+        Serialize and optionally compress the value.
+        :param flags: user flags stored with the value
         :type: int
+        :return: data and flags to store
+        :rtype: tuple
         """
+        self._check_flags(flags)
+        data, type_flags = self._serializer.serialize(value)
+        flags |= type_flags
+        if self._compressor is not None:
+            data, flags = self._compressor.compress(data, flags)
+        return data, flags
 
-        self._pool = ConnectionPool(Host(host), pool_size=pool_size,
-                                    timeout=socket_timeout)
+    def _get_many_requests(self, keys):
+        """
+        Prepare pipelined `get` commands for `keys`. Keys are split into
+        batches of `MAX_GET_KEYS`.
+        :param keys: keys to fetch
+        :type: list
+        :return: dict of checked keys and original keys, list of
+        (pool, commands) tuples
+        :rtype: tuple
+        """
+        checked = {}
+        for key in keys:
+            checked[self._check_key(key)] = key
 
-    def __del__(self):
-        self.disconnect()
+        requests = []
+        for pool, pool_keys in self._group_by_pool(list(checked)).items():
+            requests.append((pool, [
+                self._protocol.encode_get_many(batch)
+                for batch in self._batches(pool_keys, MAX_GET_KEYS)
+            ]))
+        return checked, requests
 
-    def get(self, key):
+    def _get_many_result(self, checked, responses):
         """
-        Get data for given key from Memcached.
-        :param key: key to fetch
+        Merge responses to pipelined `get` commands.
+        :param checked: dict of checked keys and original keys
+        :type: dict
+        :param responses: list of Response instances
+        :type: list
+        :return: dict of found keys and their values
+        :rtype: dict
+        """
+        result = {}
+        for response in responses:
+            for key, value in self._parse_response(
+                    'get_many', response).items():
+                if key in checked:
+                    result[checked[key]] = value
+        return result
+
+    def _many_requests(self, cmd_name, cmds_args, noreply=False):
+        """
+        Prepare pipelines of `cmd_name` commands, `MAX_PIPELINE_SIZE` each.
+        :param cmd_name: command name like 'set' or 'delete'
         :type: str
+        :param cmds_args: list of dicts of variables to set in template
+        :type: list
+        :param noreply: render commands with `noreply` option
+        :type: bool
+        :return: list of (pool, positions in `cmds_args`, commands) tuples
+        :rtype: list
         """
-        return self._send_cmd('get', key=self._check_key(key))
+        requests = []
+        groups = self._group_by_pool(
+            range(len(cmds_args)), key=lambda i: cmds_args[i]['key'])
 
-    def set(self, key, value, time=0, flags=0):
+        for pool, positions in groups.items():
+            for batch in self._batches(positions, MAX_PIPELINE_SIZE):
+                requests.append((pool, batch, self._protocol.encode_many(
+                    cmd_name, [cmds_args[i] for i in batch], noreply)))
+        return requests
+
+    def _parse_responses(self, cmd_name, responses, count, noreply=False):
         """
-        Store data in Memcached.
-        :param key:
-        :param value:
-        :param time: TTL. If 0 then cache forever
-        :param flags:
+        Parse responses to pipelined commands. Server errors are reported
+        as failed results instead of being raised.
+        :param cmd_name: command name
+        :type: str
+        :param responses: list of Response instances
+        :type: list
+        :param count: number of pipelined commands
+        :type: int
+        :param noreply: commands were sent with `noreply`. Errors can't be
+        matched to the commands then, so they are only logged
+        :type: bool
+        :return: list of `count` results
+        :rtype: list
         """
+        if noreply:
+            for response in responses:
+                for result in response.quiet.values():
+                    if result.type == ERROR:
+                        logger.debug('{} failed: {}'.format(
+                            cmd_name, result.value))
+            return [True] * count
 
-        return self._send_cmd(
-                'set', key=self._check_key(key), value=value, flags=flags,
-                time=time, size=len(value))
+        responses = self._protocol.split_responses(
+            cmd_name, responses, count)
+        results = []
+        for response in responses:
+            try:
+                results.append(self._parse_response(cmd_name, response))
+            except ServerError as exc:
+                logger.debug('{} failed: {}'.format(cmd_name, exc))
+                results.append(False)
+        return results
 
-    def flush_all(self):
-        return self._send_cmd('flush_all')
+    @staticmethod
+    def _meta_args(key, flags, **kwargs):
+        """
+        Return template variables of meta command.
+        :param key: checked key
+        :param flags: meta flags. Eg. ['v', 'T30']
+        :type: list
+        :rtype: dict
+        """
+        return dict(kwargs, key=key,
+                    flags=''.join(' ' + flag for flag in flags))
 
-    def stats(self):
-        return self._send_cmd('stats items')
+    @staticmethod
+    def _meta_get_flags(value=True, ttl=False, cas=False, hit=False,
+                        last_access=False, touch=None, vivify=None,
+                        recache=None):
+        """
+        Return flags of `mg` command. See `Client.meta_get`.
+        :rtype: list
+        """
+        flags = ['f']
+        for name, enabled in (('v', value), ('t', ttl), ('c', cas),
+                              ('h', hit), ('l', last_access)):
+            if enabled:
+                flags.append(name)
+        for name, seconds in (('T', touch), ('N', vivify), ('R', recache)):
+            if seconds is not None:
+                flags.append('{}{}'.format(name, seconds))
+        return flags
 
-    def disconnect(self):
-        logger.info('Disconnecting connection pool')
-        self._pool.close()
+    def _cached_many(self, keys):
+        """
+        Return values of `keys` found in the near cache.
+        :rtype: dict
+        """
+        cached = {}
+        if self._near_cache is not None:
+            for key in keys:
+                value = self._near_cache.get(self._check_key(key))
+                if value is not None:
+                    cached[key] = value
+        return cached
 
-    def _send_cmd(self, cmd_name, **kwargs):
-        cmd = self._parse_cmd(cmd_name, kwargs)
-        response = self._pool.request(cmd.encode('utf-8'))
-        return self._parse_response(cmd_name, response)
+    def _cache_many(self, values, time=0):
+        """
+        Store fetched or stored `values` in the near cache.
+        :param values: dict of keys and their values
+        :type: dict
+        :param time: Memcached TTL of the values, if known
+        :type: int
+        """
+        if self._near_cache is not None:
+            for key, value in values.items():
+                self._near_cache.set(self._check_key(key), value, time)
+
+    def _invalidate(self, keys):
+        """
+        Drop checked `keys` from the near cache.
+        """
+        if self._near_cache is not None:
+            for key in keys:
+                self._near_cache.delete(key)
+
+    @staticmethod
+    def _failed_keys(keys, results):
+        return [key for key, ok in zip(keys, results) if not ok]
 
     @staticmethod
     def _check_key(key):
@@ -88,29 +496,44 @@ class Client(object):
             except UnicodeEncodeError:
                 raise InvalidKeyError('No ascii key: {}'.format(key))
 
-        if b' ' in key:
-            raise InvalidKeyError('Spaces in key are not allowed')
-
         if len(key) > MAX_KEY_LENGTH:
             raise InvalidKeyError(
                     'Max key length is {}'.format(MAX_KEY_LENGTH))
+
+        invalid = INVALID_KEY_CHARS.search(key)
+        if invalid is not None:
+            if invalid.group() == b' ':
+                raise InvalidKeyError('Spaces in key are not allowed')
+            raise InvalidKeyError(
+                'Control characters in key are not allowed')
         return key
 
     @staticmethod
-    def _parse_cmd(cmd_name, cmd_args):
+    def _check_flags(flags):
         """
-        Prepare command to be send to Memcached.
-        :param cmd_name: command name like 'set' or 'get'
-        :type: str
-        :param cmd_args: dict of variables to set in template
-        :type: dict
-        :return: Parsed command
-        :rtype: str
+        Check that user flags don't overlap `RESERVED_FLAGS`.
+        :type: int
+        :raises: ValueError
         """
-        return METHOD_TO_TEMPLATE[cmd_name].format(**cmd_args)
+        if flags & RESERVED_FLAGS:
+            raise ValueError(
+                'Flags {} overlap bits reserved for value type and encoding, '
+                'use bits {} and above'.format(
+                    flags, RESERVED_FLAGS.bit_length()))
 
     @staticmethod
-    def _parse_response(cmd_name, response):
+    def _batches(items, size):
+        """
+        Split `items` into lists of at most `size` elements.
+        :param items: list to split
+        :type: list
+        :param size: max length of a batch
+        :type: int
+        :rtype: list
+        """
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _parse_response(self, cmd_name, response):
         """
         Parse response and return result or raise Server error.
         :param cmd_name: command name
@@ -122,10 +545,1129 @@ class Client(object):
         """
 
         if not response.is_valid():
-            raise ServerError(response.content)
+            raise ServerError(response.error)
+
+        if cmd_name in ('get', 'gat'):
+            for result in response.values.values():
+                return self._decode_value(result)
+        elif cmd_name in ('gets', 'gats'):
+            for result in response.values.values():
+                return self._decode_value(result), result.cas
+            return None, None
+        elif cmd_name == 'get_many':
+            return self._decode_many(response.values)
+        elif cmd_name in ('set', 'add', 'replace', 'append', 'prepend'):
+            return response.status == STORED
+        elif cmd_name == 'cas':
+            if response.status == NOT_FOUND:
+                return None
+            return response.status == STORED
+        elif cmd_name in ('incr', 'decr'):
+            if response.status == NUMERIC:
+                return response.result.value
+        elif cmd_name == 'delete':
+            return response.status == DELETED
+        elif cmd_name == 'touch':
+            return response.status == TOUCHED
+        elif cmd_name in META_COMMANDS:
+            return self._parse_meta_result(cmd_name, response.result)
+        elif cmd_name == 'mg_many':
+            return dict(
+                (opaque, self._parse_meta_result('mg', result))
+                for opaque, result in response.quiet.items())
+
+    def _decode_many(self, results):
+        """
+        Decode values of many keys. Values which can't be decoded are
+        logged and skipped, so they don't fail the other keys. Manifests
+        which can't be used, eg. without a chunker, are skipped as misses.
+        :param results: dict of keys and Result instances
+        :type: dict
+        :rtype: dict
+        """
+        values = {}
+        for key, result in results.items():
+            try:
+                value = self._decode_value(result)
+            except Exception as exc:
+                logger.warning('Decoding value of {} failed: {}'.format(
+                    key, exc))
+                continue
+            if value is None and result.flags & FLAG_CHUNKED:
+                continue
+            values[key] = value
+        return values
+
+    def _parse_meta_result(self, cmd_name, result):
+        """
+        Decode value of meta command result.
+        :rtype: Result | None
+        """
+        if result is None or result.type == META_MISS:
+            return None
+        if result.type == META_VALUE:
+            if cmd_name == 'ma':
+                value = int(result.value)
+            else:
+                value = self._decode_value(result)
+            result = result._replace(value=value)
+        return result._replace(opaque=None)
+
+    def _decode_value(self, result):
+        """
+        Decompress and deserialize value of the result using its flags.
+        Manifests of chunked values are returned as Manifest instances, or
+        None if chunking is disabled.
+        """
+        data, flags = result.value, result.flags
+        if flags & FLAG_CHUNKED:
+            if self._chunker is None:
+                return None
+            return Manifest.decode(data, flags)
+        if flags & FLAG_STAMPED:
+            data, flags, _, _ = unstamp(data, flags)
+        if flags & FLAG_COMPRESSED:
+            if self._compressor is not None:
+                data, flags = self._compressor.decompress(data, flags)
+            else:
+                data, flags = zlib.decompress(data), flags & ~FLAG_COMPRESSED
+        return self._serializer.deserialize(data, flags)
+
+
+PROTOCOLS = {
+    'text': TextProtocol,
+    'binary': BinaryProtocol,
+}
+
+
+class Client(BaseClient):
+
+    def __init__(self, host, pool_size=20, socket_timeout=None,
+                 protocol='text', near_cache=None, pool_options=None,
+                 serializer=None, compressor=None, metrics=None,
+                 chunker=None, single_flight=None):
+        """
+        :param host: host/port string. Eg. '127.0.0.1:11211'
+        :type: str
+        :param pool_size: Max size of the connection pool
+        :type: int
+        :param socket_timeout:
+        :type: int
+        :param protocol: 'text', 'binary' or protocol engine instance
+        :param near_cache: local cache of fetched values. Values stored by
+        this client replace cached ones until their TTL, other writes
+        invalidate them
+        :type: NearCache
+        :param pool_options: other ConnectionPool arguments, eg. `min_idle`,
+        `max_idle_time`, `block`, `prewarm`, `connect_timeout` or
+        `transport`
+        :type: dict
+        :param serializer: converts values to bytes and back, using flags
+        to record value type
+        :type: Serializer
+        :param compressor: compresses large values, disabled by default
+        :type: Compressor
+        :param metrics: collects latencies and counters of requests
+        :type: Metrics
+        :param chunker: splits values larger than the item size limit into
+        chunks, disabled by default
+        :type: Chunker
+        :param single_flight: coalesces concurrent `get` requests of the
+        same key, disabled by default
+        :type: SingleFlight
+        """
+        self._init_options(protocol, near_cache, serializer, compressor,
+                           metrics, chunker, single_flight)
+        self._pool = ConnectionPool(Host(host), max_size=pool_size,
+                                    timeout=socket_timeout,
+                                    parser_cls=self._protocol.parser_cls,
+                                    metrics=metrics, **(pool_options or {}))
+
+    def __del__(self):
+        self.disconnect()
+
+    def get(self, key):
+        """
+        Get data for given key from Memcached.
+        :param key: key to fetch
+        :type: str
+        """
+        key = self._check_key(key)
+        if self._near_cache is None:
+            return self._get(key)
+
+        value = self._near_cache.get(key)
+        if value is None:
+            value = self._get(key)
+            if value is not None:
+                self._near_cache.set(key, value)
+        return value
+
+    def gets(self, key):
+        """
+        Get data for given key with its CAS unique, used by `cas`.
+        :param key: key to fetch
+        :return: value and CAS unique, (None, None) if key was not found
+        :rtype: tuple
+        """
+        key = self._check_key(key)
+        value, cas = self._send_cmd('gets', key=key)
+        if isinstance(value, Manifest):
+            value = self._get_chunked({key: value}).get(key)
+            if value is None:
+                cas = None
+        return value, cas
+
+    def gat(self, key, time=0):
+        """
+        Get data for given key and update its TTL.
+        :param key: key to fetch
+        :param time: new TTL. If 0 then cache forever
+        """
+        key = self._check_key(key)
+        value = self._send_cmd('gat', key=key, time=time)
+        if isinstance(value, Manifest):
+            value = self._get_chunked({key: value}).get(key)
+        return value
+
+    def gats(self, key, time=0):
+        """
+        Get data for given key with its CAS unique and update its TTL.
+        :return: value and CAS unique, (None, None) if key was not found
+        :rtype: tuple
+        """
+        key = self._check_key(key)
+        value, cas = self._send_cmd('gats', key=key, time=time)
+        if isinstance(value, Manifest):
+            value = self._get_chunked({key: value}).get(key)
+            if value is None:
+                cas = None
+        return value, cas
+
+    def _get(self, key):
+        if self._single_flight is None:
+            value = self._send_cmd('get', key=key)
+        else:
+            value = self._get_coalesced(key)
+        if isinstance(value, Manifest):
+            value = self._get_chunked({key: value}).get(key)
+        return value
+
+    def get_many(self, keys):
+        """
+        Get data for multiple keys from Memcached in a single round trip.
+        Keys are split into batches of `MAX_GET_KEYS` and all the batches
+        are pipelined through one connection.
+        :param keys: keys to fetch
+        :type: list
+        :return: dict of found keys and their values
+        :rtype: dict
+        """
+        keys = list(keys)
+        cached = self._cached_many(keys)
+        checked, requests = self._get_many_requests(
+            [key for key in keys if key not in cached])
+
+        responses = []
+        with self._measure('get_many'):
+            for pool_responses in self._request_all(requests):
+                responses.extend(pool_responses or [])
+        result = self._get_chunked(self._get_many_result(checked, responses))
+        self._cache_many(result)
+        result.update(cached)
+        return result
+
+    def set(self, key, value, time=0, flags=0):
+        """
+        Store data in Memcached.
+        :param key:
+        :param value:
+        :param time: TTL. If 0 then cache forever
+        :param flags: user flags, bits 11 and above
+        """
+        return self._store(
+            'set', self._set_args(key, value, time, flags), value)
+
+    def add(self, key, value, time=0, flags=0):
+        """
+        Store data in Memcached only if the key doesn't exist yet.
+        :param key:
+        :param value:
+        :param time: TTL. If 0 then cache forever
+        :param flags: user flags, bits 11 and above
+        :return: True if value was stored
+        """
+        return self._store(
+            'add', self._set_args(key, value, time, flags), value)
+
+    def replace(self, key, value, time=0, flags=0):
+        """
+        Store data in Memcached only if the key already exists.
+        :return: True if value was stored
+        """
+        return self._store(
+            'replace', self._set_args(key, value, time, flags), value)
+
+    def append(self, key, value):
+        """
+        Append data to the existing value. Value is serialized, but not
+        compressed or chunked, so use it with bytes or text only.
+        :return: True if value was stored
+        """
+        return self._concat('append', key, value)
+
+    def prepend(self, key, value):
+        """
+        Prepend data to the existing value. See `append`.
+        :return: True if value was stored
+        """
+        return self._concat('prepend', key, value)
+
+    def cas(self, key, value, cas, time=0, flags=0):
+        """
+        Store data only if it was not changed since it was fetched with
+        `gets`.
+        :param cas: CAS unique returned by `gets`
+        :type: int
+        :return: True if value was stored, False if it was changed
+        meanwhile and None if key was not found
+        """
+        cmd_args = self._set_args(key, value, time, flags)
+        cmd_args['cas'] = cas
+        return self._store('cas', cmd_args, value)
+
+    def cas_update(self, key, fn, retries=10, time=0, flags=0):
+        """
+        Update value atomically. The current value is passed to `fn` and
+        its result is stored with `cas`, or `add` if key doesn't exist.
+        When the value was changed meanwhile, it's fetched again and `fn`
+        is retried, so every attempt takes two round trips.
+        :param key:
+        :param fn: function of the current value or None, returning new
+        value
+        :type: callable
+        :param retries: max number of retries after a conflict
+        :type: int
+        :param time: TTL. If 0 then cache forever
+        :param flags: user flags, bits 11 and above
+        :return: stored value
+        :raises: CASConflictError if all retries failed
+        """
+        for _ in range(retries + 1):
+            value, cas = self.gets(key)
+            value = fn(value)
+            if cas is None:
+                stored = self.add(key, value, time, flags)
+            else:
+                stored = self.cas(key, value, cas, time, flags)
+            if stored:
+                return value
+        raise CASConflictError(
+            'Value changed during {} attempts'.format(retries + 1))
+
+    def get_or_set(self, key, producer, time=0, beta=1.0, stale_time=0,
+                   lease_time=10, poll_interval=0.05):
+        """
+        Get value of given key or compute it with `producer` and store it.
+        Only one caller in the cluster, holder of a lease, computes the
+        value. Others get the current value if there is one, otherwise they
+        poll for the computed value until `lease_time` passes and then call
+        `producer` themselves.
+
+        Values are recomputed before their TTL passes with probability
+        growing as it approaches (XFetch), and are kept `stale_time`
+        seconds after it, so callers get the old value while a new one is
+        computed.
+        :param key:
+        :param producer: function without arguments returning the value
+        :type: callable
+        :param time: TTL. If 0 then cache forever
+        :param beta: eagerness of early recomputation, 0 disables it
+        :type: float
+        :param stale_time: seconds the value is kept after TTL
+        :type: int
+        :param lease_time: max time of computing the value in seconds
+        :type: int
+        :param poll_interval: seconds between polls for the value
+        :type: float
+        :return: value
+        """
+        key = self._check_key(key)
+        with self._measure('get_or_set', key):
+            found, value, delta, expiry = self._get_stamped(key)
+            if found and not should_recompute(delta, expiry, beta):
+                return value
+
+            status = self._acquire_lease(key, lease_time)
+            if status == STORED:
+                try:
+                    if not found:
+                        # previous lease holder could store it meanwhile
+                        found, value, _, _ = self._get_stamped(key)
+                        if found:
+                            return value
+                    return self._recompute(key, producer, time, stale_time)
+                finally:
+                    self.delete(lease_key(key))
+            if found:
+                return value
+
+            if status in (NOT_STORED, EXISTS):
+                deadline = default_timer() + lease_time
+                while default_timer() < deadline:
+                    _time.sleep(poll_interval)
+                    found, value, _, _ = self._get_stamped(key)
+                    if found:
+                        return value
+            # lease holder didn't make it or the server is unavailable
+            return producer()
+
+    def set_many(self, mapping, time=0, flags=0, noreply=False):
+        """
+        Store multiple values in Memcached. Commands are pipelined, so the
+        whole mapping is written before any reply is read.
+        :param mapping: dict of keys and values to store
+        :type: dict
+        :param time: TTL. If 0 then cache forever
+        :param flags: user flags, bits 11 and above
+        :param noreply: do not wait for replies to single commands. The
+        text protocol still reads errors up to the reply of a final `mn`,
+        which needs Memcached 1.6 or newer
+        :type: bool
+        :return: list of keys which were not stored
+        :rtype: list
+        """
+        keys = list(mapping)
+        cmds_args = [self._set_args(key, mapping[key], time, flags)
+                     for key in keys]
+        self._invalidate([args['key'] for args in cmds_args])
+        cmds_args = self._set_chunks(cmds_args, noreply=noreply)
+
+        # values whose chunks were not stored are failed already
+        stored = iter(self._send_many(
+            'set', [args for args in cmds_args if args is not None],
+            noreply=noreply))
+        results = [args is not None and next(stored) for args in cmds_args]
+        self._delete_chunks([args for args, result in zip(cmds_args, results)
+                             if args is not None and not result])
+        if not noreply:
+            self._cache_many(dict(
+                (key, mapping[key]) for key, result in zip(keys, results)
+                if result), time)
+        return self._failed_keys(keys, results)
+
+    def get_into(self, key, target):
+        """
+        Receive value of given key directly into a writable buffer or a
+        file object, without loading it whole into memory. Stored bytes are
+        returned as they are, so the value isn't deserialized or
+        decompressed.
+        :param key: key to fetch
+        :type: str
+        :param target: writable buffer, eg. bytearray, or file object
+        opened for writing in binary mode
+        :return: number of bytes of the value or None if key was not found
+        :rtype: int | None
+        :raises: ValueError if the value doesn't fit into the buffer or is
+        stored chunked, compressed or stamped, so its bytes aren't the
+        value. Content of `target` is undefined then
+        """
+        key = self._check_key(key)
+        if hasattr(target, 'write'):
+            sink = FileSink(target)
+        else:
+            sink = BufferSink(target)
+
+        cmd = self._protocol.encode('get', {'key': key})
+        with self._measure('get_into', key):
+            response = self._get_pool(key).request(cmd, sink=sink)
+        if not response.is_valid():
+            raise ServerError(response.error)
+
+        for result in response.values.values():
+            if result.value is None:
+                raise ValueError('Value is larger than the buffer')
+            if result.flags & (FLAG_CHUNKED | FLAG_COMPRESSED | FLAG_STAMPED):
+                raise ValueError(
+                    'Value is chunked, compressed or stamped, flags: '
+                    '{}'.format(result.flags))
+            return result.value
+
+    def set_from(self, key, file_obj, size, time=0, flags=0):
+        """
+        Store `size` bytes read from a file object, sending them in chunks
+        without loading the whole value into memory. Data is stored as it
+        is, without serialization or compression.
+        :param key:
+        :param file_obj: file object opened for reading in binary mode
+        :param size: number of bytes to store
+        :type: int
+        :param time: TTL. If 0 then cache forever
+        :param flags: user flags, bits 11 and above
+        :raises: ValueError if the file is shorter than `size`
+        """
+        self._check_flags(flags)
+        key = self._check_key(key)
+        self._invalidate([key])
+        head, tail = self._protocol.encode_stream('set', dict(
+            key=key, flags=flags, time=time, size=size))
+        with self._measure('set_from', key):
+            response = self._request(
+                'set_from', key, [head, FileBody(file_obj, size), tail])
+        return self._parse_response('set', response)
+
+    def delete(self, key):
+        """
+        Delete given key from Memcached.
+        :param key: key to delete
+        :return: True if key was deleted
+        """
+        key = self._check_key(key)
+        self._invalidate([key])
+        return self._send_cmd('delete', key=key)
+
+    def delete_many(self, keys, noreply=False):
+        """
+        Delete multiple keys from Memcached using pipelined commands.
+        :param keys: keys to delete
+        :type: list
+        :param noreply: do not wait for replies to single commands. The
+        text protocol still reads errors up to the reply of a final `mn`,
+        which needs Memcached 1.6 or newer
+        :type: bool
+        :return: list of keys which were not deleted
+        :rtype: list
+        """
+        keys = list(keys)
+        cmds_args = [dict(key=self._check_key(key)) for key in keys]
+        self._invalidate([args['key'] for args in cmds_args])
+        results = self._send_many('delete', cmds_args, noreply=noreply)
+        return self._failed_keys(keys, results)
+
+    def touch(self, key, time=0):
+        """
+        Update TTL of given key.
+        :param key: key to touch
+        :param time: new TTL. If 0 then cache forever
+        :return: True if key was touched
+        """
+        return self._send_cmd('touch', key=self._check_key(key), time=time)
+
+    def incr(self, key, delta=1):
+        """
+        Increment counter stored as decimal digits, eg. an integer value.
+        :param key:
+        :param delta: non-negative number to add
+        :type: int
+        :return: new value or None if key was not found
+        :rtype: int | None
+        """
+        key = self._check_key(key)
+        self._invalidate([key])
+        return self._send_cmd('incr', key=key, delta=delta)
+
+    def decr(self, key, delta=1):
+        """
+        Decrement counter. Memcached never decrements it below 0.
+        :return: new value or None if key was not found
+        :rtype: int | None
+        """
+        key = self._check_key(key)
+        self._invalidate([key])
+        return self._send_cmd('decr', key=key, delta=delta)
+
+    def counter_buffer(self, max_delay=1.0, max_keys=1000, time=0,
+                       max_attempts=MAX_ATTEMPTS):
+        """
+        Create buffer aggregating counter updates locally and sending them
+        in batches. Buffers are flushed and closed on `disconnect`.
+        :param max_delay: max seconds an update stays in the buffer
+        :type: float
+        :param max_keys: number of pending keys which triggers a flush
+        :type: int
+        :param time: TTL of created counters. If 0 then cache forever
+        :type: int
+        :param max_attempts: number of flushes in which the server may
+        reject a delta before it's dropped
+        :type: int
+        :rtype: CounterBuffer
+        """
+        buffer = CounterBuffer(self, max_delay=max_delay, max_keys=max_keys,
+                               time=time, max_attempts=max_attempts)
+        self._counter_buffers.append(buffer)
+        return buffer
+
+    def touch_many(self, keys, time=0, noreply=False):
+        """
+        Update TTL of multiple keys using pipelined commands.
+        :param keys: keys to touch
+        :type: list
+        :param time: new TTL. If 0 then cache forever
+        :param noreply: do not wait for replies to single commands. The
+        text protocol still reads errors up to the reply of a final `mn`,
+        which needs Memcached 1.6 or newer
+        :type: bool
+        :return: list of keys which were not touched
+        :rtype: list
+        """
+        keys = list(keys)
+        results = self._send_many('touch', [
+            dict(key=self._check_key(key), time=time) for key in keys
+        ], noreply=noreply)
+        return self._failed_keys(keys, results)
+
+    def meta_get(self, key, value=True, ttl=False, cas=False, hit=False,
+                 last_access=False, touch=None, vivify=None, recache=None):
+        """
+        Get item using meta command `mg`. Only requested fields are
+        returned by the server.
+        :param key: key to fetch
+        :param value: return value of the item
+        :param ttl: return remaining TTL as `meta['t']`, -1 if infinite
+        :param cas: return CAS unique
+        :param hit: return `meta['h']`, 1 if item was fetched before
+        :param last_access: return seconds since last access as `meta['l']`
+        :param touch: update TTL of the item
+        :param vivify: on miss create empty item with this TTL. Only one
+        client gets `meta['W']` (win) flag and should recache the item
+        :param recache: give win flag if remaining TTL is below this value
+        :return: Result with `value`, `flags`, `cas` and all returned flags
+        in `meta`. Stale items have `meta['X']` set and `meta['Z']` means
+        that win flag was already sent to another client. None on miss.
+        With `value` and `ttl`, values which aren't stale are stored in the
+        near cache for at most their remaining TTL.
+        :rtype: Result | None
+        :raises: UnsupportedCommandError with binary protocol
+        """
+        flags = self._meta_get_flags(value, ttl, cas, hit, last_access,
+                                     touch, vivify, recache)
+        key = self._check_key(key)
+        result = self._send_cmd('mg', **self._meta_args(key, flags))
+        if (value and ttl and result is not None and
+                result.type == META_VALUE and 'X' not in result.meta and
+                not isinstance(result.value, Manifest)):
+            remaining = result.meta.get('t', 0)
+            if remaining:
+                # -1 means the item never expires
+                self._cache_many({key: result.value}, max(remaining, 0))
+        return result
+
+    def meta_get_many(self, keys, **kwargs):
+        """
+        Get multiple items using quiet `mg` commands terminated with `mn`.
+        Misses are not sent by the server and hits are matched to keys by
+        opaque tokens.
+        :param keys: keys to fetch
+        :type: list
+        :param kwargs: flags of `meta_get`
+        :return: dict of found keys and their results
+        :rtype: dict
+        :raises: UnsupportedCommandError with binary protocol
+        """
+        keys = list(keys)
+        checked = [self._check_key(key) for key in keys]
+        flags = self._meta_get_flags(**kwargs) + ['q']
+        results = {}
+
+        for pool, positions in self._group_by_pool(
+                range(len(keys)), key=lambda i: checked[i]).items():
+            for batch in self._batches(positions, MAX_PIPELINE_SIZE):
+                cmd = b''.join([
+                    self._protocol.encode('mg', self._meta_args(
+                        checked[i], flags + ['O{}'.format(i)]))
+                    for i in batch
+                ] + [self._protocol.encode('mn', {})])
+                with self._measure('mg_many'):
+                    response = pool.request(cmd)
+                for i, result in self._parse_response(
+                        'mg_many', response).items():
+                    if result is not None:
+                        results[keys[i]] = result
+        return results
+
+    def meta_set(self, key, value, time=0, flags=0, mode='set', cas=None,
+                 invalidate=False, return_cas=False):
+        """
+        Store data using meta command `ms`.
+        :param key:
+        :param value:
+        :param time: TTL. If 0 then cache forever
+        :param flags: user flags, bits 11 and above
+        :param mode: one of 'set', 'add', 'append', 'prepend', 'replace'
+        :param cas: store only if CAS unique of the item matches
+        :param invalidate: with `cas`, store older CAS as a stale item
+        :param return_cas: return CAS unique of stored item
+        :return: Result of type META_OK if stored, NOT_STORED, EXISTS on
+        CAS mismatch or NOT_FOUND
+        :rtype: Result
+        :raises: UnsupportedCommandError with binary protocol
+        """
+        try:
+            mode = META_SET_MODES[mode]
+        except KeyError:
+            raise ValueError('Unknown mode: {}'.format(mode))
+
+        data, flags = self._encode_value(value, flags)
+        meta_flags = ['T{}'.format(time), 'F{}'.format(flags), 'M' + mode]
+        if cas is not None:
+            meta_flags.append('C{}'.format(cas))
+        if invalidate:
+            meta_flags.append('I')
+        if return_cas:
+            meta_flags.append('c')
+        key = self._check_key(key)
+        self._invalidate([key])
+        return self._send_cmd('ms', **self._meta_args(
+            key, meta_flags, value=data, size=len(data)))
+
+    def meta_delete(self, key, cas=None, invalidate=False, time=None):
+        """
+        Delete item using meta command `md`.
+        :param key: key to delete
+        :param cas: delete only if CAS unique of the item matches
+        :param invalidate: mark item as stale instead of deleting it, so
+        `meta_get` returns it with win flag to one client only
+        :param time: new TTL of invalidated item
+        :return: Result of type META_OK if deleted, NOT_FOUND or EXISTS
+        :rtype: Result
+        :raises: UnsupportedCommandError with binary protocol
+        """
+        flags = []
+        if cas is not None:
+            flags.append('C{}'.format(cas))
+        if invalidate:
+            flags.append('I')
+        if time is not None:
+            flags.append('T{}'.format(time))
+        key = self._check_key(key)
+        self._invalidate([key])
+        return self._send_cmd('md', **self._meta_args(key, flags))
+
+    def meta_arithmetic(self, key, delta=1, decrement=False, initial=None,
+                        vivify=None, time=None):
+        """
+        Increment or decrement counter using meta command `ma`.
+        :param key: key of the counter
+        :param delta: value to add or subtract
+        :param decrement: decrement instead of increment
+        :param initial: value of counter created by `vivify`
+        :param vivify: on miss create counter with this TTL
+        :param time: new TTL of the counter
+        :return: Result with new value of the counter, NOT_FOUND on miss
+        :rtype: Result
+        :raises: UnsupportedCommandError with binary protocol
+        """
+        flags = ['v', 'D{}'.format(delta)]
+        if decrement:
+            flags.append('MD')
+        if initial is not None:
+            flags.append('J{}'.format(initial))
+        if vivify is not None:
+            flags.append('N{}'.format(vivify))
+        if time is not None:
+            flags.append('T{}'.format(time))
+        key = self._check_key(key)
+        self._invalidate([key])
+        return self._send_cmd('ma', **self._meta_args(key, flags))
+
+    def flush_all(self):
+        if self._near_cache is not None:
+            self._near_cache.clear()
+        return self._send_cmd('flush_all')
+
+    def stats(self):
+        return self._send_cmd('stats items')
+
+    def disconnect(self):
+        for buffer in self._counter_buffers:
+            try:
+                buffer.close()
+            except Exception as exc:
+                logger.warning('Flushing counters failed: {}'.format(exc))
+        logger.info('Disconnecting connection pool')
+        for pool in self._pools:
+            pool.close()
+        if self._workers is not None:
+            self._workers.close()
+
+    def _send_cmd(self, cmd_name, **kwargs):
+        key = kwargs.get('key')
+        cmd = self._protocol.encode(cmd_name, kwargs)
+        with self._measure(cmd_name, key):
+            response = self._request(cmd_name, key, cmd)
+        return self._parse_response(cmd_name, response)
+
+    def _request(self, cmd_name, key, cmd):
+        """
+        Send encoded command of a single key and read the reply.
+        :param cmd_name: command name
+        :type: str
+        :param key: checked key or None for commands without a key
+        :param cmd: encoded command or list of its parts, see
+        `Connection.send`
+        :rtype: Response
+        """
+        return self._get_pool(key).request(cmd)
+
+    def _get_chunked(self, values, raw=False):
+        """
+        Replace manifests of chunked values with the values. Chunks of all
+        of them are fetched with one pipelined multi-get. Values with
+        missing or corrupted chunks are dropped as misses.
+        :param values: dict of keys and fetched values
+        :type: dict
+        :param raw: return joined values as Result instances, without
+        decoding them
+        :type: bool
+        :rtype: dict
+        """
+        manifests = dict((key, value) for key, value in values.items()
+                         if isinstance(value, Manifest))
+        if not manifests:
+            return values
+
+        chunk_keys = dict(
+            (key, manifest.chunk_keys(self._check_key(key)))
+            for key, manifest in manifests.items())
+        checked, requests = self._get_many_requests(
+            [chunk_key for keys in chunk_keys.values() for chunk_key in keys])
+        responses = []
+        with self._measure('get_chunks'):
+            for pool_responses in self._request_all(requests):
+                responses.extend(pool_responses or [])
+        chunks = self._get_many_result(checked, responses)
+
+        values = dict(values)
+        for key, manifest in manifests.items():
+            data = manifest.join([chunks.get(chunk_key)
+                                  for chunk_key in chunk_keys[key]])
+            if data is None:
+                logger.debug('Chunks of {} do not match manifest'.format(key))
+                del values[key]
+            else:
+                result = Result(VALUE, key, data, manifest.flags)
+                values[key] = result if raw else self._decode_value(result)
+        return values
+
+    def _set_chunks(self, cmds_args, noreply=False):
+        """
+        Store values larger than chunk size of the chunker as chunks, all
+        of them in one pipeline, and replace their `set` commands with
+        commands storing manifests.
+        :param cmds_args: list of `set` template variables
+        :type: list
+        :return: list of `set` template variables, None for values whose
+        chunks were not stored
+        :rtype: list
+        """
+        if self._chunker is None:
+            return cmds_args
+
+        cmds_args = list(cmds_args)
+        chunks_args = []
+        positions = []
+        for i, args in enumerate(cmds_args):
+            split = self._chunker.split(
+                args['key'], args['value'], args['flags'])
+            if split is None:
+                continue
+
+            manifest, chunks = split
+            data = manifest.encode()
+            cmds_args[i] = dict(args, value=data, size=len(data),
+                                flags=manifest.flags | FLAG_CHUNKED)
+            for chunk_key, chunk in chunks:
+                chunks_args.append(dict(key=chunk_key, value=chunk, flags=0,
+                                        time=args['time'], size=len(chunk)))
+                positions.append(i)
+
+        if chunks_args:
+            results = self._send_many('set', chunks_args, noreply=noreply)
+            failed = set(i for i, stored in zip(positions, results)
+                         if not stored)
+            self._delete_chunks([cmds_args[i] for i in failed])
+            for i in failed:
+                cmds_args[i] = None
+        return cmds_args
+
+    def _delete_chunks(self, cmds_args):
+        """
+        Delete chunks of values whose manifests were not stored, eg. when
+        `add` or `cas` failed, so they don't stay in the cache.
+        :param cmds_args: list of storage template variables, values which
+        are not manifests are ignored
+        :type: list
+        """
+        chunk_keys = []
+        for args in cmds_args:
+            if args['flags'] & FLAG_CHUNKED:
+                manifest = Manifest.decode(args['value'], args['flags'])
+                chunk_keys.extend(manifest.chunk_keys(args['key']))
+        if chunk_keys:
+            self._send_many('delete', [dict(key=chunk_key)
+                                       for chunk_key in chunk_keys])
+
+    def _get_coalesced(self, key):
+        """
+        Send `get` unless the same one is in flight already, and decode the
+        shared response separately for every caller.
+        """
+        cmd = self._protocol.encode('get', {'key': key})
+        with self._measure('get', key):
+            response, shared = self._single_flight.do(
+                (self._get_pool(key), key),
+                lambda: self._request('get', key, cmd))
+        value = self._parse_response('get', response)
+        if shared and isinstance(value, bytearray):
+            # large values are received into a mutable buffer
+            value = bytearray(value)
+        return value
+
+    def _concat(self, cmd_name, key, value):
+        key = self._check_key(key)
+        data, _ = self._serializer.serialize(value)
+        self._invalidate([key])
+        return self._send_cmd(cmd_name, key=key, value=data, flags=0, time=0,
+                              size=len(data))
+
+    def _store(self, cmd_name, cmd_args, value=None):
+        """
+        Send storage command of a single value, splitting it into chunks
+        if needed.
+        :param value: value before encoding, cached in the near cache once
+        stored. If None then the near cache is only invalidated
+        """
+        self._invalidate([cmd_args['key']])
+        cmd_args = self._set_chunks([cmd_args])[0]
+        if cmd_args is None:
+            return False
+        try:
+            result = self._send_cmd(cmd_name, **cmd_args)
+        except ServerError:
+            self._delete_chunks([cmd_args])
+            raise
+        if result is not True:
+            self._delete_chunks([cmd_args])
+        elif value is not None:
+            self._cache_many({cmd_args['key']: value}, cmd_args['time'])
+        return result
+
+    def _get_stamped(self, key):
+        """
+        Get value of given key with its stamp.
+        :param key: checked key
+        :return: found flag, value, compute time and logical expiry
+        :rtype: tuple
+        """
+        cmd = self._protocol.encode('get', {'key': key})
+        response = self._get_pool(key).request(cmd)
+        if not response.is_valid():
+            raise ServerError(response.error)
+
+        results = list(response.values.values())
+        result = results[0] if results else None
+        if result is not None and result.flags & FLAG_CHUNKED:
+            if self._chunker is None:
+                result = None
+            else:
+                result = self._get_chunked(
+                    {key: Manifest.decode(result.value, result.flags)},
+                    raw=True).get(key)
+        if result is None:
+            return False, None, 0, 0
+
+        data, flags, delta, expiry = result.value, result.flags, 0, 0
+        if flags & FLAG_STAMPED:
+            data, flags, delta, expiry = unstamp(data, flags)
+        value = self._decode_value(result._replace(value=data, flags=flags))
+        return True, value, delta, expiry
+
+    def _acquire_lease(self, key, lease_time):
+        """
+        Try to add lease guarding recomputation of given key.
+        :return: status of `add`: STORED if lease was acquired, NOT_STORED
+        or EXISTS if somebody else holds it
+        """
+        lease = lease_key(key)
+        cmd = self._protocol.encode(
+            'add', dict(key=lease, value=b'1', flags=0, time=lease_time,
+                        size=1))
+        response = self._get_pool(lease).request(cmd)
+        return response.status
+
+    def _recompute(self, key, producer, time, stale_time):
+        """
+        Compute value with `producer` and store it with a stamp.
+        """
+        start = default_timer()
+        value = producer()
+        delta = default_timer() - start
+
+        data, flags = self._encode_value(value)
+        data, flags = stamp(data, flags, delta, expires_at(time))
+        self._store('set', dict(
+            key=key, value=data, flags=flags, size=len(data),
+            time=time + stale_time if time else 0), value)
+        return value
+
+    def _send_many(self, cmd_name, cmds_args, noreply=False):
+        """
+        Pipeline many `cmd_name` commands, `MAX_PIPELINE_SIZE` per write.
+        :param cmd_name: command name like 'set' or 'delete'
+        :type: str
+        :param cmds_args: list of dicts of variables to set in template
+        :type: list
+        :param noreply: send commands with `noreply` and skip the replies
+        :type: bool
+        :return: list of parsed results in order of `cmds_args`. If `noreply`
+        is set, then all results are assumed to be successful.
+        :rtype: list
+        """
+        results = [None] * len(cmds_args)
+
+        with self._measure(cmd_name + '_many'):
+            requests = self._many_requests(
+                cmd_name, cmds_args, noreply=noreply)
+            all_responses = self._request_all(
+                [(pool, cmds) for pool, _, cmds in requests],
+                **self._protocol.read_options(noreply))
+
+            for (_, positions, _), responses in zip(requests, all_responses):
+                if responses is None:
+                    parsed = [False] * len(positions)
+                else:
+                    parsed = self._parse_responses(
+                        cmd_name, responses, len(positions), noreply)
+
+                for i, result in zip(positions, parsed):
+                    results[i] = result
+        return results
+
+    def _request_all(self, requests, **kwargs):
+        """
+        Send pipelines and read their replies. Pipelines of different
+        servers run concurrently, so the batch takes as long as the slowest
+        server instead of all of them in turn. Failed servers don't fail
+        the batch unless all of them failed.
+        :param requests: list of (pool, commands) tuples
+        :type: list
+        :param kwargs: other arguments of `ConnectionPool.request_many`
+        :return: lists of Response instances in order of `requests`, None
+        for pipelines of failed servers
+        :rtype: list
+        :raises: error of the first pipeline if all of them failed
+        """
+        if (self._workers is None or
+                len(set(pool for pool, _ in requests)) < 2):
+            return [pool.request_many(cmds, **kwargs)
+                    for pool, cmds in requests]
+
+        tasks = [self._workers.submit(partial(pool.request_many, **kwargs),
+                                      cmds)
+                 for pool, cmds in requests[1:]]
+        # the caller sends the first pipeline itself
+        pool, cmds = requests[0]
+        tasks.insert(0, Task(partial(pool.request_many, **kwargs), (cmds,)))
+        tasks[0].run()
+        tasks[0].finish()
+
+        results = []
+        for (pool, _), task in zip(requests, tasks):
+            task.done.wait()
+            if task.failed:
+                logger.debug('Request to {} failed: {}'.format(
+                    pool, task.exc_info[1]))
+                results.append(None)
+            else:
+                results.append(task.result)
+        if all(task.failed for task in tasks):
+            tasks[0].get()
+        return results
+
+
+class DistributedClient(Client):
+    """
+    Client for multiple Memcached servers. Keys are distributed between
+    servers using ketama consistent hashing, so adding or removing a server
+    remaps only a part of the keys.
+    """
+
+    def __init__(self, servers, pool_size=20, socket_timeout=None,
+                 protocol='text', near_cache=None, pool_options=None,
+                 serializer=None, compressor=None, metrics=None,
+                 chunker=None, single_flight=None, workers=None):
+        """
+        :param servers: list of host/port strings or (host/port, weight)
+        tuples. Eg. ['127.0.0.1:11211', ('127.0.0.1:11212', 2)]
+        :type: list
+        :param pool_size: Max size of the connection pool of each server
+        :type: int
+        :param workers: max number of threads sending requests to servers
+        concurrently, eg. batches of `get_many`. Defaults to `pool_size`
+        :type: int
+        Other arguments are the same as in `Client`.
+        """
+        self._init_options(protocol, near_cache, serializer, compressor,
+                           metrics, chunker, single_flight)
+        self._servers = {}
+        self._pool_size = pool_size
+        self._pool_options = pool_options or {}
+        self._socket_timeout = socket_timeout
+        self._ring = HashRing()
+        self._workers = WorkerPool(workers or pool_size)
+
+        for server in servers:
+            if isinstance(server, (tuple, list)):
+                self.add_server(*server)
+            else:
+                self.add_server(server)
+
+    @property
+    def servers(self):
+        return self._ring.nodes
+
+    def add_server(self, host, weight=1):
+        """
+        Add server to the ring or change its weight.
+        :param host: host/port string. Eg. '127.0.0.1:11211'
+        :type: str
+        :param weight: weight of the server
+        :type: int
+        """
+        host = Host(host)
+        name = str(host)
+        if name not in self._servers:
+            self._servers[name] = ConnectionPool(
+                host, max_size=self._pool_size, timeout=self._socket_timeout,
+                parser_cls=self._protocol.parser_cls, metrics=self._metrics,
+                **self._pool_options)
+        self._ring.add_node(name, weight)
+
+    def remove_server(self, host):
+        """
+        Remove server from the ring and close its connections.
+        :param host: host/port string. Eg. '127.0.0.1:11211'
+        :type: str
+        """
+        name = str(Host(host))
+        self._ring.remove_node(name)
+        pool = self._servers.pop(name, None)
+        if pool:
+            pool.close()
+
+    def flush_all(self):
+        if self._near_cache is not None:
+            self._near_cache.clear()
+        cmd = self._protocol.encode('flush_all', {})
+        for pool in self._pools:
+            self._parse_response('flush_all', pool.request(cmd))
+
+    @property
+    def _pools(self):
+        return list(self._servers.values())
 
-        if cmd_name == 'get':
-            if response.data:
-                return list(response.data.values())[0]
-        elif cmd_name == 'set':
-            return STORED_RE.match(response.content) and True
+    def _get_pool(self, key):
+        node = self._ring.get_node(key)
+        if node is None:
+            raise NoServersError('No servers available')
+        return self._servers[node]
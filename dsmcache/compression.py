@@ -0,0 +1,112 @@
+"""
+Compression of large values. Compressed values are marked with
+`FLAG_COMPRESSED` bit of flags and decompressed on read.
+"""
+from __future__ import unicode_literals
+
+import threading
+import zlib
+from timeit import default_timer
+
+
+# Bit of flags marking compressed value, above the value type byte
+FLAG_COMPRESSED = 1 << 8
+
+
+class Compressor(object):
+    """
+    Compresses values larger than `threshold` bytes, if it saves space.
+    zlib is used by default, other codecs are plugged in with `compress`
+    and `decompress` functions.
+    """
+
+    def __init__(self, threshold=1024, level=6, compress=None,
+                 decompress=None):
+        """
+        :param threshold: min size of compressed value in bytes
+        :type: int
+        :param level: zlib compression level, unused with custom codec
+        :type: int
+        :param compress: function compressing bytes
+        :type: callable
+        :param decompress: function decompressing bytes
+        :type: callable
+        """
+        if (compress is None) != (decompress is None):
+            raise ValueError('Both compress and decompress have to be set')
+
+        self._threshold = threshold
+        self._compress = compress or (lambda data: zlib.compress(data, level))
+        self._decompress = decompress or zlib.decompress
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
+
+    @property
+    def ratio(self):
+        """
+        Size of compressed values to their original size, None if nothing
+        was compressed
+        """
+        if self.bytes_in:
+            return float(self.bytes_out) / self.bytes_in
+
+    @property
+    def stats(self):
+        return {
+            'compressed': self.compressed,
+            'skipped': self.skipped,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.ratio,
+            'compress_time': self.compress_time,
+            'decompress_time': self.decompress_time,
+        }
+
+    def compress(self, data, flags):
+        """
+        Compress serialized value if it's large enough and compression
+        saves space.
+        :param data: serialized value
+        :type: bytes
+        :param flags: flags of the value
+        :type: int
+        :return: data and flags to store
+        :rtype: tuple
+        """
+        if len(data) < self._threshold:
+            return data, flags
+
+        start = default_timer()
+        compressed = self._compress(bytes(data))
+        elapsed = default_timer() - start
+
+        with self._lock:
+            self.compress_time += elapsed
+            if len(compressed) >= len(data):
+                self.skipped += 1
+                return data, flags
+
+            self.compressed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(compressed)
+        return compressed, flags | FLAG_COMPRESSED
+
+    def decompress(self, data, flags):
+        """
+        Decompress value if it's marked as compressed.
+        :return: data and flags without FLAG_COMPRESSED
+        :rtype: tuple
+        """
+        if not flags & FLAG_COMPRESSED:
+            return data, flags
+
+        start = default_timer()
+        data = self._decompress(bytes(data))
+        with self._lock:
+            self.decompress_time += default_timer() - start
+        return data, flags & ~FLAG_COMPRESSED
@@ -3,32 +3,96 @@ import logging
 import re
 import socket
 import time
+from timeit import default_timer
 
-import six
-
-from .response import Response
+from .metrics import CONNECT, FIRST_BYTE, BYTES_IN, BYTES_OUT, DEAD_SOCKETS
+from .response import Response, ResponseParser, READ_BUFFER_SIZE, ERROR
 from .exceptions import InvalidPortError, InvalidAddressError
 
 
 DEFAULT_MC_PORT = 11211
 DEFAULT_SOCKET_TIMEOUT = 3
+# Max number of buffers passed to one `sendmsg` call, IOV_MAX on Linux
+MAX_SEND_BUFFERS = 1024
 logger = logging.getLogger(__name__)
 
 
+def join_commands(cmds):
+    """
+    Join pipelined commands for a single write. Commands rendered as lists
+    of parts, eg. with large values, are kept as separate parts, other
+    commands are concatenated.
+    :param cmds: list of commands, bytes or lists of parts
+    :type: list
+    :return: bytes or list of parts
+    :rtype: bytes | list
+    """
+    if not any(isinstance(cmd, list) for cmd in cmds):
+        return b''.join(cmds)
+
+    parts = []
+    joined = []
+    for cmd in cmds:
+        if isinstance(cmd, list):
+            if joined:
+                parts.append(b''.join(joined))
+                joined = []
+            parts.extend(cmd)
+        else:
+            joined.append(cmd)
+    if joined:
+        parts.append(b''.join(joined))
+    return parts
+
+
+def sendmsg_all(sock, buffers):
+    """
+    Send all buffers with vectored `sendmsg` calls, without concatenating
+    them.
+    :param sock: socket supporting `sendmsg`
+    :param buffers: bytes-like objects
+    :type: list
+    """
+    buffers = [memoryview(buf) for buf in buffers]
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first:first + MAX_SEND_BUFFERS])
+        # skip fully sent buffers and the sent part of the next one
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+
 class Host(object):
 
     def __init__(self, host_str):
         """
         :param host_str: either IP address of the host or IP with port
-        in format 'IP:PORT'
+        in format 'IP:PORT'. IPv6 addresses with port are enclosed in
+        brackets, eg. '[::1]:11211'. Paths of Unix sockets start with '/'
+        or 'unix:', eg. 'unix:/var/run/memcached.sock'
         """
-        self._ip, self._port = self._parse(host_str)
+        self._family = socket.AF_INET
+        if host_str.startswith(('/', 'unix:')):
+            self._family = getattr(socket, 'AF_UNIX', None)
+            self._ip, self._port = self._parse_unix(host_str)
+        elif host_str.startswith('[') or host_str.count(':') > 1:
+            self._family = socket.AF_INET6
+            self._ip, self._port = self._parse_ipv6(host_str)
+        else:
+            self._ip, self._port = self._parse(host_str)
 
     def __str__(self):
+        if self._port is None:
+            return self._ip
+        elif self._family == socket.AF_INET6:
+            return '[{}]:{}'.format(self._ip, self._port)
         return '{}:{}'.format(self._ip, self._port)
 
     def __repr__(self):
-        return '<Host: {}:{}>'.format(self._ip, self._port)
+        return '<Host: {}>'.format(self)
 
     @property
     def ip(self):
@@ -38,10 +102,52 @@ class Host(object):
     def port(self):
         return self._port
 
+    @property
+    def family(self):
+        """
+        Socket address family: AF_INET, AF_INET6 or AF_UNIX
+        """
+        return self._family
+
     @property
     def address(self):
+        """
+        Address passed to `socket.connect`, a path of Unix socket
+        """
+        if self._port is None:
+            return self._ip
         return self._ip, self._port
 
+    @staticmethod
+    def _parse_unix(host_str):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise InvalidAddressError('Unix sockets are not supported')
+        path = host_str[len('unix:'):] if host_str.startswith('unix:') \
+            else host_str
+        if not path:
+            raise InvalidAddressError('Invalid address')
+        return path, None
+
+    @staticmethod
+    def _parse_ipv6(host_str):
+        port = DEFAULT_MC_PORT
+        ip = host_str
+        if host_str.startswith('['):
+            ip, bracket, rest = host_str[1:].partition(']')
+            if not bracket or (rest and not rest.startswith(':')):
+                raise InvalidAddressError('Invalid address')
+            if rest:
+                try:
+                    port = int(rest[1:])
+                except ValueError:
+                    raise InvalidPortError('Invalid port')
+
+        try:
+            socket.inet_pton(socket.AF_INET6, ip)
+        except (socket.error, ValueError):
+            raise InvalidAddressError('Invalid address')
+        return ip, port
+
     @staticmethod
     def _parse(host_str):
         addr_port = host_str.split(':')
@@ -59,19 +165,150 @@ class Host(object):
             return addr_port[0], port
 
 
+class FileBody(object):
+    """
+    Command part read from a file object and sent in chunks, so at most
+    `chunk_size` bytes of it are kept in memory.
+    """
+
+    def __init__(self, file_obj, size, chunk_size=READ_BUFFER_SIZE * 4):
+        """
+        :param file_obj: file object opened in binary mode
+        :param size: number of bytes to send
+        :type: int
+        """
+        self._file = file_obj
+        self._size = size
+        self._chunk_size = chunk_size
+        try:
+            self._start = file_obj.tell()
+        except (AttributeError, IOError, OSError):
+            # eg. pipe, the body can be sent only once
+            self._start = None
+
+    def __len__(self):
+        return self._size
+
+    def rewind(self):
+        """
+        Seek back to the start of the body, so it can be sent again.
+        :return: False if the file is not seekable
+        :rtype: bool
+        """
+        if self._start is None:
+            return False
+        self._file.seek(self._start)
+        return True
+
+    def send(self, sock):
+        """
+        Send `size` bytes of the file through the socket.
+        :raises: ValueError if the file is shorter than `size`
+        """
+        chunk = memoryview(bytearray(min(self._chunk_size, self._size)))
+        remaining = self._size
+        while remaining:
+            view = chunk[:min(len(chunk), remaining)]
+            if hasattr(self._file, 'readinto'):
+                nbytes = self._file.readinto(view)
+            else:
+                data = self._file.read(len(view))
+                nbytes = len(data)
+                view[:nbytes] = data
+            if not nbytes:
+                raise ValueError('File is shorter than {} bytes'.format(
+                    self._size))
+            sock.sendall(view[:nbytes])
+            remaining -= nbytes
+
+
+class Transport(object):
+    """
+    Creates sockets of connections and sets their options. TCP options are
+    skipped for Unix sockets. Subclass it to customize sockets further.
+    """
+
+    def __init__(self, nodelay=True, keepalive=False, send_buffer_size=None,
+                 recv_buffer_size=None):
+        """
+        :param nodelay: disable Nagle's algorithm, so small requests are
+        sent immediately
+        :type: bool
+        :param keepalive: enable TCP keepalive probes
+        :type: bool
+        :param send_buffer_size: SO_SNDBUF in bytes, OS default if None
+        :type: int
+        :param recv_buffer_size: SO_RCVBUF in bytes, OS default if None
+        :type: int
+        """
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.send_buffer_size = send_buffer_size
+        self.recv_buffer_size = recv_buffer_size
+
+    def create_socket(self, host):
+        """
+        Return new socket for the host, not connected yet.
+        :type host: Host
+        :rtype: socket.socket
+        """
+        sock = socket.socket(host.family, socket.SOCK_STREAM)
+        self.configure(sock, host)
+        return sock
+
+    def configure(self, sock, host):
+        """
+        Set socket options.
+        """
+        if self.send_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                            self.send_buffer_size)
+        if self.recv_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            self.recv_buffer_size)
+        if host.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+DEFAULT_TRANSPORT = Transport()
+
+
 class Connection(object):
     """
     Class representing connection to Memcached server
     """
 
     def __init__(self, host, socket_timeout=DEFAULT_SOCKET_TIMEOUT,
-                 retry_timeout=10):
+                 retry_timeout=10, parser_cls=ResponseParser, metrics=None,
+                 connect_timeout=None, transport=None):
+        """
+        :param host: Host instance
+        :param socket_timeout: timeout of sending and reading in seconds
+        :param retry_timeout: seconds to wait before reconnecting to a dead
+        server
+        :param parser_cls: response parser class of the protocol
+        :param metrics: collects latencies and counters of requests
+        :type: Metrics
+        :param connect_timeout: timeout of connecting in seconds, defaults
+        to `socket_timeout`
+        :param transport: creates and configures sockets
+        :type: Transport
+        """
         self._host = host
         self._socket_timeout = socket_timeout
+        self._connect_timeout = connect_timeout
+        self._transport = transport or DEFAULT_TRANSPORT
         self._retry_timeout = retry_timeout
         self._socket = None
         self._dead_ts = 0
-        self._buffer = b''
+        self._parser = parser_cls()
+        self._metrics = metrics
+        # time the last request was sent, until first byte of reply
+        self._sent_at = None
 
     def connect(self):
         """
@@ -85,85 +322,142 @@ class Connection(object):
         if self._socket:
             return self._socket
 
-        self._buffer = b''
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.settimeout(self._socket_timeout)
-
+        self._parser.reset()
+        start = default_timer()
         try:
+            self._socket = self._transport.create_socket(self._host)
+            self._socket.settimeout(
+                self._connect_timeout if self._connect_timeout is not None
+                else self._socket_timeout)
             self._socket.connect(self._host.address)
+            self._socket.settimeout(self._socket_timeout)
         except (socket.timeout, socket.error) as exc:
             self._mark_socket_dead(str(exc))
             return
 
+        if self._metrics is not None:
+            self._metrics.record(CONNECT, default_timer() - start)
         return self._socket
 
     def send(self, cmd):
+        """
+        Send command to the server.
+        :param cmd: command or list of its parts, bytes or FileBody
+        :type: bytes | list
+        :raises: ValueError if FileBody is shorter than declared. Socket is
+        closed then, as the server waits for the rest of the command.
+        """
+        # drop leftovers of previous, possibly interrupted, responses
+        self._parser.reset()
+        parts = cmd if isinstance(cmd, list) else [cmd]
         try:
-            self._socket.sendall(cmd)
+            for group in self._group_parts(parts):
+                if isinstance(group, FileBody):
+                    group.send(self._socket)
+                elif len(group) == 1:
+                    self._socket.sendall(group[0])
+                elif hasattr(self._socket, 'sendmsg'):
+                    sendmsg_all(self._socket, group)
+                else:
+                    self._socket.sendall(b''.join(group))
         except (AttributeError, socket.error, socket.timeout) as exc:
             self._mark_socket_dead(str(exc))
             return
+        except ValueError as exc:
+            self._mark_socket_dead(str(exc))
+            raise
+
+        if self._metrics is not None:
+            self._metrics.incr(BYTES_OUT, sum(len(part) for part in parts))
+            self._sent_at = default_timer()
 
-    def _read(self, length=None):
+    @staticmethod
+    def _group_parts(parts):
         """
-        Return `length` bytes from the server or if length is None
-        read one line delimited by `\r\n` and return.
-        :param length: number of bytes to read from the socket.
-        :rtype: str | None
+        Split command parts into FileBody instances and lists of buffers
+        between them, each list sent in one call.
+        :type: list
+        :rtype: list
         """
-        response = None
-
-        while response is None:
-            if length:
-                if len(self._buffer) >= length:
-                    response = self._buffer[:length]
-                    self._buffer = self._buffer[length:]
+        groups = []
+        buffers = []
+        for part in parts:
+            if isinstance(part, FileBody):
+                if buffers:
+                    groups.append(buffers)
+                    buffers = []
+                groups.append(part)
             else:
-                index = self._buffer.find(b'\r\n')
-                if index != -1:
-                    response = self._buffer[:index+2]
-                    self._buffer = self._buffer[index+2:]
+                buffers.append(part)
+        if buffers:
+            groups.append(buffers)
+        return groups
 
-            if response is None:
-                try:
-                    tmp = self._socket.recv(4096)
-                except (AttributeError, socket.error, socket.timeout) as exc:
-                    self._mark_socket_dead(str(exc))
-                    return
-
-                if not tmp:
-                    self._mark_socket_dead('Server error')
-                else:
-                    self._buffer += tmp
-        return response
-
-    def read(self):
-        self._buffer = b''
+    def _recv(self):
+        """
+        Receive data from the server straight into the parser buffer.
+        Marks socket as dead on error.
+        :return: number of received bytes, 0 on error
+        :rtype: int
+        """
+        try:
+            nbytes = self._socket.recv_into(self._parser.get_buffer())
+        except (AttributeError, socket.error, socket.timeout) as exc:
+            self._mark_socket_dead(str(exc))
+            return 0
+
+        if not nbytes:
+            self._mark_socket_dead('Server error')
+            return nbytes
+
+        if self._metrics is not None:
+            self._metrics.incr(BYTES_IN, nbytes)
+            if self._sent_at is not None:
+                self._metrics.record(
+                    FIRST_BYTE, default_timer() - self._sent_at)
+                self._sent_at = None
+        self._parser.buffer_updated(nbytes)
+        return nbytes
+
+    def read(self, sink=None, quiet=False):
+        """
+        Read response to one command. Values are collected until the final
+        status line.
+        :param sink: sink receiving value bodies, eg. FileSink
+        :param quiet: read reply to a pipeline of `noreply` commands ending
+        with `mn`. Errors of failed commands are collected as quiet results
+        until the final `MN`
+        :type: bool
+        :rtype: Response
+        """
         response = Response()
-        line = self._read()
-        response.write(line)
-
-        if line and b'VALUE' in line:
-            while line != b'END\r\n':
-                header = line.split()
-                if len(header) == 4 and header[0] == b'VALUE':
-                    key = header[1]
-                    length = int(header[3])
-                    line = self._read(length)
-                    response.write(line)
-
-                    if six.PY3:
-                        response[key] = line.decode('utf-8')
-                    else:
-                        response[key] = line
-
-                line = self._read()
-                response.write(line)
-        return response
+        self._parser.sink = sink
+        try:
+            while True:
+                result = self._parser.next_result()
+                if result is None:
+                    if not self._recv():
+                        return response
+                    continue
+
+                if quiet and result.type == ERROR:
+                    result = result._replace(opaque=len(response.quiet))
+                response.add(result)
+                if result.final:
+                    return response
+        finally:
+            self._parser.sink = None
 
     def is_alive(self):
         return not self._check_dead()
 
+    @property
+    def connected(self):
+        """
+        True if socket is open, it's closed when the server fails
+        """
+        return self._socket is not None
+
     def _check_dead(self):
         """
         Return True if socket is marked as dead
@@ -172,6 +466,8 @@ class Connection(object):
 
     def _mark_socket_dead(self, reason):
         self._dead_ts = time.time() + self._retry_timeout
+        if self._metrics is not None:
+            self._metrics.incr(DEAD_SOCKETS)
         logger.debug('Socket is dead with reason: {}'.format(reason))
         self.close()
 
@@ -0,0 +1,222 @@
+"""
+Client side aggregation of counter updates. Deltas are summed per key in
+memory and sent as pipelined `incr` and `decr` commands, so thousands of
+updates per second cost a few requests.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import weakref
+from timeit import default_timer
+
+
+# Flushes a rejected delta is sent in before it's dropped
+MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer(object):
+    """
+    Thread-safe buffer of counter deltas, created by `Client.counter_buffer`.
+    Deltas are flushed every `max_delay` seconds by a background thread,
+    when `max_keys` keys are pending and when the buffer is closed.
+    Missing counters are created with `add`.
+
+    The client is referenced weakly, so the background thread doesn't keep
+    it alive: the client is disconnected when it's garbage collected,
+    which closes the buffer. Deltas which can't be sent after that are
+    dropped.
+    """
+
+    def __init__(self, client, max_delay=1.0, max_keys=1000, time=0,
+                 max_attempts=MAX_ATTEMPTS):
+        """
+        :param client: client sending the commands
+        :type: Client
+        :param max_delay: max seconds a delta stays in the buffer. None
+        disables the background thread
+        :type: float
+        :param max_keys: number of pending keys which triggers a flush
+        :type: int
+        :param time: TTL of created counters. If 0 then cache forever
+        :type: int
+        :param max_attempts: number of flushes in which the server may
+        reject a delta, eg. `incr` of a non-numeric value, before the
+        delta is dropped
+        :type: int
+        """
+        self._client = weakref.ref(client)
+        self._check_key = client._check_key
+        self._max_attempts = max_attempts
+        # keys and number of flushes which failed to apply their deltas
+        self._attempts = {}
+        self._max_delay = max_delay
+        self._max_keys = max_keys
+        self._time = time
+        self._deltas = {}
+        # time the oldest pending delta was added
+        self._since = None
+        self._lock = threading.Lock()
+        # only one flush sends commands at a time
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._closed = False
+
+        if max_delay:
+            flusher = threading.Thread(target=self._flush_forever,
+                                       name='dsmcache-counters')
+            flusher.daemon = True
+            flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @property
+    def pending(self):
+        """
+        Dict of keys and deltas waiting to be sent
+        """
+        with self._lock:
+            return dict(self._deltas)
+
+    def incr(self, key, delta=1):
+        """
+        Add `delta` to the counter.
+        :param key:
+        :param delta: number to add, negative to subtract
+        :type: int
+        """
+        key = self._check_key(key)
+        with self._lock:
+            if self._closed:
+                raise ValueError('Counter buffer is closed')
+            if not self._deltas:
+                self._since = default_timer()
+            self._deltas[key] = self._deltas.get(key, 0) + delta
+            full = len(self._deltas) >= self._max_keys
+            stale = (self._max_delay is not None and
+                     default_timer() - self._since >= self._max_delay)
+
+        if full or stale:
+            self.flush()
+
+    def decr(self, key, delta=1):
+        """
+        Subtract `delta` from the counter. Memcached never decrements it
+        below 0.
+        """
+        self.incr(key, -delta)
+
+    def flush(self):
+        """
+        Send pending deltas. Deltas which could not be sent are kept for the
+        next flush, unless the server rejected them `max_attempts` times.
+        """
+        with self._flush_lock:
+            with self._lock:
+                deltas = self._deltas
+                self._deltas = {}
+                self._since = None
+
+            client = self._client()
+            if client is None:
+                if deltas:
+                    logger.warning('Client is gone, dropping {} counters'
+                                   .format(len(deltas)))
+                return
+
+            try:
+                failed = self._send(client, dict(
+                    (key, delta) for key, delta in deltas.items() if delta))
+            except Exception:
+                self._restore(deltas)
+                raise
+            self._restore(self._retried(deltas, failed))
+
+    def close(self):
+        """
+        Stop the background thread and flush pending deltas.
+        """
+        with self._lock:
+            self._closed = True
+        self._stop.set()
+        self.flush()
+
+    def _send(self, client, deltas):
+        """
+        Send `incr` and `decr` commands and create missing counters.
+        :param deltas: dict of checked keys and non-zero deltas
+        :type: dict
+        :return: dict of deltas which were not applied
+        :rtype: dict
+        """
+        client._invalidate(list(deltas))
+        missing = {}
+        failed = {}
+        for cmd_name, sign in (('incr', 1), ('decr', -1)):
+            keys = [key for key, delta in deltas.items() if delta * sign > 0]
+            if not keys:
+                continue
+            results = client._send_many(cmd_name, [
+                dict(key=key, delta=deltas[key] * sign) for key in keys])
+            for key, result in zip(keys, results):
+                if result is None:
+                    missing[key] = deltas[key]
+                elif result is False:
+                    failed[key] = deltas[key]
+
+        for key, delta in missing.items():
+            # counters are never created below 0, like `decr` works
+            if client.add(key, max(delta, 0), self._time):
+                continue
+            # created by somebody else meanwhile
+            cmd_name = 'incr' if delta > 0 else 'decr'
+            if client._send_cmd(cmd_name, key=key, delta=abs(delta)) is None:
+                failed[key] = delta
+        return failed
+
+    def _retried(self, deltas, failed):
+        """
+        Count failed attempts of keys and return deltas to send again.
+        :rtype: dict
+        """
+        for key in deltas:
+            if key not in failed:
+                self._attempts.pop(key, None)
+
+        retried = {}
+        for key, delta in failed.items():
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts < self._max_attempts:
+                self._attempts[key] = attempts
+                retried[key] = delta
+            else:
+                self._attempts.pop(key, None)
+                logger.warning(
+                    'Dropping delta {} of counter {!r} rejected {} times'
+                    .format(delta, key, attempts))
+        if retried:
+            logger.debug('Sending {} counters failed'.format(len(retried)))
+        return retried
+
+    def _restore(self, deltas):
+        with self._lock:
+            if not self._deltas:
+                self._since = default_timer()
+            for key, delta in deltas.items():
+                self._deltas[key] = self._deltas.get(key, 0) + delta
+
+    def _flush_forever(self):
+        while not self._stop.wait(self._max_delay):
+            if self._client() is None:
+                return
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.debug('Flushing counters failed: {}'.format(exc))
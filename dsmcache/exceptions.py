@@ -33,6 +33,18 @@ class ClosedPoolError(ConnectionPoolException):
     """
 
 
+class CircuitOpenError(ConnectionPoolException):
+    """
+    Exception raised if circuit breaker of the server is open
+    """
+
+
+class NoServersError(ConnectionPoolException):
+    """
+    Exception raised if there are no servers to send command to
+    """
+
+
 class ServerError(Exception):
     """
     Base class for all server errors
@@ -43,3 +55,16 @@ class InvalidKeyError(Exception):
     """
     Exception raised if key is invalid
     """
+
+
+class CASConflictError(Exception):
+    """
+    Exception raised if value kept changing during all retries of
+    `cas_update`
+    """
+
+
+class UnsupportedCommandError(ValueError):
+    """
+    Exception raised if command is not supported by the protocol engine
+    """
@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+
+import bisect
+import hashlib
+import math
+
+import six
+
+
+# Number of md5 digests per server. Each digest gives 4 points on the ring.
+POINTS_PER_SERVER = 40
+POINTS_PER_HASH = 4
+
+
+def ketama_points(digest):
+    """
+    Split md5 digest into 4 little-endian 32 bit points like libketama does.
+    :param digest: md5 digest
+    :type: bytes
+    :rtype: list
+    """
+    digest = bytearray(digest)
+    return [
+        (digest[3 + i * 4] << 24) | (digest[2 + i * 4] << 16) |
+        (digest[1 + i * 4] << 8) | digest[i * 4]
+        for i in range(POINTS_PER_HASH)
+    ]
+
+
+def ketama_hash(key):
+    """
+    Return position of `key` on the ring.
+    :param key: key to hash
+    :type: bytes
+    :rtype: int
+    """
+    if isinstance(key, six.text_type):
+        key = key.encode('utf-8')
+    return ketama_points(hashlib.md5(key).digest())[0]
+
+
+class HashRing(object):
+    """
+    Ketama compatible consistent hash ring. Points are precomputed when nodes
+    change, so lookup is a single bisect.
+    """
+
+    def __init__(self, nodes=None):
+        """
+        :param nodes: dict of node names and their weights
+        :type: dict
+        """
+        self._weights = dict(nodes or {})
+        self._points = []
+        self._nodes = []
+        self._build()
+
+    def __len__(self):
+        return len(self._weights)
+
+    def __contains__(self, node):
+        return node in self._weights
+
+    @property
+    def nodes(self):
+        return list(self._weights)
+
+    def add_node(self, node, weight=1):
+        """
+        Add node to the ring or change its weight.
+        :param node: node name. Eg. '127.0.0.1:11211'
+        :type: str
+        :param weight: weight of the node
+        :type: int
+        """
+        self._weights[node] = weight
+        self._build()
+
+    def remove_node(self, node):
+        """
+        Remove node from the ring.
+        :param node: node name
+        :type: str
+        """
+        self._weights.pop(node, None)
+        self._build()
+
+    def get_node(self, key):
+        """
+        Return node responsible for `key` or None if the ring is empty.
+        :param key: key to look up
+        :type: bytes
+        :rtype: str | None
+        """
+        if not self._points:
+            return None
+
+        index = bisect.bisect_left(self._points, ketama_hash(key))
+        if index == len(self._points):
+            index = 0
+        return self._nodes[index]
+
+    def get_nodes(self, key, count):
+        """
+        Return up to `count` distinct nodes for `key`: the one responsible
+        for it followed by the next ones clockwise on the ring.
+        :param key: key to look up
+        :type: bytes
+        :param count: number of nodes
+        :type: int
+        :rtype: list
+        """
+        if not self._points:
+            return []
+
+        count = min(count, len(self._weights))
+        start = bisect.bisect_left(self._points, ketama_hash(key))
+        nodes = []
+        for i in range(len(self._points)):
+            node = self._nodes[(start + i) % len(self._points)]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == count:
+                    break
+        return nodes
+
+    def _build(self):
+        points = []
+        total_weight = sum(self._weights.values())
+
+        for node, weight in self._weights.items():
+            factor = int(math.floor(
+                float(weight) / total_weight * POINTS_PER_SERVER *
+                len(self._weights)))
+
+            for i in range(factor):
+                digest = hashlib.md5(
+                    '{}-{}'.format(node, i).encode('utf-8')).digest()
+                points.extend(
+                    (point, node) for point in ketama_points(digest))
+
+        points.sort()
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
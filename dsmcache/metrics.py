@@ -0,0 +1,215 @@
+"""
+Instrumentation of clients: latency histograms of commands and of request
+phases, counters and hooks called around every command.
+
+Updates are not locked. Under heavy contention a few samples may be lost,
+which keeps the cost low enough to leave metrics always on.
+"""
+from __future__ import unicode_literals
+
+from timeit import default_timer
+
+
+# Phases of a request. FIRST_BYTE and READ are measured from sending the
+# request to the first byte and to the whole reply
+POOL_WAIT = 'pool_wait'
+CONNECT = 'connect'
+SEND = 'send'
+FIRST_BYTE = 'first_byte'
+READ = 'read'
+
+# Counters
+BYTES_IN = 'bytes_in'
+BYTES_OUT = 'bytes_out'
+DEAD_SOCKETS = 'dead_sockets'
+POOL_EXHAUSTED = 'pool_exhausted'
+ERRORS = 'errors'
+HEDGES = 'hedges'
+HEDGE_WINS = 'hedge_wins'
+REPLICA_ERRORS = 'replica_errors'
+
+
+class Histogram(object):
+    """
+    Latency histogram with buckets of powers of two microseconds. Bucket
+    `i` counts samples shorter than 2^i us, the last one everything above.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """
+        Add sample to the histogram.
+        :param seconds: measured latency
+        :type: float
+        """
+        index = int(seconds * 1e6).bit_length()
+        self.buckets[min(index, self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """
+        Return upper bound of the bucket containing given percentile.
+        :param percent: percentile, eg. 99.9
+        :type: float
+        :return: latency in seconds or None if there are no samples
+        :rtype: float | None
+        """
+        if not self.count:
+            return None
+
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min((1 << index) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        :return: summary of the histogram in seconds
+        :rtype: dict
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+
+class MetricsHook(object):
+    """
+    Base class of hooks called around every command. Use it to export
+    measurements to other metrics systems.
+    """
+
+    def before(self, cmd_name, key):
+        """
+        Called before the command is sent.
+        :param cmd_name: command name like 'get' or 'set_many'
+        :param key: checked key or None for commands of many keys
+        """
+
+    def after(self, cmd_name, key, elapsed, error):
+        """
+        Called after the command is done.
+        :param elapsed: duration of the command in seconds
+        :type: float
+        :param error: exception raised by the command or None
+        """
+
+
+class Metrics(object):
+    """
+    Histograms of commands and phases of requests, and counters. Shared by
+    a client, its pools and connections.
+    """
+
+    def __init__(self, hooks=None):
+        """
+        :param hooks: MetricsHook instances
+        :type: list
+        """
+        self.commands = {}
+        self.phases = {}
+        self.counters = {}
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, phase, seconds):
+        """
+        Record duration of request phase, eg. POOL_WAIT.
+        """
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases.setdefault(phase, Histogram())
+        histogram.record(seconds)
+
+    def incr(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def measure(self, cmd_name, key=None):
+        """
+        Return context manager measuring the command and calling hooks.
+        :rtype: Measurement
+        """
+        return Measurement(self, cmd_name, key)
+
+    def snapshot(self):
+        """
+        :return: summaries of all histograms and counters
+        :rtype: dict
+        """
+        return {
+            'commands': dict((name, histogram.snapshot())
+                             for name, histogram in self.commands.items()),
+            'phases': dict((name, histogram.snapshot())
+                           for name, histogram in self.phases.items()),
+            'counters': dict(self.counters),
+        }
+
+
+class Measurement(object):
+    """
+    Context manager measuring one command.
+    """
+
+    __slots__ = ('_metrics', '_cmd_name', '_key', '_start')
+
+    def __init__(self, metrics, cmd_name, key):
+        self._metrics = metrics
+        self._cmd_name = cmd_name
+        self._key = key
+        self._start = None
+
+    def __enter__(self):
+        for hook in self._metrics.hooks:
+            hook.before(self._cmd_name, self._key)
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = default_timer() - self._start
+        metrics = self._metrics
+
+        histogram = metrics.commands.get(self._cmd_name)
+        if histogram is None:
+            histogram = metrics.commands.setdefault(
+                self._cmd_name, Histogram())
+        histogram.record(elapsed)
+        if exc_type is not None:
+            metrics.incr(ERRORS)
+
+        for hook in metrics.hooks:
+            hook.after(self._cmd_name, self._key, elapsed, exc)
+        return False
+
+
+class NullMeasurement(object):
+    """
+    Context manager doing nothing, used when metrics are disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_MEASUREMENT = NullMeasurement()
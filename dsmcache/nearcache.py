@@ -0,0 +1,175 @@
+"""
+In-process near cache (L1) kept in front of Memcached. Hot keys are served
+from local memory without a network round trip.
+"""
+from __future__ import unicode_literals
+
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import six
+
+
+# Memcached treats TTL above 30 days as unix timestamp
+MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+
+# Values of these types are shared by all callers, others are copied
+IMMUTABLE_TYPES = (six.binary_type, six.text_type, float, bool,
+                   type(None)) + six.integer_types
+
+
+class NearCache(object):
+    """
+    Thread-safe LRU cache bounded by number of entries and by size of
+    values. Every entry expires after at most `ttl` seconds, so values
+    changed by other clients are seen after `ttl` at the latest. Entries
+    stored with their Memcached TTL expire no later than the key does.
+
+    Bytes, text and numbers are returned as they are. Values of other
+    types are deep-copied when stored and on every hit, so callers
+    changing them don't change the cache, but hits of large containers
+    cost as much as copying them.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=5):
+        """
+        :param max_entries: max number of cached keys
+        :type: int
+        :param max_bytes: max total size of cached values
+        :type: int
+        :param ttl: max time in seconds an entry is kept
+        :type: int
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        # key: (value, size, expires_at). Least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def stats(self):
+        """
+        Counters for sizing the cache
+        :rtype: dict
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def get(self, key):
+        """
+        Return cached value of `key` or None if it's missing or expired.
+        :param key: checked key
+        :type: bytes
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, _, expires_at = entry
+            if expires_at <= _now():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._move_to_end(key)
+            self.hits += 1
+        return _copy(value)
+
+    def set(self, key, value, time=0):
+        """
+        Cache `value` of `key`.
+        :param key: checked key
+        :type: bytes
+        :param value: value to cache
+        :param time: Memcached TTL of the value. If 0 then only `ttl` of
+        the cache applies
+        :type: int
+        """
+        ttl = self._entry_ttl(time)
+        size = self._size(value)
+        if ttl <= 0 or size > self._max_bytes:
+            self.delete(key)
+            return
+
+        value = _copy(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, _now() + ttl)
+            self._bytes += size
+
+            while (len(self._entries) > self._max_entries or
+                   self._bytes > self._max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Invalidate cached value of `key`.
+        :param key: checked key
+        :type: bytes
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _entry_ttl(self, time):
+        if time <= 0:
+            return self._ttl
+        if time > MAX_RELATIVE_TTL:
+            time -= _now()
+        return min(self._ttl, time)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _move_to_end(self, key):
+        if six.PY3:
+            self._entries.move_to_end(key)
+        else:
+            self._entries[key] = self._entries.pop(key)
+
+    @staticmethod
+    def _size(value):
+        if isinstance(value, (six.binary_type, six.text_type, bytearray)):
+            return len(value)
+        return sys.getsizeof(value)
+
+
+def _now():
+    return time.time()
+
+
+def _copy(value):
+    if isinstance(value, IMMUTABLE_TYPES):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return copy.deepcopy(value)
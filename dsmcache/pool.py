@@ -1,26 +1,96 @@
 from __future__ import unicode_literals
 
-from six.moves.queue import Queue, Full, Empty
+import logging
+import threading
+import time
+from collections import deque
+from timeit import default_timer
 
-from .exceptions import EmptyPoolError, ClosedPoolError
-from .connection import Connection, DEFAULT_SOCKET_TIMEOUT
+from .breaker import CircuitBreaker
+from .exceptions import EmptyPoolError, ClosedPoolError, CircuitOpenError
+from .connection import Connection, DEFAULT_SOCKET_TIMEOUT, join_commands
+from .metrics import POOL_WAIT, SEND, READ, POOL_EXHAUSTED
+from .response import ResponseParser
+
+
+logger = logging.getLogger(__name__)
 
 
 class ConnectionPool(object):
+    """
+    Elastic pool of connections. Connections are created on demand up to
+    `max_size`, idle ones are reused most recently used first, so the ones
+    not needed anymore stay idle long enough to be closed by the reaper.
+    """
 
-    QueueCls = Queue
     ConnectionCls = Connection
 
-    def __init__(self, host, pool_size=20, timeout=DEFAULT_SOCKET_TIMEOUT):
+    def __init__(self, host, max_size=20, timeout=DEFAULT_SOCKET_TIMEOUT,
+                 parser_cls=ResponseParser, min_idle=0, max_idle_time=60,
+                 block=True, prewarm=False, metrics=None,
+                 connect_timeout=None, transport=None, breaker_options=None):
+        """
+        :param host: Host instance
+        :type: Host
+        :param max_size: max number of open connections
+        :type: int
+        :param timeout: socket timeout, also max time to wait for a free
+        connection
+        :type: int
+        :param parser_cls: response parser class of the protocol
+        :param min_idle: number of idle connections kept open by the reaper
+        :type: int
+        :param max_idle_time: seconds after which idle connection above
+        `min_idle` is closed. None disables the reaper
+        :type: int
+        :param block: wait for a free connection when `max_size` is reached
+        instead of raising EmptyPoolError
+        :type: bool
+        :param prewarm: open `min_idle` connections on startup
+        :type: bool
+        :param metrics: collects latencies of request phases and counters
+        :type: Metrics
+        :param connect_timeout: timeout of connecting in seconds, defaults
+        to `timeout`
+        :type: float
+        :param transport: creates and configures sockets, eg. sets
+        TCP_NODELAY or buffer sizes
+        :type: Transport
+        :param breaker_options: CircuitBreaker arguments. If given, health
+        of the server is tracked by a breaker shared by all connections and
+        requests fail with CircuitOpenError while it's open
+        :type: dict
+        """
         self._host = host
-        self._pool_size = pool_size
+        self._max_size = max_size
         self._timeout = timeout
-        self._pool = self.QueueCls(pool_size)
+        self._parser_cls = parser_cls
+        self._min_idle = min(min_idle, max_size)
+        self._max_idle_time = max_idle_time
+        self._block = block
+        self._metrics = metrics
+        self._connect_timeout = connect_timeout
+        self._transport = transport
+        self._breaker = None
+        if breaker_options is not None:
+            self._breaker = CircuitBreaker(name=str(host), **breaker_options)
+        # idle connections and time they were returned, most recent last
+        self._idle = deque()
+        # number of open connections, idle and in use
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
 
-        # TODO: creating all `pool_size` connections on startup probably isn't
-        # a good idea
-        for _ in range(self._pool_size):
-            self._pool.put(self._new_connection())
+        if prewarm:
+            self._fill()
+
+        if max_idle_time:
+            reaper = threading.Thread(
+                target=self._reap_forever,
+                name='dsmcache-reaper-{}'.format(host))
+            reaper.daemon = True
+            reaper.start()
 
     def __repr__(self):
         return '<ConnectionPool: {}>'.format(self._host)
@@ -32,6 +102,27 @@ class ConnectionPool(object):
         self.close()
         return False
 
+    @property
+    def size(self):
+        """
+        Number of open connections, idle and in use
+        """
+        return self._size
+
+    @property
+    def breaker(self):
+        """
+        CircuitBreaker of the server or None
+        """
+        return self._breaker
+
+    @property
+    def idle(self):
+        """
+        Number of idle connections
+        """
+        return len(self._idle)
+
     def _new_connection(self):
         """
         Create new connection
@@ -39,7 +130,15 @@ class ConnectionPool(object):
         :rtype: Connection
         """
 
-        connection = Connection(self._host, socket_timeout=self._timeout)
+        options = {}
+        if self._breaker is not None:
+            # the breaker decides when to retry dead server
+            options['retry_timeout'] = 0
+        connection = Connection(self._host, socket_timeout=self._timeout,
+                                parser_cls=self._parser_cls,
+                                metrics=self._metrics,
+                                connect_timeout=self._connect_timeout,
+                                transport=self._transport, **options)
         return connection
 
     def _put_connection(self, conn):
@@ -47,66 +146,184 @@ class ConnectionPool(object):
         Put connection back to the pool
         :param conn: Connection instance
         """
-        try:
-            self._pool.put(conn, block=False)
-            return
-        except Full:
-            # Do not put connection to pool if it's full
-            pass
-        except AttributeError:
-            pass
-
-        if conn:
-            conn.close()
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+                return
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
 
     def _get_connection(self):
-        connection = None
-        try:
-            connection = self._pool.get(timeout=self._timeout)
-        except Empty:
-            pass
-        except AttributeError:
-            raise ClosedPoolError('Pool is already closed')
+        """
+        Return idle connection or a new one if `max_size` isn't reached.
+        Otherwise wait for a free connection or fail, depending on `block`.
+        :rtype: Connection
+        :raises: EmptyPoolError, ClosedPoolError
+        """
+        deadline = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ClosedPoolError('Pool is already closed')
+                if self._idle:
+                    return self._idle.pop()[0]
+                if self._size < self._max_size:
+                    self._size += 1
+                    break
+                if not self._block:
+                    self._exhausted()
 
-        return connection or self._new_connection()
+                if deadline is None and self._timeout is not None:
+                    deadline = time.time() + self._timeout
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    self._exhausted()
+                self._cond.wait(remaining)
 
-    def close(self):
+        return self._new_connection()
+
+    def _exhausted(self):
+        if self._metrics is not None:
+            self._metrics.incr(POOL_EXHAUSTED)
+        raise EmptyPoolError('Pool is empty')
+
+    def _fill(self):
         """
-        Close all connections and make pool unusable.
+        Open connections until there are `min_idle` idle ones.
         """
-        pool = self._pool
-        self._pool = None
-
         while True:
-            try:
-                conn = pool.get(block=False)
-            except Empty:
+            with self._cond:
+                if (self._closed or len(self._idle) >= self._min_idle or
+                        self._size >= self._max_size):
+                    return
+                self._size += 1
+
+            connection = self._new_connection()
+            connection.connect()
+            self._put_connection(connection)
+            if not connection.is_alive():
                 return
-            if conn:
-                conn.close()
 
-    def request(self, cmd):
+    def reap(self):
+        """
+        Close connections idle for longer than `max_idle_time`, keeping at
+        least `min_idle` of them, and open missing `min_idle` connections.
         """
-        Get connection instance from the queue and send `cmd` through it
-        :param cmd: command to send
-        :type: str
+        expired = []
+        with self._cond:
+            deadline = time.time() - self._max_idle_time
+            # oldest connections are at the left side
+            while (len(self._idle) > self._min_idle and
+                   self._idle[0][1] < deadline):
+                expired.append(self._idle.popleft()[0])
+                self._size -= 1
+
+        for connection in expired:
+            connection.close()
+        if expired:
+            logger.debug('Closed {} idle connections to {}'.format(
+                len(expired), self._host))
+        self._fill()
+
+    def _reap_forever(self):
+        interval = max(self._max_idle_time / 2.0, 0.1)
+        while not self._stop.wait(interval):
+            try:
+                self.reap()
+            except Exception as exc:
+                logger.debug('Reaping connections failed: {}'.format(exc))
+
+    def close(self):
+        """
+        Close all connections and make pool unusable. Connections in use are
+        closed when they are returned.
+        """
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        self._stop.set()
+        for conn, _ in idle:
+            conn.close()
+
+    def request(self, cmd, sink=None):
+        """
+        Get connection instance from the pool and send `cmd` through it
+        :param cmd: command to send or list of its parts
+        :type: bytes | list
+        :param sink: sink receiving value bodies of the response
         :return: Response instance
         :rtype: Response
         """
-        connection = None
+        return self.request_many([cmd], sink=sink)[0]
+
+    def request_many(self, cmds, noreply=False, sink=None, quiet=False):
+        """
+        Get connection instance from the pool, send all `cmds` through it
+        in a single write and read their responses back in order.
+        :param cmds: commands to send
+        :type: list
+        :param noreply: do not read any responses. Use it only for commands
+        sent with `noreply` option.
+        :type: bool
+        :param sink: sink receiving value bodies of the responses
+        :param quiet: commands were sent with `noreply` option and end with
+        `mn`. A single response is read, holding errors of failed commands
+        as quiet results, so they don't stay in the connection
+        :type: bool
+        :return: list of Response instances
+        :rtype: list
+        """
+        breaker = self._breaker
+        if breaker is None:
+            return self._request_many(cmds, noreply, sink, quiet)[0]
+
+        if not breaker.allow():
+            raise CircuitOpenError(
+                'Circuit breaker of {} is open'.format(self._host))
+        try:
+            responses, alive = self._request_many(
+                cmds, noreply, sink, quiet)
+        except Exception:
+            # eg. no free connection, health of the server is unknown
+            breaker.release()
+            raise
+        breaker.record(alive)
+        return responses
+
+    def _request_many(self, cmds, noreply, sink, quiet):
+        """
+        :return: list of Response instances and False if the connection
+        died during the request
+        :rtype: tuple
+        """
+        metrics = self._metrics
+        start = default_timer()
+        connection = self._get_connection()
+        if metrics is not None:
+            metrics.record(POOL_WAIT, default_timer() - start)
 
         try:
-            connection = self._pool.get(timeout=self._timeout)
             connection.connect()  # if not already connected
-            connection.send(cmd)
-            response = connection.read()
-        except Empty:
-            raise EmptyPoolError('Pool is empty')
-        except AttributeError:
-            raise ClosedPoolError('Pool is already closed')
+            start = default_timer()
+            connection.send(
+                cmds[0] if len(cmds) == 1 else join_commands(cmds))
+            if metrics is not None:
+                metrics.record(SEND, default_timer() - start)
+            if noreply:
+                return [], connection.connected
+
+            if quiet:
+                responses = [connection.read(quiet=True)]
+            else:
+                responses = [connection.read(sink) for _ in cmds]
+            if metrics is not None:
+                metrics.record(READ, default_timer() - start)
+            return responses, connection.connected
         finally:
             # put connection back to the pool
-            if connection:
-                self._put_connection(connection)
-
-        return response
+            self._put_connection(connection)
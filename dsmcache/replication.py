@@ -0,0 +1,407 @@
+"""
+Replication of keys to several servers with hedged reads.
+
+Writes go to all replicas of a key, reads go to the first one. When it
+doesn't answer within the hedge delay, the read is sent to the second
+replica too and the first good answer wins. Hedges are limited to a share
+of reads, so a slow cluster isn't flooded with duplicate requests.
+
+Writes depending on state of a single server, like `cas` or `incr`, go to
+the first replica only and the key is deleted from the others, so hedged
+reads never return the value from before the write.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import OrderedDict
+from timeit import default_timer
+
+from six.moves import queue
+
+from .client import DistributedClient, MAX_PIPELINE_SIZE
+from .connection import Host
+from .exceptions import NoServersError
+from .hashring import HashRing
+from .metrics import HEDGES, HEDGE_WINS, REPLICA_ERRORS, Histogram
+from .response import NOT_FOUND
+
+
+# Commands written to all replicas. Replicas answering differently than
+# the first one drop the key
+REPLICATED_COMMANDS = frozenset([
+    'set', 'add', 'replace', 'append', 'prepend', 'delete', 'touch', 'ms',
+    'md'])
+
+# Commands depending on state of a single server. They go to the first
+# replica only and the other replicas drop the key
+PRIMARY_COMMANDS = frozenset(['cas', 'incr', 'decr', 'ma'])
+
+# Commands which may be sent to the second replica
+HEDGED_COMMANDS = frozenset(['get'])
+
+# Reads measured before the hedge delay follows the percentile
+MIN_HEDGE_SAMPLES = 100
+
+# Max number of hedges saved up by the budget
+MAX_HEDGE_BURST = 10
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicatedClient(DistributedClient):
+    """
+    Client storing every key on `replicas` servers: the one chosen by the
+    hash ring and the next ones clockwise. Alternatively, servers can be
+    split into fixed replica groups; the ring then picks a group and keys
+    are stored on all its servers.
+
+    `set`, `add`, `replace`, `append`, `prepend`, `delete`, `touch`,
+    `set_from`, `meta_set`, `meta_delete` and the `_many` variants are
+    replicated, `get` is hedged. `cas`, `incr`, `decr` and
+    `meta_arithmetic` update the first replica and delete the key from the
+    others. Other commands use the first replica only.
+    """
+
+    def __init__(self, servers=(), replicas=2, groups=None, hedge_delay=0.01,
+                 hedge_percentile=None, max_hedge_rate=0.05, **kwargs):
+        """
+        :param servers: list of host/port strings or (host/port, weight)
+        tuples, ignored if `groups` are given
+        :type: list
+        :param replicas: number of servers storing each key
+        :type: int
+        :param groups: lists of host/port strings of servers replicating
+        each other. Eg. [['10.0.0.1:11211', '10.0.0.2:11211'],
+        ['10.0.0.3:11211', '10.0.0.4:11211']]
+        :type: list
+        :param hedge_delay: seconds to wait for the first replica before
+        asking the second one
+        :type: float
+        :param hedge_percentile: follow this percentile of latency of the
+        first replicas instead of `hedge_delay` once enough reads are
+        measured, eg. 95
+        :type: float
+        :param max_hedge_rate: max share of reads which are hedged
+        :type: float
+        Other arguments are passed to DistributedClient.
+        """
+        self._groups = None
+        if groups is not None:
+            self._groups = [[str(Host(host)) for host in group]
+                            for group in groups]
+            servers = [host for group in self._groups for host in group]
+            replicas = max(len(group) for group in self._groups)
+            self._group_ring = HashRing(dict(
+                ('group-{}'.format(i), 1) for i in range(len(groups))))
+
+        super(ReplicatedClient, self).__init__(servers, **kwargs)
+        self._replicas = replicas
+        self._hedge_delay = hedge_delay
+        self._hedge_percentile = hedge_percentile
+        self._max_hedge_rate = max_hedge_rate
+        self._latency = Histogram()
+        self._lock = threading.Lock()
+        self._hedge_budget = 0.0
+        self.reads = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def hedge_stats(self):
+        """
+        Number of hedged reads, hedges sent and hedges which answered first.
+        :rtype: dict
+        """
+        return {
+            'reads': self.reads,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+        }
+
+    @property
+    def hedge_delay(self):
+        """
+        Current delay before hedging in seconds.
+        :rtype: float
+        """
+        if (self._hedge_percentile is not None and
+                self._latency.count >= MIN_HEDGE_SAMPLES):
+            return self._latency.percentile(self._hedge_percentile)
+        return self._hedge_delay
+
+    def _get_replicas(self, key):
+        """
+        Return connection pools of servers storing `key`, the first one
+        being the primary.
+        :param key: checked key
+        :type: bytes
+        :rtype: list
+        """
+        if self._groups is None:
+            nodes = self._ring.get_nodes(key, self._replicas)
+        else:
+            group = self._group_ring.get_node(key)
+            nodes = self._groups[int(group.split('-')[1])]
+        pools = [self._servers[node] for node in nodes
+                 if node in self._servers]
+        if not pools:
+            raise NoServersError('No servers available')
+        return pools
+
+    def _get_pool(self, key):
+        if key is None:
+            return super(ReplicatedClient, self)._get_pool(key)
+        return self._get_replicas(key)[0]
+
+    def _request(self, cmd_name, key, cmd):
+        if key is None:
+            return super(ReplicatedClient, self)._request(cmd_name, key, cmd)
+
+        pools = self._get_replicas(key)
+        if len(pools) > 1:
+            if cmd_name in REPLICATED_COMMANDS:
+                return self._replicated_request(pools, key, cmd)
+            if cmd_name in PRIMARY_COMMANDS:
+                return self._primary_request(pools, key, cmd)
+            if cmd_name == 'set_from':
+                return self._streamed_request(pools, key, cmd)
+            if cmd_name in HEDGED_COMMANDS:
+                return self._hedged_request(pools, cmd)
+        return pools[0].request(cmd)
+
+    def _many_requests(self, cmd_name, cmds_args, noreply=False):
+        if cmd_name not in REPLICATED_COMMANDS:
+            return super(ReplicatedClient, self)._many_requests(
+                cmd_name, cmds_args, noreply)
+
+        replicas = [self._get_replicas(args['key']) for args in cmds_args]
+        requests = []
+        # results of later requests overwrite the earlier ones, so the
+        # primary replicas go last
+        for rank in reversed(range(self._replicas)):
+            groups = OrderedDict()
+            for i, pools in enumerate(replicas):
+                if rank < len(pools):
+                    groups.setdefault(pools[rank], []).append(i)
+
+            for pool, positions in groups.items():
+                for batch in self._batches(positions, MAX_PIPELINE_SIZE):
+                    requests.append((pool, batch, self._protocol.encode_many(
+                        cmd_name, [cmds_args[i] for i in batch], noreply)))
+        return requests
+
+    def _replicated_request(self, pools, key, cmd):
+        """
+        Send the command to all replicas at once. Replicas answering with
+        another status than the primary, eg. `NOT_STORED` of `append` or
+        `EXISTS` of `ms` with CAS, drop the key.
+        :return: response of the primary
+        :rtype: Response
+        """
+        tasks = [self._workers.submit(pool.request, cmd)
+                 for pool in pools[1:]]
+        response = None
+        try:
+            response = pools[0].request(cmd)
+            return response
+        finally:
+            stale = []
+            for pool, task in zip(pools[1:], tasks):
+                try:
+                    replica = task.get()
+                except Exception as exc:
+                    logger.debug('Writing to {} failed: {}'.format(
+                        pool, exc))
+                    self._incr(REPLICA_ERRORS)
+                    continue
+                # replica without the key can't return its old value
+                if (response is not None and
+                        replica.status not in (response.status, NOT_FOUND)):
+                    stale.append(pool)
+            self._delete_replicas(stale, key)
+
+    def _primary_request(self, pools, key, cmd):
+        """
+        Send the command to the primary and delete the key from the other
+        replicas meanwhile.
+        :return: response of the primary
+        :rtype: Response
+        """
+        tasks = self._submit_deletes(pools[1:], key)
+        try:
+            return pools[0].request(cmd)
+        finally:
+            self._wait_deletes(pools[1:], tasks)
+
+    def _streamed_request(self, pools, key, cmd):
+        """
+        Send command with a file body to the replicas one by one, since
+        the file is read again for each of them. Replicas drop the key if
+        the file can't be read again or they answer differently than the
+        primary.
+        :param cmd: list of command parts, the second one being FileBody
+        :return: response of the primary
+        :rtype: Response
+        """
+        response = None
+        stale = []
+        try:
+            response = pools[0].request(cmd)
+            return response
+        finally:
+            for i, pool in enumerate(pools[1:], 1):
+                if response is None or not cmd[1].rewind():
+                    stale.extend(pools[i:])
+                    break
+                try:
+                    if pool.request(cmd).status != response.status:
+                        stale.append(pool)
+                except Exception as exc:
+                    logger.debug('Writing to {} failed: {}'.format(
+                        pool, exc))
+                    self._incr(REPLICA_ERRORS)
+                    stale.append(pool)
+            self._delete_replicas(stale, key)
+
+    def _delete_replicas(self, pools, key):
+        """
+        Delete the key from replicas which may keep its old value.
+        """
+        self._wait_deletes(pools, self._submit_deletes(pools, key))
+
+    def _submit_deletes(self, pools, key):
+        cmd = self._protocol.encode('delete', {'key': key})
+        return [self._workers.submit(pool.request, cmd) for pool in pools]
+
+    def _wait_deletes(self, pools, tasks):
+        for pool, task in zip(pools, tasks):
+            try:
+                task.get()
+            except Exception as exc:
+                logger.warning('Deleting stale key from {} failed: {}'.format(
+                    pool, exc))
+                self._incr(REPLICA_ERRORS)
+
+    def _hedged_request(self, pools, cmd):
+        """
+        Send the command to the primary and, if it doesn't answer within
+        the hedge delay or fails, to the second replica. The primary is sent
+        from a worker, so the calling thread can wait for it with a timeout.
+        When the budget allows no hedge, it's sent from the calling thread.
+        :return: first good response. A miss of the second replica waits
+        for the primary, which may store a key deleted from the others.
+        :rtype: Response
+        """
+        with self._lock:
+            self.reads += 1
+            self._hedge_budget = min(
+                self._hedge_budget + self._max_hedge_rate, MAX_HEDGE_BURST)
+            can_hedge = self._hedge_budget >= 1
+        if not can_hedge:
+            return self._unhedged_request(pools, cmd)
+
+        done = queue.Queue()
+        started = threading.Event()
+        primary = self._workers.submit(
+            self._timed_request, pools[0], cmd, started, done_queue=done)
+        # time spent waiting for a free worker is not server latency, so
+        # the delay runs from the moment the primary is sent
+        started.wait()
+        try:
+            done.get(timeout=self.hedge_delay)
+        except queue.Empty:
+            if not self._take_hedge():
+                return primary.get()
+            pending = [primary]
+        else:
+            # failed primary is replaced regardless of the budget
+            if _answered(primary):
+                return primary.get()
+            pending = []
+
+        self._count_hedge()
+        hedge = self._workers.submit(pools[1].request, cmd, done_queue=done)
+        pending.append(hedge)
+        while pending:
+            task = done.get()
+            pending.remove(task)
+            if not _answered(task):
+                continue
+            if task is hedge and primary in pending and not _found(task):
+                continue
+            if task is hedge:
+                self._count_hedge_win()
+            return task.get()
+        if _answered(hedge):
+            self._count_hedge_win()
+            return hedge.get()
+        return primary.get()
+
+    def _unhedged_request(self, pools, cmd):
+        """
+        Send the command to the primary from the calling thread. If it
+        fails, the second replica is asked.
+        :rtype: Response
+        """
+        try:
+            response = self._timed_request(pools[0], cmd)
+        except Exception as exc:
+            logger.debug('Reading from {} failed: {}'.format(pools[0], exc))
+            response = None
+        if response is not None and response.status is not None:
+            return response
+
+        self._count_hedge()
+        hedge = pools[1].request(cmd)
+        if hedge.status is None and response is not None:
+            return response
+        self._count_hedge_win()
+        return hedge
+
+    def _timed_request(self, pool, cmd, started=None):
+        if started is not None:
+            started.set()
+        start = default_timer()
+        response = pool.request(cmd)
+        self._latency.record(default_timer() - start)
+        return response
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedge_budget < 1:
+                return False
+            self._hedge_budget -= 1
+            return True
+
+    def _count_hedge(self):
+        with self._lock:
+            self.hedges += 1
+        self._incr(HEDGES)
+
+    def _count_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+        self._incr(HEDGE_WINS)
+
+    def _incr(self, counter):
+        if self._metrics is not None:
+            self._metrics.incr(counter)
+
+
+def _answered(task):
+    """
+    Return True if the request finished with a complete reply.
+    :type: Task
+    :rtype: bool
+    """
+    return not task.failed and task.result.status is not None
+
+
+def _found(task):
+    """
+    Return True if the answered request found any value.
+    :type: Task
+    :rtype: bool
+    """
+    return bool(task.result.values)
@@ -1,36 +1,497 @@
+from collections import deque, namedtuple
+
+
+# Initial size of the parser buffer. It grows when needed.
+READ_BUFFER_SIZE = 16384
+
+# Types of results emitted by ResponseParser
+VALUE = 'value'
+END = 'end'
+STORED = 'stored'
+NOT_STORED = 'not_stored'
+EXISTS = 'exists'
+NOT_FOUND = 'not_found'
+DELETED = 'deleted'
+TOUCHED = 'touched'
+OK = 'ok'
+NUMERIC = 'numeric'
+ERROR = 'error'
+# results of meta commands: HD, VA and EN
+META_OK = 'meta_ok'
+META_VALUE = 'meta_value'
+META_MISS = 'meta_miss'
+
+STATUS_LINES = {
+    b'END': END,
+    b'STORED': STORED,
+    b'NOT_STORED': NOT_STORED,
+    b'EXISTS': EXISTS,
+    b'NOT_FOUND': NOT_FOUND,
+    b'DELETED': DELETED,
+    b'TOUCHED': TOUCHED,
+    b'OK': OK,
+}
+
+META_LINES = {
+    b'HD': META_OK,
+    b'VA': META_VALUE,
+    b'EN': META_MISS,
+    b'NF': NOT_FOUND,
+    b'NS': NOT_STORED,
+    b'EX': EXISTS,
+    b'MN': END,
+}
+# meta flags returned with numeric tokens
+META_NUMERIC_FLAGS = frozenset('cfhlOst')
+
+
+def parse_meta_flags(tokens):
+    """
+    Parse flags returned by meta command into a dict. Flags without a token,
+    like 'W' (win) or 'X' (stale), are set to True.
+    :param tokens: flag tokens. Eg. [b't30', b'c12', b'W']
+    :type: list
+    :rtype: dict
+    """
+    meta = {}
+    for token in tokens:
+        flag, data = token[:1].decode('ascii'), token[1:]
+        if not data:
+            meta[flag] = True
+        elif flag in META_NUMERIC_FLAGS and data.lstrip(b'-').isdigit():
+            meta[flag] = int(data)
+        else:
+            meta[flag] = data
+    return meta
+
+
+class Result(namedtuple('Result', 'type key value flags cas opaque meta')):
+    """
+    Single result parsed from the server response. Results of quiet,
+    pipelined requests carry `opaque` of the request. Results of meta
+    commands keep all returned flags in `meta`.
+    """
+    __slots__ = ()
+
+    def __new__(cls, type, key=None, value=None, flags=0, cas=None,
+                opaque=None, meta=None):
+        return super(Result, cls).__new__(
+            cls, type, key, value, flags, cas, opaque, meta)
+
+    @property
+    def final(self):
+        """
+        True if it's the last result of a response
+        """
+        return self.type != VALUE and self.opaque is None
+
 
 class Response(object):
     """
-    Class for storing responses from Memcached server.
+    Class for storing responses from Memcached server: values returned by
+    retrieval commands and the final status line.
     """
 
     def __init__(self):
-        self._data = {}
-        self._content = b''
+        self._values = {}
+        self._quiet = {}
+        self._status = None
 
-    def write(self, data):
-        if data:
-            self._content += data
+    def add(self, result):
+        """
+        Add parsed result to the response.
+        :param result: Result instance
+        :type: Result
+        """
+        if result.type == VALUE:
+            self._values[result.key] = result
+        elif result.opaque is not None:
+            self._quiet[result.opaque] = result
+        else:
+            self._status = result
 
     def __setitem__(self, key, value):
-        self._data[key] = value
+        self._values[key] = Result(VALUE, key, value)
 
     def __getitem__(self, item):
-        return self._data.get(item)
+        result = self._values.get(item)
+        return result.value if result else None
 
     @property
-    def content(self):
-        return self._content
+    def data(self):
+        return dict((key, result.value)
+                    for key, result in self._values.items())
 
     @property
-    def data(self):
-        return self._data
+    def values(self):
+        return self._values
+
+    @property
+    def quiet(self):
+        """
+        Dict of opaques and results of quiet requests, which reported
+        anything other than a value
+        """
+        return self._quiet
+
+    @property
+    def result(self):
+        """
+        Final result or None if response is incomplete
+        """
+        return self._status
+
+    @property
+    def status(self):
+        """
+        Type of the final result or None if response is incomplete
+        """
+        return self._status.type if self._status else None
+
+    @property
+    def error(self):
+        if self.status == ERROR:
+            return self._status.value
 
     def is_valid(self):
         """
         Return True if response is valid
         :rtype: bool
         """
+        return self.status != ERROR
+
+
+class BytesSink(object):
+    """
+    Receives value body into a bytearray of the value size, which becomes
+    the value without a copy.
+    """
+
+    def __init__(self):
+        self.value = None
+        self._view = None
+        self._end = 0
+
+    def open(self, length):
+        """
+        Prepare for value body of `length` bytes.
+        """
+        self.value = bytearray(length)
+        self._view = memoryview(self.value)
+        self._end = 0
+
+    def write(self, data):
+        """
+        Copy part of the body, which was already received.
+        """
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        self._finish()
+
+    def get_buffer(self):
+        """
+        Return memoryview to receive the rest of the body into.
+        """
+        return self._view[self._end:]
+
+    def written(self, nbytes):
+        """
+        Commit `nbytes` received into `get_buffer()`.
+        """
+        self._end += nbytes
+        self._finish()
+
+    def _finish(self):
+        if self._end == len(self._view):
+            # exported view would keep the value from being resized
+            self._view = None
+
+
+class BufferSink(BytesSink):
+    """
+    Receives value body into caller's writable buffer. Value is the number
+    of received bytes, or None if the buffer was too small. Bodies not
+    fitting into the buffer are drained and dropped.
+    """
+
+    def __init__(self, buffer):
+        super(BufferSink, self).__init__()
+        self._buffer = memoryview(buffer)
+        self._discard = None
+
+    def open(self, length):
+        self._end = 0
+        if length > len(self._buffer):
+            self._discard = DiscardSink()
+            self._discard.open(length)
+            self.value = None
+        else:
+            self._discard = None
+            self._view = self._buffer[:length]
+            self.value = length
+
+    def write(self, data):
+        (self._discard or super(BufferSink, self)).write(data)
+
+    def get_buffer(self):
+        return (self._discard or super(BufferSink, self)).get_buffer()
+
+    def written(self, nbytes):
+        (self._discard or super(BufferSink, self)).written(nbytes)
+
+
+class FileSink(object):
+    """
+    Writes value body to a file object in chunks, so at most `chunk_size`
+    bytes of the value are kept in memory. Value is the number of written
+    bytes.
+    """
+
+    def __init__(self, file_obj, chunk_size=READ_BUFFER_SIZE * 4):
+        self._file = file_obj
+        self._chunk = memoryview(bytearray(chunk_size))
+        self._remaining = 0
+        self.value = None
+
+    def open(self, length):
+        self._remaining = length
+        self.value = length
+
+    def write(self, data):
+        self._file.write(data)
+        self._remaining -= len(data)
+
+    def get_buffer(self):
+        return self._chunk[:min(len(self._chunk), self._remaining)]
+
+    def written(self, nbytes):
+        self.write(self._chunk[:nbytes])
+
+
+class DiscardSink(FileSink):
+    """
+    Receives value body and drops it.
+    """
+
+    def __init__(self, chunk_size=READ_BUFFER_SIZE):
+        super(DiscardSink, self).__init__(None, chunk_size)
+
+    def write(self, data):
+        self._remaining -= len(data)
+
+
+class ResponseParser(object):
+    """
+    Incremental parser of Memcached responses. Received data is written
+    to `get_buffer()` and committed with `buffer_updated()` or copied with
+    `feed()`. Parsed results are returned by `next_result()`.
+
+    Value bodies which don't fit into the buffer are received directly into
+    a bytearray of the value size, so they are never copied and are
+    returned as bytearray, unlike smaller values returned as bytes. When
+    `sink` is set, all value bodies are streamed to it instead.
+    """
+
+    # number of bytes following value body
+    VALUE_TRAILER = 2
+
+    def __init__(self, buffer_size=READ_BUFFER_SIZE):
+        self._buffer = bytearray(buffer_size)
+        # unparsed data lives in self._buffer[self._start:self._end]
+        self._start = self._end = 0
+        # value being read: its header, length and sink receiving the body
+        self._header = None
+        self._length = 0
+        self._value = None
+        self._value_end = 0
+        self.sink = None
+        # bytes of `\r\n` after value body still to skip
+        self._skip = 0
+        self._results = deque()
+
+    def reset(self):
+        """
+        Drop all unparsed data and results.
+        """
+        self._start = self._end = 0
+        self._header = self._value = None
+        self._skip = 0
+        self._results.clear()
+
+    def get_buffer(self, sizehint=0):
+        """
+        Return memoryview to write received data to.
+        :param sizehint: minimum number of bytes expected to be written
+        :type: int
+        :rtype: memoryview
+        """
+        if self._value is not None:
+            return self._value.get_buffer()
+
+        sizehint = max(sizehint, 1)
+        if self._start == self._end:
+            self._start = self._end = 0
+        if len(self._buffer) - self._end < sizehint:
+            self._compact()
+            if len(self._buffer) - self._end < sizehint:
+                self._grow(self._end + sizehint)
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """
+        Parse `nbytes` written to the buffer returned by `get_buffer()`.
+        :param nbytes: number of written bytes
+        :type: int
+        """
+        if self._value is not None:
+            self._value.written(nbytes)
+            self._value_end += nbytes
+        else:
+            self._end += nbytes
+        self._parse()
+
+    def feed(self, data):
+        """
+        Copy `data` to the parser and parse it.
+        :param data: data received from the server
+        :type: bytes
+        """
+        data = memoryview(data)
+        while len(data):
+            buf = self.get_buffer()
+            nbytes = min(len(buf), len(data))
+            buf[:nbytes] = data[:nbytes]
+            self.buffer_updated(nbytes)
+            data = data[nbytes:]
+
+    def next_result(self):
+        """
+        Return next parsed result or None if more data is needed.
+        :rtype: Result | None
+        """
+        if self._results:
+            return self._results.popleft()
+
+    def _parse(self):
+        while True:
+            if self._value is not None:
+                if self._value_end < self._length:
+                    return
+                self._emit_value(self._value.value)
+                self._value = None
+                self._skip = self.VALUE_TRAILER
+
+            if self._skip:
+                skip = min(self._skip, self._end - self._start)
+                self._start += skip
+                self._skip -= skip
+                if self._skip:
+                    return
+
+            if self._header is not None:
+                if not self._parse_value():
+                    return
+                continue
+
+            index = self._buffer.find(b'\r\n', self._start, self._end)
+            if index == -1:
+                return
+            line = bytes(memoryview(self._buffer)[self._start:index])
+            self._start = index + 2
+            self._parse_line(line)
+
+    def _parse_line(self, line):
+        if line.startswith(b'VALUE '):
+            header = line.split()
+            self._header = Result(
+                VALUE, header[1], flags=int(header[2]),
+                cas=int(header[4]) if len(header) > 4 else None)
+            self._length = int(header[3])
+        elif line in STATUS_LINES:
+            self._results.append(Result(STATUS_LINES[line]))
+        elif line[:2] in META_LINES and line[2:3] in (b'', b' '):
+            self._parse_meta_line(META_LINES[line[:2]], line.split()[1:])
+        elif line.strip().isdigit():
+            self._results.append(Result(NUMERIC, value=int(line)))
+        else:
+            # ERROR, CLIENT_ERROR, SERVER_ERROR or garbage
+            self._results.append(Result(ERROR, value=line))
+
+    def _parse_meta_line(self, type, tokens):
+        """
+        Parse response line of meta command: `VA <size> <flags>*` header of
+        a value or status line with flags.
+        """
+        if type == META_VALUE:
+            self._length = int(tokens.pop(0))
+
+        meta = parse_meta_flags(tokens)
+        result = Result(type, meta.get('k'), flags=meta.get('f', 0),
+                        cas=meta.get('c'), opaque=meta.get('O'), meta=meta)
+        if type == META_VALUE:
+            self._header = result
+        else:
+            self._results.append(result)
+
+    def _parse_value(self):
+        """
+        Parse value body of the current header.
+        :return: False if more data is needed
+        :rtype: bool
+        """
+        available = self._end - self._start
+
+        if self.sink is not None and self._streams_value():
+            sink = self.sink
+        elif self._length > len(self._buffer):
+            sink = BytesSink()
+        else:
+            sink = None
+
+        if sink is not None:
+            # receive the rest of the body directly into the sink
+            copied = min(available, self._length)
+            sink.open(self._length)
+            sink.write(memoryview(self._buffer)[
+                self._start:self._start + copied])
+            self._value = sink
+            self._value_end = copied
+            self._start += copied
+            return True
+
+        needed = self._length + self.VALUE_TRAILER
+        if available < needed:
+            if self._start + needed > len(self._buffer):
+                self._compact()
+            return False
+
+        self._emit_value(bytes(memoryview(self._buffer)[
+            self._start:self._start + self._length]))
+        self._start += needed
+        return True
+
+    def _streams_value(self):
+        """
+        Return True if body of the current header is a value.
+        """
+        return self._header.type in (VALUE, META_VALUE)
+
+    def _emit_value(self, value):
+        self._results.append(self._header._replace(value=value))
+        self._header = None
+
+    def _compact(self):
+        """
+        Move unparsed data to the beginning of the buffer.
+        """
+        if self._start:
+            size = self._end - self._start
+            self._buffer[:size] = memoryview(self._buffer)[
+                self._start:self._end]
+            self._start, self._end = 0, size
 
-        # TODO: Would be good to have better error handling. Lack of time :(
-        return b'ERROR' not in self._content
+    def _grow(self, size):
+        new_size = len(self._buffer)
+        while new_size < size:
+            new_size *= 2
+        self._buffer = self._buffer + bytearray(new_size - len(self._buffer))
@@ -0,0 +1,121 @@
+"""
+Serializers turning values into bytes stored in Memcached. Type of the
+value is recorded in the low byte of `flags`, so it's decoded back to the
+same type on read.
+"""
+from __future__ import unicode_literals
+
+import json
+
+import six
+from six.moves import cPickle as pickle
+
+
+# Value types stored in the low byte of flags
+FLAG_BYTES = 0
+FLAG_TEXT = 1
+FLAG_INTEGER = 2
+FLAG_PICKLE = 3
+FLAG_JSON = 4
+TYPE_MASK = 0xff
+
+BUILTIN_TYPES = frozenset(
+    [FLAG_BYTES, FLAG_TEXT, FLAG_INTEGER, FLAG_PICKLE, FLAG_JSON])
+
+
+class Serializer(object):
+    """
+    Default serializer. Bytes are stored as they are, text as utf-8 and
+    integers as decimal digits, so `incr` and `decr` work on them. Other
+    values are pickled or dumped to JSON, depending on `fallback`.
+
+    Custom types are added with `register`.
+    """
+
+    def __init__(self, fallback=FLAG_PICKLE,
+                 pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        """
+        :param fallback: FLAG_PICKLE or FLAG_JSON, used for values of other
+        types
+        :type: int
+        :param pickle_protocol: protocol of pickled values
+        :type: int
+        """
+        if fallback not in (FLAG_PICKLE, FLAG_JSON):
+            raise ValueError('Fallback has to be FLAG_PICKLE or FLAG_JSON')
+
+        self._fallback = fallback
+        self._pickle_protocol = pickle_protocol
+        # list of (types, type flag, dumps) of custom types
+        self._custom = []
+        self._loads = {
+            FLAG_BYTES: None,
+            FLAG_TEXT: self._loads_text,
+            FLAG_INTEGER: self._loads_integer,
+            FLAG_PICKLE: self._loads_pickle,
+            FLAG_JSON: self._loads_json,
+        }
+
+    def register(self, type_flag, types, dumps, loads):
+        """
+        Register serializer of custom type.
+        :param type_flag: value type recorded in flags, 5-255
+        :type: int
+        :param types: class or tuple of classes serialized with `dumps`
+        :param dumps: function returning bytes of a value
+        :type: callable
+        :param loads: function returning value of bytes
+        :type: callable
+        """
+        if type_flag in BUILTIN_TYPES or not 0 < type_flag <= TYPE_MASK:
+            raise ValueError('Invalid type flag: {}'.format(type_flag))
+
+        self._custom.append((types, type_flag, dumps))
+        self._loads[type_flag] = loads
+
+    def serialize(self, value):
+        """
+        Return bytes of `value` and flags recording its type.
+        :rtype: tuple
+        """
+        for types, type_flag, dumps in self._custom:
+            if isinstance(value, types):
+                return dumps(value), type_flag
+
+        if isinstance(value, (six.binary_type, bytearray, memoryview)):
+            return value, FLAG_BYTES
+        elif isinstance(value, six.text_type):
+            return value.encode('utf-8'), FLAG_TEXT
+        elif (isinstance(value, six.integer_types) and
+              not isinstance(value, bool)):
+            return six.text_type(value).encode('ascii'), FLAG_INTEGER
+        elif self._fallback == FLAG_JSON:
+            return json.dumps(value).encode('utf-8'), FLAG_JSON
+        return pickle.dumps(value, self._pickle_protocol), FLAG_PICKLE
+
+    def deserialize(self, data, flags):
+        """
+        Return value of `data` stored with `flags`. Bytes are returned
+        without a copy.
+        """
+        try:
+            loads = self._loads[flags & TYPE_MASK]
+        except KeyError:
+            raise ValueError('Unknown value type in flags: {}'.format(flags))
+        return loads(data) if loads else data
+
+    @staticmethod
+    def _loads_text(data):
+        return data.decode('utf-8')
+
+    @staticmethod
+    def _loads_integer(data):
+        return int(bytes(data))
+
+    @staticmethod
+    def _loads_pickle(data):
+        return pickle.loads(bytes(data))
+
+    @staticmethod
+    def _loads_json(data):
+        return json.loads(data.decode('utf-8'))
@@ -0,0 +1,79 @@
+"""
+Coalescing of concurrent identical requests within one process. While a
+request for a key is in flight, other threads asking for the same key wait
+for its result instead of sending their own.
+"""
+from __future__ import unicode_literals
+
+import sys
+import threading
+
+import six
+
+
+class _Call(object):
+    """
+    Request in flight and its outcome.
+    """
+
+    __slots__ = ('done', 'result', 'exc_info', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        # number of callers waiting for the result
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Runs at most one function call per key at a time, sharing its result
+    or exception with all callers which asked for the key meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # number of calls answered with result of another call
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        Call `func` unless a call for `key` is already in flight, in which
+        case wait for it.
+        :param key: key identifying the call
+        :param func: function without arguments
+        :type: callable
+        :return: result of the call and flag telling if it was shared with
+        other callers, for the caller which made the call too
+        :rtype: tuple
+        :raises: exception raised by the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                self.coalesced += 1
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        # the call is no longer registered, so waiters can't change
+        return call.result, call.waiters > 0
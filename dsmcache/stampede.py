@@ -0,0 +1,92 @@
+"""
+Protection against cache stampedes, used by `Client.get_or_set`.
+
+Values are stored with a stamp holding time it took to compute them and
+their logical expiry. Before the expiry a value is recomputed early with
+probability growing as the expiry approaches (XFetch), so usually one
+caller refreshes it while others still read the old one. Recomputation is
+guarded by a lease, a key added with `add`, which only one client in the
+cluster gets.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import math
+import random
+import struct
+import time
+
+from .nearcache import MAX_RELATIVE_TTL
+
+
+# Bit of flags marking value with a stamp
+FLAG_STAMPED = 1 << 10
+
+# compute time in seconds and logical expiry timestamp, 0 if never
+STAMP = struct.Struct('!dd')
+
+# Longer keys are replaced with their hash in lease keys
+MAX_BASE_KEY_LENGTH = 200
+
+
+def stamp(data, flags, delta, expires_at):
+    """
+    Prepend stamp to serialized value.
+    :param delta: time it took to compute the value in seconds
+    :type: float
+    :param expires_at: logical expiry timestamp or 0
+    :type: float
+    :return: data and flags to store
+    :rtype: tuple
+    """
+    return STAMP.pack(delta, expires_at) + bytes(data), flags | FLAG_STAMPED
+
+
+def unstamp(data, flags):
+    """
+    Split stamp from the value.
+    :return: data, flags, compute time and logical expiry
+    :rtype: tuple
+    """
+    delta, expires_at = STAMP.unpack_from(bytes(data[:STAMP.size]))
+    return data[STAMP.size:], flags & ~FLAG_STAMPED, delta, expires_at
+
+
+def expires_at(ttl, now=None):
+    """
+    Return logical expiry timestamp of value stored with `ttl`.
+    :param ttl: TTL in seconds or unix timestamp, like in Memcached. If 0
+    then never
+    :rtype: float
+    """
+    if not ttl or ttl > MAX_RELATIVE_TTL:
+        return ttl
+    return (now or time.time()) + ttl
+
+
+def should_recompute(delta, expiry, beta=1.0, now=None):
+    """
+    Decide if value should be recomputed before its expiry. Values which
+    take longer to compute are refreshed earlier, `beta` above 1 favours
+    earlier refreshes.
+    :param delta: time it took to compute the value in seconds
+    :param expiry: logical expiry timestamp or 0
+    :rtype: bool
+    """
+    if not expiry:
+        return False
+    now = now or time.time()
+    # 1 - random() is in (0, 1], so log is never infinite
+    return now - delta * beta * math.log(1.0 - random.random()) >= expiry
+
+
+def lease_key(key):
+    """
+    Return key of the lease guarding recomputation of `key`.
+    :param key: checked key
+    :type: bytes
+    :rtype: bytes
+    """
+    if len(key) > MAX_BASE_KEY_LENGTH:
+        key = hashlib.md5(key).hexdigest().encode('ascii')
+    return key + b':lease'
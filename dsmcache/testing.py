@@ -0,0 +1,347 @@
+"""
+In-process stand-in for Memcached speaking the text protocol. It's meant
+for tests and benchmarks, not for storing real data.
+
+    with FakeMemcachedServer() as server:
+        client = Client(server.address)
+"""
+from __future__ import unicode_literals
+
+import os
+import socket
+import threading
+import time
+
+from six.moves import socketserver
+
+
+# Memcached treats TTL above 30 days as unix timestamp
+MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+
+# Replies sent even to commands with `noreply`
+ERROR_REPLIES = (b'CLIENT_ERROR', b'SERVER_ERROR')
+
+
+class ItemTooLarge(Exception):
+    pass
+
+
+class FakeMemcachedHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one client connection. Commands are read line by line and
+    dispatched to `cmd_<name>` methods of the handler.
+    """
+
+    def handle(self):
+        try:
+            self._serve()
+        except socket.error:
+            # client went away
+            pass
+
+    def _serve(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            parts = line.split()
+            if not parts:
+                continue
+
+            noreply = parts[-1] == b'noreply'
+            if noreply:
+                parts = parts[:-1]
+
+            method = getattr(
+                self, 'cmd_' + parts[0].decode('ascii', 'replace'), None)
+            try:
+                reply = method(*parts[1:]) if method else b'ERROR\r\n'
+            except (TypeError, ValueError):
+                reply = b'CLIENT_ERROR bad command line format\r\n'
+            except ItemTooLarge:
+                reply = b'SERVER_ERROR object too large for cache\r\n'
+
+            # like Memcached, errors are sent even with `noreply`
+            if not noreply or reply.startswith(ERROR_REPLIES):
+                self.wfile.write(reply)
+                self.wfile.flush()
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def cmd_get(self, *keys):
+        return self._values(keys, cas=False)
+
+    def cmd_gets(self, *keys):
+        return self._values(keys, cas=True)
+
+    def cmd_gat(self, exptime, *keys):
+        return self._values(keys, cas=False, exptime=exptime)
+
+    def cmd_gats(self, exptime, *keys):
+        return self._values(keys, cas=True, exptime=exptime)
+
+    def cmd_set(self, key, flags, exptime, size):
+        value = self._read_value(size)
+        self.store.set(key, value, int(flags), int(exptime))
+        return b'STORED\r\n'
+
+    def cmd_add(self, key, flags, exptime, size):
+        value = self._read_value(size)
+        if self.store.get(key) is not None:
+            return b'NOT_STORED\r\n'
+        self.store.set(key, value, int(flags), int(exptime))
+        return b'STORED\r\n'
+
+    def cmd_replace(self, key, flags, exptime, size):
+        value = self._read_value(size)
+        if self.store.get(key) is None:
+            return b'NOT_STORED\r\n'
+        self.store.set(key, value, int(flags), int(exptime))
+        return b'STORED\r\n'
+
+    def cmd_append(self, key, flags, exptime, size):
+        return self._concat(key, self._read_value(size), append=True)
+
+    def cmd_prepend(self, key, flags, exptime, size):
+        return self._concat(key, self._read_value(size), append=False)
+
+    def cmd_cas(self, key, flags, exptime, size, cas):
+        value = self._read_value(size)
+        with self.store.lock:
+            item = self.store.get(key)
+            if item is None:
+                return b'NOT_FOUND\r\n'
+            if item[2] != int(cas):
+                return b'EXISTS\r\n'
+            self.store.set(key, value, int(flags), int(exptime))
+        return b'STORED\r\n'
+
+    def cmd_delete(self, key):
+        if self.store.delete(key):
+            return b'DELETED\r\n'
+        return b'NOT_FOUND\r\n'
+
+    def cmd_touch(self, key, exptime):
+        if self.store.touch(key, int(exptime)):
+            return b'TOUCHED\r\n'
+        return b'NOT_FOUND\r\n'
+
+    def cmd_incr(self, key, delta):
+        return self._counter(key, int(delta))
+
+    def cmd_decr(self, key, delta):
+        return self._counter(key, -int(delta))
+
+    def cmd_flush_all(self, *args):
+        self.store.clear()
+        return b'OK\r\n'
+
+    def cmd_mn(self):
+        return b'MN\r\n'
+
+    def cmd_version(self):
+        return b'VERSION 1.6.0-fake\r\n'
+
+    def _read_value(self, size):
+        data = self.rfile.read(int(size) + 2)
+        limit = self.server.item_size_limit
+        if limit is not None and len(data) - 2 > limit:
+            raise ItemTooLarge()
+        return data[:-2]
+
+    def _values(self, keys, cas, exptime=None):
+        reply = []
+        for key in keys:
+            if exptime is not None:
+                self.store.touch(key, int(exptime))
+            item = self.store.get(key)
+            if item is None:
+                continue
+            value, flags, unique = item
+            header = [b'VALUE', key, str(flags).encode('ascii'),
+                      str(len(value)).encode('ascii')]
+            if cas:
+                header.append(str(unique).encode('ascii'))
+            reply.extend([b' '.join(header), b'\r\n', value, b'\r\n'])
+        reply.append(b'END\r\n')
+        return b''.join(reply)
+
+    def _concat(self, key, data, append):
+        with self.store.lock:
+            item = self.store.get(key)
+            if item is None:
+                return b'NOT_STORED\r\n'
+            value, flags, _ = item
+            value = value + data if append else data + value
+            self.store.set(key, value, flags, keep_ttl=True)
+        return b'STORED\r\n'
+
+    def _counter(self, key, delta):
+        with self.store.lock:
+            item = self.store.get(key)
+            if item is None:
+                return b'NOT_FOUND\r\n'
+            value, flags, _ = item
+            if not value.isdigit():
+                return (b'CLIENT_ERROR cannot increment or decrement '
+                        b'non-numeric value\r\n')
+            value = str(max(int(value) + delta, 0)).encode('ascii')
+            self.store.set(key, value, flags, keep_ttl=True)
+        return value + b'\r\n'
+
+
+class FakeStore(object):
+    """
+    Thread-safe dict of items with expiration.
+    """
+
+    def __init__(self):
+        # key: (value, flags, cas unique, expires_at or None)
+        self._items = {}
+        self._cas = 0
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """
+        Return (value, flags, cas unique) of the item or None.
+        """
+        with self.lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[3] is not None and item[3] <= time.time():
+                del self._items[key]
+                return None
+            return item[:3]
+
+    def set(self, key, value, flags=0, exptime=0, keep_ttl=False):
+        with self.lock:
+            if keep_ttl and key in self._items:
+                expires_at = self._items[key][3]
+            else:
+                expires_at = self._expires_at(exptime)
+            self._cas += 1
+            self._items[key] = (value, flags, self._cas, expires_at)
+
+    def delete(self, key):
+        with self.lock:
+            found = self.get(key) is not None
+            self._items.pop(key, None)
+            return found
+
+    def touch(self, key, exptime):
+        with self.lock:
+            if self.get(key) is None:
+                return False
+            value, flags, unique, _ = self._items[key]
+            self._items[key] = (value, flags, unique,
+                                self._expires_at(exptime))
+            return True
+
+    def clear(self):
+        with self.lock:
+            self._items.clear()
+
+    @staticmethod
+    def _expires_at(exptime):
+        if exptime < 0:
+            return 0
+        if exptime == 0:
+            return None
+        if exptime > MAX_RELATIVE_TTL:
+            return exptime
+        return time.time() + exptime
+
+
+class FakeServerMixin(object):
+    """
+    Starting and stopping of fake servers.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+    _thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+        """
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05},
+            name='fake-memcached')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+class FakeMemcachedServer(FakeServerMixin, socketserver.ThreadingMixIn,
+                          socketserver.TCPServer):
+    """
+    Threaded fake Memcached server listening on localhost. Port is chosen
+    by the OS unless given. IPv6 is used for IPv6 `host`, eg. '::1'.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, item_size_limit=None):
+        """
+        :param item_size_limit: max size of stored value in bytes, like
+        `-I` option of Memcached. Unlimited by default
+        :type: int
+        """
+        if ':' in host:
+            self.address_family = socket.AF_INET6
+        socketserver.TCPServer.__init__(
+            self, (host, port), FakeMemcachedHandler)
+        self.store = FakeStore()
+        self.item_size_limit = item_size_limit
+
+    @property
+    def address(self):
+        """
+        host/port string of the server. Eg. '127.0.0.1:54321'
+        """
+        host, port = self.server_address[:2]
+        if self.address_family == socket.AF_INET6:
+            return '[{}]:{}'.format(host, port)
+        return '{}:{}'.format(host, port)
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class FakeMemcachedUnixServer(FakeServerMixin,
+                                  socketserver.ThreadingMixIn,
+                                  socketserver.UnixStreamServer):
+        """
+        Threaded fake Memcached server listening on a Unix socket.
+        """
+
+        def __init__(self, path, item_size_limit=None):
+            socketserver.UnixStreamServer.__init__(
+                self, path, FakeMemcachedHandler)
+            self.store = FakeStore()
+            self.item_size_limit = item_size_limit
+
+        @property
+        def address(self):
+            """
+            Path of the socket prefixed with 'unix:'
+            """
+            return 'unix:' + self.server_address
+
+        def stop(self):
+            super(FakeMemcachedUnixServer, self).stop()
+            os.unlink(self.server_address)
@@ -0,0 +1,130 @@
+"""
+Small pool of daemon threads running requests in the background, used to
+send requests to several servers at once.
+"""
+from __future__ import unicode_literals
+
+import logging
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class Task(object):
+    """
+    Function call submitted to the pool and its outcome.
+    """
+
+    __slots__ = ('func', 'args', 'done', 'result', 'exc_info', '_done_queue')
+
+    def __init__(self, func, args, done_queue=None):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self._done_queue = done_queue
+
+    @property
+    def failed(self):
+        return self.exc_info is not None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def finish(self):
+        self.done.set()
+        if self._done_queue is not None:
+            self._done_queue.put(self)
+
+    def get(self, timeout=None):
+        """
+        Wait for the call to finish.
+        :param timeout: max seconds to wait, None to wait forever
+        :type: float
+        :return: result of the call
+        :raises: exception raised by the call or `queue.Empty` when it
+        didn't finish in time
+        """
+        if not self.done.wait(timeout):
+            raise queue.Empty()
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+        return self.result
+
+
+class WorkerPool(object):
+    """
+    Runs submitted calls in up to `max_workers` threads. Threads are started
+    on demand and live as long as the pool.
+    """
+
+    def __init__(self, max_workers=8, name='dsmcache-worker'):
+        """
+        :param max_workers: max number of threads
+        :type: int
+        :param name: name of the threads
+        :type: str
+        """
+        self._max_workers = max_workers
+        self._name = name
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        # idle threads less queued tasks
+        self._idle = 0
+        self._closed = False
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run `func` with `args` in a worker thread.
+        :param done_queue: queue the task is put to when it finishes, so the
+        caller can wait for the first of several tasks
+        :type: queue.Queue
+        :rtype: Task
+        """
+        task = Task(func, args, kwargs.get('done_queue'))
+        with self._lock:
+            if self._closed:
+                raise ValueError('Worker pool is closed')
+            if self._idle <= 0 and len(self._workers) < self._max_workers:
+                worker = threading.Thread(target=self._work, name=self._name)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            else:
+                self._idle -= 1
+        self._tasks.put(task)
+        return task
+
+    def close(self):
+        """
+        Stop the threads once queued calls are finished.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = len(self._workers)
+        for _ in range(workers):
+            self._tasks.put(None)
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task.run()
+            # idle before the caller learns about it, so its next task
+            # reuses this thread
+            with self._lock:
+                self._idle += 1
+            task.finish()
@@ -12,7 +12,7 @@ setup(name="dsmcache",
       url=meta.__homepage__,
       download_url="http://github.com/r4fek/dsmcache/tarball/master",
       py_modules=["dsmcache"],
-      packages=find_packages(exclude=['tests']),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       install_requires=['six'],
       setup_requires=['pytest-runner'],
       tests_require=['pytest', 'mock'],
@@ -0,0 +1,204 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from mock import Mock
+
+from dsmcache.aio import AsyncClient, AsyncConnectionPool
+from dsmcache.connection import Host
+from dsmcache.exceptions import (
+    ClosedPoolError, EmptyPoolError, CASConflictError)
+from dsmcache.testing import FakeMemcachedServer
+
+
+class AsyncClientTestCase(IsolatedAsyncioTestCase):
+    """
+    Runs the client against a tiny in-process server, which answers `get`
+    and `set` from a dict.
+    """
+
+    async def asyncSetUp(self):
+        self.data = {}
+        self.connections = 0
+        self.server = await asyncio.start_server(
+            self._handle, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = AsyncClient('127.0.0.1:{}'.format(port), pool_size=2)
+
+    async def asyncTearDown(self):
+        self.client.disconnect()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            try:
+                line = await reader.readuntil(b'\r\n')
+            except asyncio.IncompleteReadError:
+                break
+            parts = line.split()
+            if parts[0] == b'get':
+                for key in parts[1:]:
+                    if key in self.data:
+                        flags, value = self.data[key]
+                        writer.write(b'VALUE ' + key + b' ' + flags + b' ' +
+                                     str(len(value)).encode() + b'\r\n' +
+                                     value + b'\r\n')
+                writer.write(b'END\r\n')
+            elif parts[0] == b'set':
+                value = await reader.readexactly(int(parts[4]) + 2)
+                if len(value) > 1024:
+                    # memcached answers even `noreply` sets with errors
+                    writer.write(b'SERVER_ERROR object too large\r\n')
+                else:
+                    self.data[parts[1]] = (parts[2], value[:-2])
+                    if parts[-1] != b'noreply':
+                        writer.write(b'STORED\r\n')
+            elif parts[0] == b'mn':
+                writer.write(b'MN\r\n')
+            else:
+                writer.write(b'ERROR\r\n')
+            await writer.drain()
+        writer.close()
+
+    async def test_get_miss(self):
+        self.assertIsNone(await self.client.get('key'))
+
+    async def test_set_get(self):
+        self.assertTrue(await self.client.set('key', 'val'))
+        self.assertEqual(await self.client.get('key'), 'val')
+
+    async def test_get_many(self):
+        self.assertEqual(
+            await self.client.set_many({'a': '1', 'b': '2'}), [])
+
+        self.assertEqual(await self.client.get_many(['a', 'b', 'c']),
+                         {'a': '1', 'b': '2'})
+
+    async def test_set_many_noreply(self):
+        self.assertEqual(
+            await self.client.set_many({'a': '1'}, noreply=True), [])
+
+        self.assertEqual(await self.client.get('a'), '1')
+
+    async def test_set_many_noreply_error(self):
+        self.assertEqual(await self.client.set_many(
+            {'a': '1', 'b': 'x' * 2048}, noreply=True), [])
+
+        self.assertEqual(await self.client.get('a'), '1')
+        self.assertIsNone(await self.client.get('b'))
+
+    async def test_concurrent_requests_share_pool(self):
+        await self.client.set('key', 'val')
+
+        results = await asyncio.gather(
+            *[self.client.get('key') for _ in range(200)])
+
+        self.assertEqual(results, ['val'] * 200)
+        self.assertLessEqual(self.connections, 2)
+
+
+class AsyncClientCommandsTestCase(IsolatedAsyncioTestCase):
+    """
+    Runs the client against the bundled fake server.
+    """
+
+    async def asyncSetUp(self):
+        self.server = FakeMemcachedServer()
+        self.server.start()
+        self.client = AsyncClient(self.server.address)
+
+    async def asyncTearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    async def test_add_replace(self):
+        self.assertFalse(await self.client.replace('key', 'val'))
+        self.assertTrue(await self.client.add('key', 'val'))
+        self.assertFalse(await self.client.add('key', 'other'))
+        self.assertTrue(await self.client.replace('key', 'new'))
+
+        self.assertEqual(await self.client.get('key'), 'new')
+
+    async def test_append_prepend(self):
+        self.assertFalse(await self.client.append('key', b'b'))
+        await self.client.set('key', b'b')
+
+        self.assertTrue(await self.client.append('key', b'c'))
+        self.assertTrue(await self.client.prepend('key', b'a'))
+        self.assertEqual(await self.client.get('key'), b'abc')
+
+    async def test_gets_cas(self):
+        self.assertEqual(await self.client.gets('key'), (None, None))
+        await self.client.set('key', 'val')
+
+        value, cas = await self.client.gets('key')
+        self.assertEqual(value, 'val')
+        self.assertTrue(await self.client.cas('key', 'new', cas))
+        self.assertFalse(await self.client.cas('key', 'other', cas))
+        self.assertEqual(await self.client.get('key'), 'new')
+
+    async def test_gat_gats(self):
+        await self.client.set('key', 'val')
+
+        self.assertEqual(await self.client.gat('key', 100), 'val')
+        value, cas = await self.client.gats('key', 100)
+        self.assertEqual(value, 'val')
+        self.assertIsNotNone(cas)
+        self.assertIsNone(await self.client.gat('missing'))
+
+    async def test_incr_decr(self):
+        self.assertIsNone(await self.client.incr('counter'))
+        await self.client.set('counter', 10)
+
+        self.assertEqual(await self.client.incr('counter', 5), 15)
+        self.assertEqual(await self.client.decr('counter', 20), 0)
+
+    async def test_cas_update(self):
+        self.assertEqual(
+            await self.client.cas_update('key', lambda value: 1), 1)
+        self.assertEqual(await self.client.cas_update(
+            'key', lambda value: value + 1), 2)
+        self.assertEqual(await self.client.get('key'), 2)
+
+    async def test_cas_update_conflict(self):
+        await self.client.set('key', 1)
+
+        def conflict(value):
+            data, flags, _ = self.server.store.get(b'key')
+            self.server.store.set(b'key', data, flags)
+            return value + 1
+
+        with self.assertRaises(CASConflictError):
+            await self.client.cas_update('key', conflict, retries=1)
+
+
+class AsyncConnectionPoolTestCase(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.pool = AsyncConnectionPool(Host('127.0.0.1:11211'), pool_size=1,
+                                        timeout=0.01)
+
+    async def test_request_closed_pool(self):
+        self.pool.close()
+
+        with self.assertRaises(ClosedPoolError):
+            await self.pool.request(b'get a\r\n')
+
+    async def test_request_empty_pool(self):
+        await self.pool._get_connection()
+
+        with self.assertRaises(EmptyPoolError):
+            await self.pool.request(b'get a\r\n')
+
+    async def test_cancelled_request_closes_connection(self):
+        connection = Mock()
+        connection.connect.side_effect = asyncio.CancelledError()
+        self.pool._pool = asyncio.LifoQueue()
+        self.pool._pool.put_nowait(connection)
+
+        with self.assertRaises(asyncio.CancelledError):
+            await self.pool.request(b'get a\r\n')
+
+        connection.close.assert_called_once_with()
+        self.assertEqual(self.pool._pool.qsize(), 1)
@@ -0,0 +1,170 @@
+from __future__ import unicode_literals
+from unittest import TestCase
+
+from dsmcache.binary import (
+    BinaryProtocol, BinaryResponseParser, HEADER, FLAGS, RESPONSE_MAGIC,
+    OP_GET, OP_GETKQ, OP_SET, OP_DELETE, OP_DELETEQ, OP_INCREMENT,
+    OP_NOOP, OP_TOUCH, STATUS_KEY_NOT_FOUND, packet)
+from dsmcache.exceptions import UnsupportedCommandError
+from dsmcache.response import (
+    Response, Result, VALUE, END, STORED, NOT_STORED, DELETED, NOT_FOUND,
+    NUMERIC, ERROR)
+
+
+def response_packet(opcode, status=0, key=b'', extras=b'', value=b'',
+                    opaque=0, cas=0):
+    return HEADER.pack(
+        RESPONSE_MAGIC, opcode, len(key), len(extras), 0, status,
+        len(extras) + len(key) + len(value), opaque, cas
+    ) + extras + key + value
+
+
+class BinaryResponseParserTestCase(TestCase):
+
+    def setUp(self):
+        self.parser = BinaryResponseParser()
+
+    def results(self):
+        results = []
+        result = self.parser.next_result()
+        while result:
+            results.append(result)
+            result = self.parser.next_result()
+        return results
+
+    def test_get_hit(self):
+        self.parser.feed(response_packet(
+            OP_GET, extras=FLAGS.pack(3), value=b'value', cas=7))
+
+        self.assertEqual(self.results(), [
+            Result(VALUE, b'', b'value', 3, 7), Result(END)])
+
+    def test_get_miss(self):
+        self.parser.feed(response_packet(
+            OP_GET, status=STATUS_KEY_NOT_FOUND, value=b'Not found'))
+
+        self.assertEqual(self.results(), [Result(END)])
+
+    def test_quiet_get_many(self):
+        data = (response_packet(OP_GETKQ, key=b'a', extras=FLAGS.pack(0),
+                                value=b'1', opaque=0) +
+                response_packet(OP_GETKQ, key=b'c', extras=FLAGS.pack(0),
+                                value=b'3', opaque=2) +
+                response_packet(OP_NOOP))
+        for i in range(len(data)):
+            self.parser.feed(data[i:i + 1])
+
+        results = self.results()
+        self.assertEqual([(r.type, r.key, r.value) for r in results], [
+            (VALUE, b'a', b'1'), (VALUE, b'c', b'3'), (END, None, None)])
+        self.assertEqual([r.final for r in results], [False, False, True])
+
+    def test_quiet_failure_carries_opaque(self):
+        self.parser.feed(response_packet(
+            OP_DELETEQ, status=STATUS_KEY_NOT_FOUND, value=b'Not found',
+            opaque=5) + response_packet(OP_NOOP))
+
+        self.assertEqual(self.results(), [
+            Result(NOT_FOUND, opaque=5), Result(END)])
+
+    def test_statuses(self):
+        self.parser.feed(
+            response_packet(OP_DELETE) +
+            response_packet(OP_INCREMENT, value=b'\0' * 7 + b'\x2a') +
+            response_packet(OP_TOUCH, status=0x81, value=b'Unknown command'))
+
+        self.assertEqual(self.results(), [
+            Result(DELETED), Result(NUMERIC, value=42),
+            Result(ERROR, value=b'Unknown command')])
+
+    def test_value_larger_than_buffer(self):
+        parser = BinaryResponseParser(buffer_size=32)
+        parser.feed(response_packet(OP_GET, extras=FLAGS.pack(0),
+                                    value=b'x' * 100))
+
+        result = parser.next_result()
+        self.assertEqual(result.value, b'x' * 100)
+        self.assertIsInstance(result.value, bytearray)
+        self.assertEqual(parser.next_result(), Result(END))
+
+
+class BinaryProtocolTestCase(TestCase):
+
+    def setUp(self):
+        self.protocol = BinaryProtocol()
+
+    def test_encode_get(self):
+        self.assertEqual(self.protocol.encode('get', {'key': b'key'}),
+                         HEADER.pack(0x80, OP_GET, 3, 0, 0, 0, 3, 0, 0) +
+                         b'key')
+
+    def test_encode_set(self):
+        cmd = self.protocol.encode('set', {
+            'key': b'k', 'value': 'val', 'flags': 1, 'time': 10, 'size': 3})
+
+        self.assertEqual(cmd, HEADER.pack(0x80, 0x01, 1, 8, 0, 0, 12, 0, 0) +
+                         b'\0\0\0\x01\0\0\0\x0a' + b'k' + b'val')
+
+    def test_encode_stream(self):
+        args = {'key': b'k', 'value': b'val', 'flags': 1, 'time': 10,
+                'size': 3}
+        head, tail = self.protocol.encode_stream('set', args)
+
+        self.assertEqual(head + b'val' + tail,
+                         self.protocol.encode('set', args))
+
+    def test_encode_cas(self):
+        cmd = self.protocol.encode('cas', {
+            'key': b'k', 'value': b'val', 'flags': 0, 'time': 0, 'size': 3,
+            'cas': 77})
+
+        self.assertEqual(HEADER.unpack_from(cmd)[1], OP_SET)
+        self.assertEqual(HEADER.unpack_from(cmd)[-1], 77)
+
+    def test_encode_incr(self):
+        cmd = self.protocol.encode('incr', {'key': b'k', 'delta': 5})
+
+        self.assertEqual(cmd, HEADER.pack(0x80, 0x05, 1, 20, 0, 0, 21, 0, 0) +
+                         b'\0' * 7 + b'\x05' + b'\0' * 8 + b'\xff' * 4 +
+                         b'k')
+
+    def test_encode_get_many(self):
+        self.assertEqual(self.protocol.encode_get_many([b'a', b'b']),
+                         packet(OP_GETKQ, b'a') + packet(OP_GETKQ, b'b') +
+                         packet(OP_NOOP))
+
+    def test_encode_many_quiet(self):
+        cmds = self.protocol.encode_many('delete', [{'key': b'a'},
+                                                    {'key': b'b'}])
+
+        self.assertEqual(cmds, [packet(OP_DELETEQ, b'a', opaque=0) +
+                                packet(OP_DELETEQ, b'b', opaque=1) +
+                                packet(OP_NOOP)])
+
+    def test_encode_many_without_quiet_opcode(self):
+        cmds = self.protocol.encode_many('touch', [{'key': b'a', 'time': 1}])
+
+        self.assertEqual(len(cmds), 1)
+        self.assertEqual(HEADER.unpack_from(cmds[0])[1], OP_TOUCH)
+
+    def test_encode_meta_unsupported(self):
+        for cmd_name in ('mg', 'ms', 'md', 'ma', 'mn'):
+            self.assertRaises(UnsupportedCommandError, self.protocol.encode,
+                              cmd_name, {'key': b'a'})
+        self.assertRaises(UnsupportedCommandError, self.protocol.encode_many,
+                          'mg', [{'key': b'a'}])
+
+    def test_split_responses(self):
+        response = Response()
+        response.add(Result(NOT_STORED, opaque=1))
+        response.add(Result(END))
+
+        split = self.protocol.split_responses('set', [response], 3)
+
+        self.assertEqual([r.status for r in split],
+                         [STORED, NOT_STORED, STORED])
+
+    def test_split_responses_incomplete(self):
+        split = self.protocol.split_responses('set', [Response()], 2)
+
+        self.assertEqual([r.status for r in split], [None, None])
@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from mock import patch, Mock
+
+from dsmcache.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+@patch('dsmcache.breaker.time.time')
+class CircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.listener = Mock()
+        self.breaker = CircuitBreaker(
+            'host', failure_threshold=3, error_rate=0.5, window=4,
+            reset_timeout=1, max_reset_timeout=3, listeners=[self.listener])
+
+    def fail(self, count=1):
+        for _ in range(count):
+            self.breaker.record(False)
+
+    def test_opens_after_failures_in_row(self, time_mock):
+        time_mock.return_value = 100
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.fail()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.listener.assert_called_once_with('host', CLOSED, OPEN)
+
+    def test_opens_on_error_rate(self, time_mock):
+        time_mock.return_value = 100
+        for success in (True, False, True, False):
+            self.breaker.record(success)
+
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_success_resets_failures(self, time_mock):
+        time_mock.return_value = 100
+        self.breaker = CircuitBreaker(failure_threshold=2, error_rate=None)
+        for _ in range(3):
+            self.fail()
+            self.breaker.record(True)
+
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_single_probe(self, time_mock):
+        time_mock.return_value = 100
+        self.fail(3)
+
+        time_mock.return_value = 101
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        transitions = [call[0][1:] for call in self.listener.call_args_list]
+        self.assertEqual(transitions, [
+            (CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_failed_probe_backs_off(self, time_mock):
+        time_mock.return_value = 100
+        self.fail(3)
+
+        for now, timeout in ((101, 2), (103, 3), (106, 3)):
+            time_mock.return_value = now
+            self.assertTrue(self.breaker.allow())
+            self.fail()
+            self.assertEqual(self.breaker.state, OPEN)
+            time_mock.return_value = now + timeout - 0.5
+            self.assertFalse(self.breaker.allow())
+
+    def test_release_probe(self, time_mock):
+        time_mock.return_value = 100
+        self.fail(3)
+        time_mock.return_value = 101
+        self.breaker.allow()
+
+        self.breaker.release()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        time_mock.return_value = 102
+        self.assertTrue(self.breaker.allow())
+
+    def test_failing_listener(self, time_mock):
+        time_mock.return_value = 100
+        self.listener.side_effect = ValueError
+
+        self.fail(3)
+
+        self.assertEqual(self.breaker.state, OPEN)
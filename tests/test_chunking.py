@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from dsmcache.chunking import Chunker, Manifest, FLAG_CHUNKED
+
+
+class ChunkerTestCase(TestCase):
+
+    def setUp(self):
+        self.chunker = Chunker(chunk_size=4)
+
+    def test_small_value(self):
+        self.assertIsNone(self.chunker.split(b'key', b'abcd', 0))
+
+    def test_split(self):
+        manifest, chunks = self.chunker.split(b'key', b'0123456789', 3)
+
+        self.assertEqual((manifest.count, manifest.size, manifest.flags),
+                         (3, 10, 3))
+        self.assertEqual([chunk for _, chunk in chunks],
+                         [b'0123', b'4567', b'89'])
+        self.assertEqual([chunk_key for chunk_key, _ in chunks],
+                         manifest.chunk_keys(b'key'))
+        self.assertTrue(chunks[0][0].startswith(b'key:' + manifest.version))
+
+    def test_versions_differ(self):
+        first, _ = self.chunker.split(b'key', b'0123456789', 0)
+        second, _ = self.chunker.split(b'key', b'0123456789', 0)
+
+        self.assertNotEqual(first.version, second.version)
+
+    def test_long_key_is_hashed(self):
+        manifest, chunks = self.chunker.split(b'k' * 250, b'0123456789', 0)
+
+        self.assertTrue(all(len(chunk_key) < 60 for chunk_key, _ in chunks))
+
+
+class ManifestTestCase(TestCase):
+
+    def setUp(self):
+        self.manifest, chunks = Chunker(chunk_size=4).split(
+            b'key', b'0123456789', 1)
+        self.chunks = [chunk for _, chunk in chunks]
+
+    def test_encode_decode(self):
+        data = self.manifest.encode()
+
+        self.assertEqual(Manifest.decode(data, 1 | FLAG_CHUNKED),
+                         self.manifest)
+
+    def test_decode_malformed(self):
+        self.assertIsNone(Manifest.decode(b'abc 1', FLAG_CHUNKED))
+
+    def test_join(self):
+        self.assertEqual(self.manifest.join(self.chunks), b'0123456789')
+
+    def test_join_missing_chunk(self):
+        self.assertIsNone(self.manifest.join([b'0123', None, b'89']))
+
+    def test_join_corrupted_chunk(self):
+        self.assertIsNone(self.manifest.join([b'0123', b'xxxx', b'89']))
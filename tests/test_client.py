@@ -1,10 +1,32 @@
 from __future__ import unicode_literals
+import threading
+from collections import OrderedDict
 from mock import patch, Mock
 
 from unittest import TestCase
 
-from dsmcache.client import Client
-from dsmcache.exceptions import InvalidKeyError
+from dsmcache.binary import BinaryProtocol, BinaryResponseParser
+from dsmcache.client import (
+    Client, DistributedClient, TextProtocol, COMMAND_ENCODERS)
+from dsmcache.compression import Compressor
+from dsmcache.exceptions import (
+    InvalidKeyError, NoServersError, EmptyPoolError, UnsupportedCommandError)
+from dsmcache.nearcache import NearCache
+from dsmcache.serializers import FLAG_TEXT
+from dsmcache.singleflight import SingleFlight
+from dsmcache.response import (
+    Response, ResponseParser, META_OK, EXISTS)
+
+
+def make_response(data):
+    parser = ResponseParser()
+    parser.feed(data)
+    response = Response()
+    result = parser.next_result()
+    while result:
+        response.add(result)
+        result = parser.next_result()
+    return response
 
 
 class ClientTestCase(TestCase):
@@ -28,7 +50,8 @@ class ClientTestCase(TestCase):
                         socket_timeout=socket_timeout)
 
         connection_pool_mock.assert_called_once_with(
-            host_mock.return_value, pool_size=pool_size, timeout=socket_timeout
+            host_mock.return_value, max_size=pool_size,
+            timeout=socket_timeout, parser_cls=ResponseParser, metrics=None
         )
         host_mock.assert_called_once_with(host)
         self.assertEqual(client._pool, connection_pool_mock.return_value)
@@ -54,6 +77,62 @@ class ClientTestCase(TestCase):
         self.assertEqual(cm.exception, check_key_mock.side_effect)
         self.assertFalse(send_mock.called)
 
+    def test_get_many(self):
+        response = Response()
+        response[b'a'] = b'val_a'
+        response[b'c'] = b'val_c'
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [response]
+
+        result = self.client.get_many(['a', 'b', 'c'])
+
+        self.assertEqual(result, {'a': b'val_a', 'c': b'val_c'})
+        self.client._pool.request_many.assert_called_once_with(
+            [b'get a b c\r\n'])
+
+    def test_get_many_undecodable_value(self):
+        self.client._pool = Mock()
+        # unknown value type in flags of `b`
+        self.client._pool.request_many.return_value = [make_response(
+            b'VALUE a 0 1\r\n1\r\nVALUE b 5 1\r\nx\r\nEND\r\n')]
+
+        self.assertEqual(self.client.get_many(['a', 'b']), {'a': b'1'})
+
+    def test_set_reserved_flags(self):
+        self.client._pool = Mock()
+
+        for flags in (1, 0xff, 1 << 8, 1 << 9, 1 << 10):
+            with self.assertRaises(ValueError):
+                self.client.set('key', 'val', flags=flags)
+            with self.assertRaises(ValueError):
+                self.client.set_many({'key': 'val'}, flags=flags)
+        self.assertFalse(self.client._pool.request.called)
+        self.assertFalse(self.client._pool.request_many.called)
+
+    def test_set_user_flags(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'STORED\r\n')
+
+        self.assertTrue(self.client.set('key', 'val', flags=1 << 11))
+        self.client._pool.request.assert_called_once_with(
+            b'set key 2049 0 3\r\nval\r\n')
+
+    @patch('dsmcache.client.MAX_GET_KEYS', 2)
+    def test_get_many_batches(self):
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [Response(), Response()]
+
+        self.assertEqual(self.client.get_many(['a', 'b', 'c']), {})
+        self.client._pool.request_many.assert_called_once_with(
+            [b'get a b\r\n', b'get c\r\n'])
+
+    def test_get_many_no_keys(self):
+        self.client._pool = Mock()
+
+        self.assertEqual(self.client.get_many([]), {})
+        self.assertFalse(self.client._pool.request_many.called)
+
     @patch('dsmcache.client.Client._send_cmd')
     @patch('dsmcache.client.Client._check_key')
     def test_set(self, check_key_mock, send_mock):
@@ -62,8 +141,302 @@ class ClientTestCase(TestCase):
 
         check_key_mock.assert_called_once_with('key')
         send_mock.assert_called_once_with(
-                'set', key=check_key_mock.return_value, value='value', flags=0,
-                time=0, size=len('value'))
+                'set', key=check_key_mock.return_value, value=b'value',
+                flags=FLAG_TEXT, time=0, size=len('value'))
+
+    def test_add(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'NOT_STORED\r\n')
+
+        self.assertFalse(self.client.add('key', 'value', time=10))
+        self.client._pool.request.assert_called_once_with(
+            b'add key 1 10 5\r\nvalue\r\n')
+
+    def test_init_protocol(self):
+        client = Client('127.0.0.1', protocol='binary')
+
+        self.assertIsInstance(client._protocol, BinaryProtocol)
+        self.assertEqual(client._pool._parser_cls, BinaryResponseParser)
+
+    def test_meta_commands_binary_protocol(self):
+        client = Client('127.0.0.1', protocol='binary')
+        client._pool = Mock()
+
+        self.assertRaises(UnsupportedCommandError, client.meta_get, 'key')
+        self.assertRaises(UnsupportedCommandError, client.meta_set,
+                          'key', 'val')
+        self.assertRaises(UnsupportedCommandError, client.meta_get_many,
+                          ['key'])
+        self.assertFalse(client._pool.request.called)
+
+    def test_init_unknown_protocol(self):
+        with self.assertRaises(ValueError):
+            Client('127.0.0.1', protocol='carrier-pigeon')
+
+    def test_set_many(self):
+        stored = make_response(b'STORED\r\n')
+        not_stored = make_response(
+            b'SERVER_ERROR object too large for cache\r\n')
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [stored, not_stored]
+
+        failed = self.client.set_many(
+            OrderedDict([('a', 'val'), ('b', 'big')]), time=10)
+
+        self.assertEqual(failed, ['b'])
+        self.client._pool.request_many.assert_called_once_with(
+            [b'set a 1 10 3\r\nval\r\n', b'set b 1 10 3\r\nbig\r\n'],
+            quiet=False)
+
+    def test_set_many_noreply(self):
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [make_response(
+            b'SERVER_ERROR object too large for cache\r\nMN\r\n')]
+
+        self.assertEqual(self.client.set_many({'a': 'val'}, noreply=True), [])
+        self.client._pool.request_many.assert_called_once_with(
+            [b'set a 1 0 3 noreply\r\nval\r\n', b'mn\r\n'], quiet=True)
+
+    @patch('dsmcache.client.MAX_PIPELINE_SIZE', 1)
+    def test_delete_many(self):
+        deleted = make_response(b'DELETED\r\n')
+        not_found = make_response(b'NOT_FOUND\r\n')
+        self.client._pool = Mock()
+        self.client._pool.request_many.side_effect = [[deleted], [not_found]]
+
+        self.assertEqual(self.client.delete_many(['a', 'b']), ['b'])
+        self.assertEqual(self.client._pool.request_many.call_count, 2)
+
+    def test_touch_many(self):
+        touched = make_response(b'TOUCHED\r\n')
+        not_found = make_response(b'NOT_FOUND\r\n')
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [touched, not_found]
+
+        self.assertEqual(self.client.touch_many(['a', 'b'], time=5), ['b'])
+        self.client._pool.request_many.assert_called_once_with(
+            [b'touch a 5\r\n', b'touch b 5\r\n'], quiet=False)
+
+    def test_get_near_cache(self):
+        self.client._near_cache = NearCache()
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VALUE a 1 3\r\nfoo\r\nEND\r\n')
+
+        self.assertEqual(self.client.get('a'), 'foo')
+        self.assertEqual(self.client.get('a'), 'foo')
+        self.assertEqual(self.client._pool.request.call_count, 1)
+
+        self.client._pool.request.return_value = make_response(
+            b'DELETED\r\n')
+        self.client.delete('a')
+        self.assertNotIn(b'a', self.client._near_cache)
+
+    def test_get_many_near_cache(self):
+        self.client._near_cache = NearCache()
+        self.client._near_cache.set(b'a', 'val_a')
+        response = Response()
+        response[b'b'] = b'val_b'
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [response]
+
+        result = self.client.get_many(['a', 'b'])
+
+        self.assertEqual(result, {'a': 'val_a', 'b': b'val_b'})
+        self.assertIn(b'b', self.client._near_cache)
+        self.client._pool.request_many.assert_called_once_with(
+            [b'get b\r\n'])
+
+    @patch('dsmcache.nearcache._now')
+    def test_set_updates_near_cache(self, now_mock):
+        now_mock.return_value = 100
+        self.client._near_cache = NearCache(ttl=5)
+        self.client._near_cache.set(b'a', 'old')
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'STORED\r\n')
+
+        self.assertTrue(self.client.set('a', 'new', time=2))
+        self.assertEqual(self.client._near_cache.get(b'a'), 'new')
+        now_mock.return_value = 102
+        self.assertIsNone(self.client._near_cache.get(b'a'))
+
+    def test_failed_set_invalidates_near_cache(self):
+        self.client._near_cache = NearCache()
+        self.client._near_cache.set(b'a', 'old')
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'NOT_STORED\r\n')
+
+        self.assertFalse(self.client.add('a', 'new'))
+        self.assertNotIn(b'a', self.client._near_cache)
+
+    @patch('dsmcache.nearcache._now')
+    def test_meta_get_caches_with_ttl(self, now_mock):
+        now_mock.return_value = 100
+        self.client._near_cache = NearCache(ttl=5)
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VA 3 f1 t2\r\nfoo\r\n')
+
+        self.assertEqual(self.client.meta_get('a', ttl=True).value, 'foo')
+        self.assertEqual(self.client._near_cache.get(b'a'), 'foo')
+        now_mock.return_value = 102
+        self.assertIsNone(self.client._near_cache.get(b'a'))
+
+    def test_meta_get_stale_not_cached(self):
+        self.client._near_cache = NearCache()
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VA 3 f1 t2 X\r\nfoo\r\n')
+
+        self.assertEqual(self.client.meta_get('a', ttl=True).value, 'foo')
+        self.assertNotIn(b'a', self.client._near_cache)
+
+    def test_meta_arithmetic_invalidates_near_cache(self):
+        self.client._near_cache = NearCache()
+        self.client._near_cache.set(b'a', 1)
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VA 1\r\n2\r\n')
+
+        self.assertEqual(self.client.meta_arithmetic('a').value, 2)
+        self.assertNotIn(b'a', self.client._near_cache)
+
+    def test_set_get_compressed(self):
+        self.client._compressor = Compressor(threshold=10)
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'STORED\r\n')
+        self.client.set('a', 'x' * 100)
+
+        cmd = self.client._pool.request.call_args[0][0]
+        header, value = cmd.split(b'\r\n', 1)
+        self.assertTrue(header.startswith(b'set a 257 0 '))
+        self.client._pool.request.return_value = make_response(
+            b'VALUE a 257 ' + header.split()[-1] + b'\r\n' + value +
+            b'END\r\n')
+
+        self.assertEqual(self.client.get('a'), 'x' * 100)
+
+    def test_get_coalesced(self):
+        self.client._single_flight = SingleFlight()
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VALUE a 1 3\r\nfoo\r\nEND\r\n')
+
+        self.assertEqual(self.client.get('a'), 'foo')
+        self.client._pool.request.assert_called_once_with(b'get a\r\n')
+
+    def test_get_coalesced_shared_value_copied(self):
+        parser = ResponseParser(buffer_size=16)
+        parser.feed(b'VALUE a 0 20\r\n' + b'x' * 20 + b'\r\nEND\r\n')
+        response = Response()
+        response.add(parser.next_result())
+        response.add(parser.next_result())
+        shared = response[b'a']
+        self.assertIsInstance(shared, bytearray)
+        self.client._single_flight = Mock()
+        self.client._single_flight.do.return_value = (response, True)
+
+        value = self.client.get('a')
+
+        self.assertEqual(value, b'x' * 20)
+        self.assertIsNot(value, shared)
+
+    def test_get_coalesced_error(self):
+        self.client._single_flight = SingleFlight()
+        self.client._pool = Mock()
+        self.client._pool.request.side_effect = EmptyPoolError('Pool is empty')
+
+        with self.assertRaises(EmptyPoolError):
+            self.client.get('a')
+        self.assertEqual(self.client._single_flight._calls, {})
+
+    def test_get_chunked_without_chunker(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VALUE a 513 11\r\nabcd 2 10 1\r\nEND\r\n')
+
+        self.assertIsNone(self.client.get('a'))
+
+    def test_get_many_chunked_without_chunker(self):
+        self.client._pool = Mock()
+        self.client._pool.request_many.return_value = [make_response(
+            b'VALUE a 513 11\r\nabcd 2 10 1\r\n'
+            b'VALUE b 0 1\r\nx\r\nEND\r\n')]
+
+        self.assertEqual(self.client.get_many(['a', 'b']), {'b': b'x'})
+
+    def test_meta_get(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VA 3 f1 t30 c12 W\r\nfoo\r\n')
+
+        result = self.client.meta_get('a', ttl=True, cas=True, vivify=30)
+
+        self.assertEqual(result.value, 'foo')
+        self.assertEqual(result.cas, 12)
+        self.assertEqual(result.meta['t'], 30)
+        self.assertTrue(result.meta['W'])
+        self.client._pool.request.assert_called_once_with(
+            b'mg a f v t c N30\r\n')
+
+    def test_meta_get_miss(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(b'EN\r\n')
+
+        self.assertIsNone(self.client.meta_get('a'))
+
+    def test_meta_get_many(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VA 3 f1 O1\r\nbar\r\nMN\r\n')
+
+        result = self.client.meta_get_many(['a', 'b'])
+
+        self.assertEqual(list(result), ['b'])
+        self.assertEqual(result['b'].value, 'bar')
+        self.assertIsNone(result['b'].opaque)
+        self.client._pool.request.assert_called_once_with(
+            b'mg a f v q O0\r\nmg b f v q O1\r\nmn\r\n')
+
+    def test_meta_set(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(b'EX\r\n')
+
+        result = self.client.meta_set('a', 'val', time=10, mode='add', cas=5)
+
+        self.assertEqual(result.type, EXISTS)
+        self.client._pool.request.assert_called_once_with(
+            b'ms a 3 T10 F1 ME C5\r\nval\r\n')
+
+    def test_meta_set_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.client.meta_set('a', 'val', mode='upsert')
+
+    def test_meta_delete_invalidate(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(b'HD\r\n')
+
+        result = self.client.meta_delete('a', invalidate=True, time=30)
+
+        self.assertEqual(result.type, META_OK)
+        self.client._pool.request.assert_called_once_with(
+            b'md a I T30\r\n')
+
+    def test_meta_arithmetic(self):
+        self.client._pool = Mock()
+        self.client._pool.request.return_value = make_response(
+            b'VA 2\r\n41\r\n')
+
+        result = self.client.meta_arithmetic(
+            'a', delta=2, decrement=True, initial=43, vivify=0)
+
+        self.assertEqual(result.value, 41)
+        self.client._pool.request.assert_called_once_with(
+            b'ma a v D2 MD J43 N0\r\n')
 
     @patch('dsmcache.client.Client._send_cmd')
     @patch('dsmcache.client.Client._check_key')
@@ -79,14 +452,204 @@ class ClientTestCase(TestCase):
     def test_send_cmd(self):
         pass
 
-    def test_parse_cmd(self):
-        pass
-
     def test_check_key_valid(self):
-        pass
+        self.assertEqual(self.client._check_key('key:1'), b'key:1')
+        self.assertEqual(self.client._check_key(b'key\xff'), b'key\xff')
+        self.assertEqual(self.client._check_key('k' * 250), b'k' * 250)
 
     def test_check_key_invalid(self):
-        pass
+        for key in ('key 1', 'key\r\n', 'key\x00', b'key\x7f', 'k' * 251,
+                    '\u0105'):
+            with self.assertRaises(InvalidKeyError):
+                self.client._check_key(key)
+
+    def test_encode(self):
+        protocol = TextProtocol()
+        store = dict(key=b'k', flags=3, time=10, size=2, value=b'va')
+        expected = [
+            ('get', dict(key=b'k'), b'get k\r\n'),
+            ('gets', dict(key=b'k'), b'gets k\r\n'),
+            ('gat', dict(key=b'k', time=10), b'gat 10 k\r\n'),
+            ('gats', dict(key=b'k', time=10), b'gats 10 k\r\n'),
+            ('get_many', dict(keys=b'a b'), b'get a b\r\n'),
+            ('set', store, b'set k 3 10 2\r\nva\r\n'),
+            ('add', store, b'add k 3 10 2\r\nva\r\n'),
+            ('replace', store, b'replace k 3 10 2\r\nva\r\n'),
+            ('append', store, b'append k 3 10 2\r\nva\r\n'),
+            ('prepend', store, b'prepend k 3 10 2\r\nva\r\n'),
+            ('cas', dict(store, cas=7), b'cas k 3 10 2 7\r\nva\r\n'),
+            ('delete', dict(key=b'k'), b'delete k\r\n'),
+            ('touch', dict(key=b'k', time=10), b'touch k 10\r\n'),
+            ('incr', dict(key=b'k', delta=1), b'incr k 1\r\n'),
+            ('decr', dict(key=b'k', delta=1), b'decr k 1\r\n'),
+            ('flush_all', {}, b'flush_all\r\n'),
+            ('mg', dict(key=b'k', flags=' v t'), b'mg k v t\r\n'),
+            ('ms', dict(key=b'k', size=2, flags=' T10', value=b'va'),
+             b'ms k 2 T10\r\nva\r\n'),
+            ('md', dict(key=b'k', flags=' q'), b'md k q\r\n'),
+            ('ma', dict(key=b'k', flags=' D5'), b'ma k D5\r\n'),
+            ('mn', {}, b'mn\r\n'),
+        ]
+        self.assertEqual(sorted(cmd_name for cmd_name, _, _ in expected),
+                         sorted(COMMAND_ENCODERS))
+        for cmd_name, cmd_args, cmd in expected:
+            self.assertEqual(protocol.encode(cmd_name, cmd_args), cmd)
+
+    def test_encode_noreply(self):
+        protocol = TextProtocol()
+
+        self.assertEqual(
+            protocol.encode('set', dict(key=b'k', flags=0, time=0, size=1,
+                                        value=b'v', noreply=' noreply')),
+            b'set k 0 0 1 noreply\r\nv\r\n')
+        self.assertEqual(
+            protocol.encode('delete', dict(key=b'k', noreply=' noreply')),
+            b'delete k noreply\r\n')
+        self.assertEqual(
+            protocol.encode_many('delete', [{'key': b'k'}], noreply=True),
+            [b'delete k noreply\r\n', b'mn\r\n'])
+
+    @patch('dsmcache.client.VECTORED_VALUE_SIZE', 4)
+    def test_encode_large_value(self):
+        value = bytearray(b'value')
+
+        cmd = TextProtocol().encode('set', dict(
+            key=b'k', flags=0, time=0, size=len(value), value=value))
+
+        self.assertEqual(cmd, [b'set k 0 0 5\r\n', value, b'\r\n'])
+        self.assertIs(cmd[1], value)
 
     def test_disconnect(self):
         pass
+
+
+class DistributedClientTestCase(TestCase):
+
+    def setUp(self):
+        self.servers = ['127.0.0.1:11211', ('127.0.0.1:11212', 2)]
+        self.client = DistributedClient(self.servers)
+
+    def tearDown(self):
+        self.client.disconnect()
+
+    def test_init(self):
+        self.assertEqual(sorted(self.client.servers),
+                         ['127.0.0.1:11211', '127.0.0.1:11212'])
+        self.assertEqual(self.client._ring._weights['127.0.0.1:11212'], 2)
+
+    def test_get_pool(self):
+        node = self.client._ring.get_node(b'key')
+
+        self.assertEqual(self.client._get_pool(b'key'),
+                         self.client._servers[node])
+
+    def test_get_pool_no_servers(self):
+        client = DistributedClient([])
+
+        with self.assertRaises(NoServersError):
+            client.get('key')
+
+    def test_remove_server(self):
+        pool = self.client._servers['127.0.0.1:11211']
+        pool.close = Mock()
+        self.client.remove_server('127.0.0.1:11211')
+
+        pool.close.assert_called_once_with()
+        self.assertEqual(self.client.servers, ['127.0.0.1:11212'])
+        self.assertEqual(self.client._get_pool(b'key'),
+                         self.client._servers['127.0.0.1:11212'])
+
+    def test_get_many(self):
+        pools = dict((name, Mock()) for name in self.client._servers)
+        self.client._servers = pools
+        keys = ['key{}'.format(i) for i in range(20)]
+        for name, pool in pools.items():
+            response = Response()
+            for key in keys:
+                if self.client._ring.get_node(key.encode('ascii')) == name:
+                    response[key.encode('ascii')] = key.encode('ascii')
+            pool.request_many.return_value = [response]
+
+        result = self.client.get_many(keys)
+
+        self.assertEqual(result, dict(
+            (key, key.encode('ascii')) for key in keys))
+        for pool in pools.values():
+            self.assertEqual(pool.request_many.call_count, 1)
+
+    def test_set_many(self):
+        pools = self.mock_pools([])
+        self.assertEqual(
+            self.client.set_many({'a': '1', 'b': '2'}, noreply=True), [])
+
+        sent = []
+        for pool in pools.values():
+            for call in pool.request_many.call_args_list:
+                self.assertEqual(call[0][0][-1], b'mn\r\n')
+                sent.extend(call[0][0][:-1])
+        self.assertEqual(sorted(sent), [b'set a 1 0 1 noreply\r\n1\r\n',
+                                        b'set b 1 0 1 noreply\r\n2\r\n'])
+
+    def mock_pools(self, keys):
+        """
+        Replace pools with mocks answering `get` of their keys.
+        """
+        pools = dict((name, Mock()) for name in self.client._servers)
+        self.client._servers = pools
+        for name, pool in pools.items():
+            response = Response()
+            for key in keys:
+                if self.client._ring.get_node(key.encode('ascii')) == name:
+                    response[key.encode('ascii')] = key.encode('ascii')
+            pool.request_many.return_value = [response]
+        return pools
+
+    def test_get_many_concurrent(self):
+        keys = ['key{}'.format(i) for i in range(20)]
+        pools = self.mock_pools(keys)
+        started = dict((pool, threading.Event()) for pool in pools.values())
+        overlapped = []
+
+        for pool, event in started.items():
+            def request_many(cmds, pool=pool, event=event):
+                event.set()
+                overlapped.append(all(
+                    other.wait(1) for other in started.values()))
+                return pool.request_many.return_value
+            pool.request_many.side_effect = request_many
+
+        self.assertEqual(len(self.client.get_many(keys)), len(keys))
+        self.assertEqual(overlapped, [True, True])
+
+    def test_get_many_partial_failure(self):
+        keys = ['key{}'.format(i) for i in range(20)]
+        pools = self.mock_pools(keys)
+        pools['127.0.0.1:11211'].request_many.side_effect = EmptyPoolError
+
+        result = self.client.get_many(keys)
+
+        self.assertEqual(result, dict(
+            (key, key.encode('ascii')) for key in keys
+            if self.client._ring.get_node(key.encode('ascii')) ==
+            '127.0.0.1:11212'))
+
+    def test_get_many_all_failed(self):
+        keys = ['key{}'.format(i) for i in range(20)]
+        for pool in self.mock_pools(keys).values():
+            pool.request_many.side_effect = EmptyPoolError
+
+        with self.assertRaises(EmptyPoolError):
+            self.client.get_many(keys)
+
+    def test_set_many_partial_failure(self):
+        keys = ['key{}'.format(i) for i in range(20)]
+        pools = self.mock_pools(keys)
+        pools['127.0.0.1:11211'].request_many.side_effect = EmptyPoolError
+
+        failed = self.client.set_many(
+            dict((key, key) for key in keys), noreply=True)
+
+        self.assertEqual(sorted(failed), sorted(
+            key for key in keys
+            if self.client._ring.get_node(key.encode('ascii')) ==
+            '127.0.0.1:11211'))
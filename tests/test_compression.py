@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+
+import zlib
+from unittest import TestCase
+
+from dsmcache.compression import Compressor, FLAG_COMPRESSED
+
+
+class CompressorTestCase(TestCase):
+
+    def setUp(self):
+        self.compressor = Compressor(threshold=100)
+
+    def test_compress(self):
+        data = b'a' * 1000
+        compressed, flags = self.compressor.compress(data, 1)
+
+        self.assertEqual(flags, 1 | FLAG_COMPRESSED)
+        self.assertEqual(zlib.decompress(compressed), data)
+        self.assertEqual(self.compressor.decompress(compressed, flags),
+                         (data, 1))
+        self.assertEqual(self.compressor.compressed, 1)
+        self.assertEqual(self.compressor.bytes_in, 1000)
+        self.assertLess(self.compressor.ratio, 0.1)
+
+    def test_below_threshold(self):
+        self.assertEqual(self.compressor.compress(b'a' * 99, 0),
+                         (b'a' * 99, 0))
+        self.assertIsNone(self.compressor.ratio)
+
+    def test_incompressible(self):
+        data = bytes(bytearray(range(256)))
+        self.assertEqual(self.compressor.compress(data, 0), (data, 0))
+        self.assertEqual(self.compressor.skipped, 1)
+
+    def test_not_compressed_value(self):
+        self.assertEqual(self.compressor.decompress(b'data', 1),
+                         (b'data', 1))
+
+    def test_custom_codec(self):
+        compressor = Compressor(threshold=0, compress=lambda data: b'x',
+                                decompress=lambda data: b'data')
+
+        self.assertEqual(compressor.compress(b'data', 0),
+                         (b'x', FLAG_COMPRESSED))
+        self.assertEqual(compressor.decompress(b'x', FLAG_COMPRESSED),
+                         (b'data', 0))
+
+    def test_custom_codec_requires_both_functions(self):
+        with self.assertRaises(ValueError):
+            Compressor(compress=zlib.compress)
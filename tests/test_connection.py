@@ -1,10 +1,14 @@
+import io
 import socket
 from unittest import TestCase
 
 from mock import patch, Mock
 
-from dsmcache.connection import Host, Connection
+from dsmcache.connection import (
+    Host, Connection, FileBody, Transport, join_commands, sendmsg_all)
 from dsmcache.exceptions import InvalidAddressError, InvalidPortError
+from dsmcache.response import (
+    ResponseParser, FileSink, END, STORED, NOT_STORED, ERROR)
 
 
 class HostTestCase(TestCase):
@@ -56,6 +60,55 @@ class HostTestCase(TestCase):
 
         self.assertEqual(str(cm.exception), 'Invalid port')
 
+    def test_ipv6(self):
+        host = Host('[::1]:11212')
+
+        self.assertEqual(host.family, socket.AF_INET6)
+        self.assertEqual(host.address, ('::1', 11212))
+        self.assertEqual(str(host), '[::1]:11212')
+        self.assertEqual(Host('[::1]').port, 11211)
+        self.assertEqual(Host('fe80::1').address, ('fe80::1', 11211))
+
+    def test_ipv6_invalid(self):
+        with self.assertRaises(InvalidAddressError):
+            Host('[::1')
+        with self.assertRaises(InvalidAddressError):
+            Host('[zz::1]:11211')
+        with self.assertRaises(InvalidPortError):
+            Host('[::1]:xx')
+
+    def test_unix_socket(self):
+        for host_str in ('/tmp/mc.sock', 'unix:/tmp/mc.sock'):
+            host = Host(host_str)
+            self.assertEqual(host.family, socket.AF_UNIX)
+            self.assertEqual(host.address, '/tmp/mc.sock')
+            self.assertIsNone(host.port)
+            self.assertEqual(str(host), '/tmp/mc.sock')
+
+
+class TransportTestCase(TestCase):
+
+    def test_tcp_options(self):
+        sock = Mock()
+        transport = Transport(keepalive=True, send_buffer_size=1024,
+                              recv_buffer_size=2048)
+
+        transport.configure(sock, Host('127.0.0.1'))
+
+        options = [call[0] for call in sock.setsockopt.call_args_list]
+        self.assertEqual(options, [
+            (socket.SOL_SOCKET, socket.SO_SNDBUF, 1024),
+            (socket.SOL_SOCKET, socket.SO_RCVBUF, 2048),
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+
+    def test_unix_socket_skips_tcp_options(self):
+        sock = Mock()
+
+        Transport().configure(sock, Host('/tmp/mc.sock'))
+
+        self.assertFalse(sock.setsockopt.called)
+
 
 class ConnectionTestCase(TestCase):
 
@@ -127,9 +180,193 @@ class ConnectionTestCase(TestCase):
         self.assertEqual(self.connection.connect(),
                          self.socket_mock.socket.return_value)
 
+    @patch('dsmcache.connection.Connection._check_dead')
+    def test_connect_timeout(self, check_dead_mock):
+        check_dead_mock.return_value = False
+        connection = Connection(self.host, socket_timeout=10,
+                                connect_timeout=1)
+
+        connection.connect()
+
+        sock = self.socket_mock.socket.return_value
+        self.assertEqual([call[0][0] for call in
+                          sock.settimeout.call_args_list], [1, 10])
+
     def test_send(self):
         pass
 
+    def test_send_vectored(self):
+        self.connection._socket = Mock()
+        self.socket_mock.error = socket.error
+        self.socket_mock.timeout = socket.timeout
+        sent = []
+
+        def sendmsg(buffers):
+            sent.append([bytes(buf) for buf in buffers])
+            return sum(len(buf) for buf in buffers)
+
+        self.connection._socket.sendmsg.side_effect = sendmsg
+        value = b'v' * 100
+
+        self.connection.send([b'set k 0 0 100\r\n', value, b'\r\n'])
+
+        self.assertEqual(sent, [[b'set k 0 0 100\r\n', value, b'\r\n']])
+        self.assertFalse(self.connection._socket.sendall.called)
+
+    def test_sendmsg_all_partial(self):
+        sock = Mock()
+        sent = []
+
+        def sendmsg(buffers):
+            # send at most 3 bytes at once
+            data = b''.join(bytes(buf) for buf in buffers)[:3]
+            sent.append(data)
+            return len(data)
+
+        sock.sendmsg.side_effect = sendmsg
+
+        sendmsg_all(sock, [b'ab', b'', b'cdef', b'g'])
+
+        self.assertEqual(sent, [b'abc', b'def', b'g'])
+
+    @patch('dsmcache.connection.MAX_SEND_BUFFERS', 2)
+    def test_sendmsg_all_max_buffers(self):
+        sock = Mock()
+        sock.sendmsg.side_effect = lambda buffers: sum(
+            len(buf) for buf in buffers)
+
+        sendmsg_all(sock, [b'a', b'b', b'c'])
+
+        self.assertEqual([len(call[0][0]) for call in
+                          sock.sendmsg.call_args_list], [2, 1])
+
+    def test_join_commands(self):
+        self.assertEqual(join_commands([b'a', b'b']), b'ab')
+        value = b'v' * 10
+        self.assertEqual(
+            join_commands([b'a', b'b', [b'set', value, b'\r\n'], b'c']),
+            [b'ab', b'set', value, b'\r\n', b'c'])
+
+    def _set_chunks(self, *chunks):
+        chunks = list(chunks)
+        self.connection._socket = Mock()
+
+        def recv_into(view):
+            if not chunks:
+                return 0
+            chunk = chunks.pop(0)
+            if len(chunk) > len(view):
+                chunks.insert(0, chunk[len(view):])
+                chunk = chunk[:len(view)]
+            view[:len(chunk)] = chunk
+            return len(chunk)
+
+        self.connection._socket.recv_into.side_effect = recv_into
+
+    def test_read_value_larger_than_buffer(self):
+        self.connection._parser = ResponseParser(buffer_size=16)
+        self._set_chunks(b'VALUE k 0 40\r\nval', b'ue' * 18, b'1\r\nEND\r\n')
+
+        response = self.connection.read()
+
+        self.assertEqual(response.data, {b'k': b'val' + b'ue' * 18 + b'1'})
+        self.assertIsInstance(response[b'k'], bytearray)
+        self.assertEqual(response.status, END)
+
+    def test_read_into_sink(self):
+        self.connection._parser = ResponseParser(buffer_size=16)
+        self._set_chunks(b'VALUE k 0 40\r\nval', b'ue' * 18, b'1\r\nEND\r\n')
+        target = io.BytesIO()
+
+        response = self.connection.read(FileSink(target, chunk_size=8))
+
+        self.assertEqual(response.data, {b'k': 40})
+        self.assertEqual(target.getvalue(), b'val' + b'ue' * 18 + b'1')
+        self.assertIsNone(self.connection._parser.sink)
+
+    def test_send_file_body(self):
+        self.connection._socket = Mock()
+        self.socket_mock.error = socket.error
+        self.socket_mock.timeout = socket.timeout
+        body = FileBody(io.BytesIO(b'0123456789'), 10, chunk_size=4)
+
+        sent = []
+        # chunks are views of a reused buffer, so copy them when sent
+        self.connection._socket.sendall.side_effect = \
+            lambda data: sent.append(bytes(data))
+
+        self.connection.send([b'set k 0 0 10\r\n', body, b'\r\n'])
+
+        self.assertEqual(sent, [b'set k 0 0 10\r\n', b'0123', b'4567', b'89',
+                                b'\r\n'])
+
+    def test_send_short_file_body(self):
+        self.connection._socket = Mock()
+        self.connection._mark_socket_dead = Mock()
+        self.socket_mock.error = socket.error
+        self.socket_mock.timeout = socket.timeout
+        body = FileBody(io.BytesIO(b'0123'), 10)
+
+        with self.assertRaises(ValueError):
+            self.connection.send([b'set k 0 0 10\r\n', body, b'\r\n'])
+        self.assertEqual(self.connection._mark_socket_dead.call_count, 1)
+
+    def test_file_body_rewind(self):
+        file_obj = io.BytesIO(b'head0123')
+        file_obj.seek(4)
+        body = FileBody(file_obj, 4)
+        sock = Mock()
+
+        body.send(sock)
+        self.assertTrue(body.rewind())
+        body.send(sock)
+        self.assertEqual([bytes(call[0][0]) for call in
+                          sock.sendall.call_args_list], [b'0123', b'0123'])
+
+    def test_file_body_rewind_not_seekable(self):
+        class Pipe(object):
+            read = io.BytesIO(b'0123').read
+
+        self.assertFalse(FileBody(Pipe(), 4).rewind())
+
+    def test_read_connection_closed(self):
+        self._set_chunks(b'VALUE k 0 10\r\nval')
+        self.connection._mark_socket_dead = Mock()
+
+        response = self.connection.read()
+
+        self.assertEqual(response.data, {})
+        self.assertIsNone(response.status)
+        self.connection._mark_socket_dead.assert_called_once_with(
+            'Server error')
+
+    def test_read_pipelined(self):
+        self._set_chunks(b'STORED\r\nNOT_', b'STORED\r\n')
+
+        self.assertEqual(self.connection.read().status, STORED)
+        self.assertEqual(self.connection.read().status, NOT_STORED)
+
+    def test_read_quiet(self):
+        self._set_chunks(b'SERVER_ERROR object too large for cache\r\n',
+                         b'CLIENT_ERROR bad data chunk\r\nMN\r\n')
+
+        response = self.connection.read(quiet=True)
+
+        self.assertEqual(response.status, END)
+        self.assertEqual(
+            [(result.type, result.value) for _, result
+             in sorted(response.quiet.items())],
+            [(ERROR, b'SERVER_ERROR object too large for cache'),
+             (ERROR, b'CLIENT_ERROR bad data chunk')])
+
+    def test_read(self):
+        self._set_chunks(b'VALUE a 0 1\r\n1\r\nVALUE b 0 2\r\n22\r\nEND\r\n')
+
+        response = self.connection.read()
+
+        self.assertEqual(response.data, {b'a': b'1', b'b': b'22'})
+        self.assertEqual(self.connection._socket.recv_into.call_count, 1)
+
     def test_is_alive(self):
         pass
 
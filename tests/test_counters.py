@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+import gc
+import weakref
+from unittest import TestCase
+
+from mock import Mock
+
+from dsmcache.client import Client
+from dsmcache.counters import CounterBuffer
+
+
+class CounterBufferTestCase(TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.client._check_key = Client._check_key
+        self.client._send_many.side_effect = \
+            lambda cmd_name, cmds_args: [10] * len(cmds_args)
+        self.buffer = CounterBuffer(self.client, max_delay=None, max_keys=3)
+
+    def test_aggregates_deltas(self):
+        self.buffer.incr('a')
+        self.buffer.incr('a', 5)
+        self.buffer.decr('b', 2)
+
+        self.assertEqual(self.buffer.pending, {b'a': 6, b'b': -2})
+        self.assertFalse(self.client._send_many.called)
+
+    def test_flush(self):
+        self.buffer.incr('a', 2)
+        self.buffer.decr('b', 3)
+        self.buffer.flush()
+
+        self.client._send_many.assert_any_call(
+            'incr', [{'key': b'a', 'delta': 2}])
+        self.client._send_many.assert_any_call(
+            'decr', [{'key': b'b', 'delta': 3}])
+        self.assertEqual(self.client._send_many.call_count, 2)
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_zero_delta_is_skipped(self):
+        self.buffer.incr('a')
+        self.buffer.decr('a')
+        self.buffer.flush()
+
+        self.assertFalse(self.client._send_many.called)
+
+    def test_flush_when_full(self):
+        for key in ('a', 'b', 'c'):
+            self.buffer.incr(key)
+
+        self.assertTrue(self.client._send_many.called)
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_flush_when_stale(self):
+        buffer = CounterBuffer(self.client, max_delay=0)
+        buffer.incr('a')
+
+        self.assertTrue(self.client._send_many.called)
+
+    def test_missing_counter_is_added(self):
+        self.client._send_many.side_effect = None
+        self.client._send_many.return_value = [None]
+        self.client.add.return_value = True
+        self.buffer.incr('a', 4)
+        self.buffer.flush()
+
+        self.client.add.assert_called_once_with(b'a', 4, 0)
+
+    def test_failed_deltas_are_kept(self):
+        self.client._send_many.side_effect = None
+        self.client._send_many.return_value = [False]
+        self.buffer.incr('a', 4)
+        self.buffer.flush()
+        self.buffer.incr('a')
+
+        self.assertEqual(self.buffer.pending, {b'a': 5})
+
+    def test_close_flushes(self):
+        self.buffer.incr('a')
+        self.buffer.close()
+
+        self.assertTrue(self.client._send_many.called)
+        with self.assertRaises(ValueError):
+            self.buffer.incr('a')
+
+    def test_rejected_deltas_are_dropped(self):
+        buffer = CounterBuffer(self.client, max_delay=None, max_attempts=2)
+        self.client._send_many.side_effect = None
+        self.client._send_many.return_value = [False]
+        buffer.incr('a', 4)
+        buffer.flush()
+        self.assertEqual(buffer.pending, {b'a': 4})
+
+        with self.assertLogs('dsmcache.counters', 'WARNING'):
+            buffer.flush()
+        self.assertEqual(buffer.pending, {})
+
+    def test_attempts_reset_after_success(self):
+        buffer = CounterBuffer(self.client, max_delay=None, max_attempts=2)
+        self.client._send_many.side_effect = [[False], [10], [False]]
+        for _ in range(3):
+            buffer.incr('a')
+            buffer.flush()
+
+        self.assertEqual(buffer.pending, {b'a': 1})
+
+    def test_client_not_kept_alive(self):
+        client = Client('127.0.0.1')
+        buffer = client.counter_buffer(max_delay=0.01)
+        ref = weakref.ref(client)
+        del client
+        gc.collect()
+
+        self.assertIsNone(ref())
+        with self.assertRaises(ValueError):
+            buffer.incr('a')
@@ -1,17 +1,45 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
 from unittest import TestCase
 
+from mock import patch
+
+from dsmcache.chunking import Chunker
 from dsmcache.client import Client
+from dsmcache.compression import Compressor
+from dsmcache.nearcache import NearCache
+from dsmcache.exceptions import (
+    ServerError, CASConflictError, CircuitOpenError)
+from dsmcache.testing import FakeMemcachedServer, FakeMemcachedUnixServer
 
 
 class GetSetTestCase(TestCase):
+    """
+    Runs against Memcached at MEMCACHED_ADDRESS or bundled fake server.
+    """
 
     def setUp(self):
+        self.server = None
+        address = os.environ.get('MEMCACHED_ADDRESS')
+        if address is None:
+            # default item size limit of Memcached
+            self.server = FakeMemcachedServer(item_size_limit=1024 * 1024)
+            self.server.start()
+            address = self.server.address
+
+        self.address = address
         self.pool_size = 2
-        self.client = Client('0.0.0.0:11211', pool_size=self.pool_size)
+        self.client = Client(address, pool_size=self.pool_size)
         self.client.flush_all()
 
     def tearDown(self):
         self.client.disconnect()
+        if self.server:
+            self.server.stop()
 
     def test_client_get_miss(self):
         self.assertEqual(self.client.get('notexist'), None)
@@ -34,3 +62,284 @@ class GetSetTestCase(TestCase):
         client = Client('0.0.0.0:11111')
         self.assertFalse(client.set('a', 'b'))
         self.assertIsNone(client.get('a'))
+
+    def test_stream_round_trip(self):
+        data = os.urandom(300000)
+        self.assertTrue(self.client.set_from('big', io.BytesIO(data),
+                                             len(data)))
+
+        target = io.BytesIO()
+        self.assertEqual(self.client.get_into('big', target), len(data))
+        self.assertEqual(target.getvalue(), data)
+
+        buf = bytearray(len(data) + 10)
+        self.assertEqual(self.client.get_into('big', buf), len(data))
+        self.assertEqual(buf[:len(data)], data)
+
+        with self.assertRaises(ValueError):
+            self.client.get_into('big', bytearray(10))
+        self.assertIsNone(self.client.get_into('notexist', bytearray(10)))
+        # connection is still usable after the value was dropped
+        self.assertEqual(self.client.get('big'), data)
+
+    def test_large_value_received_into_bytearray(self):
+        self.client.set('large', b'v' * 20000)
+
+        value = self.client.get('large')
+        self.assertIsInstance(value, bytearray)
+        # value is owned by the caller, so it can be resized
+        value.extend(b'w')
+        self.assertEqual(self.client.get_many(['large'])['large'],
+                         b'v' * 20000)
+
+    def test_near_cache_values_not_shared(self):
+        client = Client(self.address, near_cache=NearCache())
+        self.addCleanup(client.disconnect)
+        self.client.set('big', b'x' * 20000)
+        self.client.set('dict', {'a': [1]})
+
+        client.get('big')[:1] = b'y'
+        client.get('dict')['a'].append(2)
+
+        self.assertEqual(client.get('big'), b'x' * 20000)
+        self.assertEqual(client.get('dict'), {'a': [1]})
+
+    def test_get_into_encoded_values(self):
+        client = Client(self.address, chunker=Chunker(chunk_size=1000),
+                        compressor=Compressor(threshold=10))
+        self.addCleanup(client.disconnect)
+        client.set('chunked', os.urandom(5000))
+        client.set('compressed', b'c' * 100)
+        client.get_or_set('stamped', lambda: b'value')
+
+        for key in ('chunked', 'compressed', 'stamped'):
+            with self.assertRaises(ValueError):
+                client.get_into(key, io.BytesIO())
+
+    def test_circuit_breaker(self):
+        client = Client('127.0.0.1:1', pool_options={
+            'breaker_options': {'failure_threshold': 2}})
+        self.addCleanup(client.disconnect)
+
+        self.assertIsNone(client.get('a'))
+        self.assertIsNone(client.get('a'))
+        with self.assertRaises(CircuitOpenError):
+            client.get('a')
+
+    def test_user_flags_round_trip(self):
+        self.assertTrue(self.client.set('key', 'val', flags=1 << 11))
+        self.assertEqual(self.client.get('key'), 'val')
+        self.assertEqual(self.client.get_many(['key']), {'key': 'val'})
+
+    def test_types_round_trip(self):
+        values = {'bytes': b'\x00\xff\r\n', 'text': 'val', 'int': 7,
+                  'dict': {'a': [1, 2]}}
+        self.assertEqual(self.client.set_many(values), [])
+        self.assertEqual(self.client.get_many(list(values)), values)
+
+    def test_large_values_pipelined(self):
+        # large values are sent as separate buffers
+        values = {'small': b'v', 'large': b'l' * 100000, 'next': b'n' * 10}
+        self.assertEqual(self.client.set_many(values), [])
+        self.assertEqual(self.client.get_many(list(values)), values)
+
+    def test_set_many_noreply_error(self):
+        # error reply to the too large value doesn't stay in the connection
+        values = {'small': b'v', 'large': b'l' * (2 * 1024 * 1024)}
+        for _ in range(self.pool_size):
+            self.assertEqual(self.client.set_many(values, noreply=True), [])
+
+        self.assertEqual(self.client.get('small'), b'v')
+        self.assertIsNone(self.client.get('large'))
+        self.assertTrue(self.client.set('next', b'n'))
+        self.assertEqual(self.client.get('next'), b'n')
+
+    def test_chunked_values(self):
+        client = Client(self.address, chunker=Chunker())
+        self.addCleanup(client.disconnect)
+        big = os.urandom(2500000)
+        with self.assertRaises(ServerError):
+            self.client.set('key', big)
+        values = {'big': big, 'small': 'val', 'big2': big[:1500000]}
+
+        self.assertTrue(client.set('key', big))
+        self.assertEqual(client.get('key'), big)
+        self.assertEqual(client.set_many(values), [])
+        self.assertEqual(client.get_many(list(values) + ['notexist']),
+                         values)
+
+        # lost chunk makes the value a miss
+        manifest = client._send_cmd('get', key=b'key')
+        client.delete(manifest.chunk_keys(b'key')[1])
+        self.assertIsNone(client.get('key'))
+        self.assertEqual(client.get_many(['key', 'small']), {'small': 'val'})
+
+    def test_chunked_conditional_store_failed(self):
+        if self.server is None:
+            self.skipTest('Needs the bundled fake server')
+        client = Client(self.address, chunker=Chunker(chunk_size=1000))
+        self.addCleanup(client.disconnect)
+        big = os.urandom(5000)
+
+        self.assertFalse(client.replace('key', big))
+        self.assertTrue(client.set('key', 'val'))
+        self.assertFalse(client.add('key', big))
+        _, cas = client.gets('key')
+        self.assertTrue(client.set('key', 'val2'))
+        self.assertFalse(client.cas('key', big, cas))
+
+        # chunks of values which were not stored are deleted
+        self.assertEqual(list(self.server.store._items), [b'key'])
+        self.assertEqual(client.get('key'), 'val2')
+
+    def test_get_or_set(self):
+        calls = []
+
+        def producer():
+            calls.append(1)
+            return 'computed'
+
+        self.assertEqual(self.client.get_or_set('key', producer, 60),
+                         'computed')
+        self.assertEqual(self.client.get_or_set('key', producer, 60),
+                         'computed')
+        self.assertEqual(self.client.get('key'), 'computed')
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(self.client.get('key:lease'))
+
+    def test_get_or_set_single_producer(self):
+        calls = []
+        results = []
+        started = threading.Event()
+
+        def producer():
+            calls.append(1)
+            started.wait(1)
+            return 'computed'
+
+        def worker():
+            results.append(self.client.get_or_set(
+                'key', producer, 60, poll_interval=0.01))
+
+        workers = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in workers:
+            thread.start()
+        started.set()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(results, ['computed'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_get_or_set_stale_value(self):
+        self.client.get_or_set('key', lambda: 'old', 1, stale_time=60)
+        self.client.add('key:lease', b'1', 60)
+
+        # value is expired, but somebody else is recomputing it
+        with patch('dsmcache.client.should_recompute', return_value=True):
+            self.assertEqual(
+                self.client.get_or_set('key', lambda: 'new', 1), 'old')
+
+    def test_storage_commands(self):
+        self.assertFalse(self.client.replace('key', 'a'))
+        self.assertTrue(self.client.add('key', 'a'))
+        self.assertFalse(self.client.add('key', 'b'))
+        self.assertTrue(self.client.replace('key', 'b'))
+        self.assertTrue(self.client.append('key', 'c'))
+        self.assertTrue(self.client.prepend('key', 'a'))
+        self.assertEqual(self.client.get('key'), 'abc')
+        self.assertFalse(self.client.append('notexist', 'c'))
+
+    def test_gets_cas(self):
+        self.assertEqual(self.client.gets('key'), (None, None))
+        self.assertIsNone(self.client.cas('key', 'a', 1))
+
+        self.client.set('key', 'a')
+        value, cas = self.client.gets('key')
+        self.assertEqual(value, 'a')
+        self.assertTrue(self.client.cas('key', 'b', cas))
+        self.assertFalse(self.client.cas('key', 'c', cas))
+        self.assertEqual(self.client.get('key'), 'b')
+
+    def test_gat(self):
+        self.assertIsNone(self.client.gat('key', 10))
+        self.client.set('key', 'a')
+        self.assertEqual(self.client.gat('key', 10), 'a')
+        self.assertEqual(self.client.gats('key', 10)[0], 'a')
+
+    def test_incr_decr(self):
+        self.assertIsNone(self.client.incr('counter'))
+        self.client.set('counter', 10)
+        self.assertEqual(self.client.incr('counter', 5), 15)
+        self.assertEqual(self.client.decr('counter', 20), 0)
+        self.assertEqual(self.client.get('counter'), 0)
+
+    def test_cas_update(self):
+        def increment(value):
+            return (value or 0) + 1
+
+        workers = [threading.Thread(target=lambda: [
+            self.client.cas_update('counter', increment, retries=100)
+            for _ in range(10)]) for _ in range(4)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(self.client.get('counter'), 40)
+
+    def test_cas_update_conflict(self):
+        self.client.set('key', 1)
+
+        def change(value):
+            self.client.set('key', value + 1)
+            return value
+
+        with self.assertRaises(CASConflictError):
+            self.client.cas_update('key', change, retries=2)
+        self.assertEqual(self.client.get('key'), 4)
+
+    def test_counter_buffer(self):
+        self.client.set('existing', 5)
+        buffer = self.client.counter_buffer(max_delay=None)
+
+        for _ in range(10):
+            buffer.incr('existing')
+            buffer.incr('new', 2)
+        buffer.decr('new')
+        self.assertIsNone(self.client.get('new'))
+
+        buffer.flush()
+        self.assertEqual(self.client.get('existing'), 15)
+        self.assertEqual(self.client.get('new'), 19)
+
+        buffer.incr('new')
+        self.client.disconnect()
+        self.assertEqual(Client(self.address).get('new'), 20)
+
+
+class TransportTestCase(TestCase):
+    """
+    Runs against bundled fake servers listening on other transports.
+    """
+
+    def check_client(self, server):
+        with server:
+            client = Client(server.address)
+            self.assertTrue(client.set('key', 'val'))
+            self.assertEqual(client.get('key'), 'val')
+            client.disconnect()
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.check_client(FakeMemcachedUnixServer(
+            os.path.join(directory, 'memcached.sock')))
+
+    def test_ipv6(self):
+        try:
+            server = FakeMemcachedServer('::1')
+        except socket.error:
+            self.skipTest('IPv6 is not available')
+        self.check_client(server)
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+from unittest import TestCase
+
+from dsmcache.hashring import HashRing, ketama_hash, POINTS_PER_SERVER
+
+
+class HashRingTestCase(TestCase):
+
+    def setUp(self):
+        self.nodes = ['10.0.0.{}:11211'.format(i) for i in range(1, 5)]
+        self.ring = HashRing(dict((node, 1) for node in self.nodes))
+        self.keys = ['key{}'.format(i).encode('ascii') for i in range(2000)]
+
+    def test_ketama_hash(self):
+        # first 4 bytes of md5(b'') = d41d8cd9..., little-endian
+        self.assertEqual(ketama_hash(b''), 0xd98c1dd4)
+        self.assertEqual(ketama_hash(''), ketama_hash(b''))
+
+    def test_points(self):
+        self.assertEqual(len(self.ring._points),
+                         POINTS_PER_SERVER * 4 * len(self.nodes))
+        self.assertEqual(self.ring._points, sorted(self.ring._points))
+
+    def test_weights(self):
+        ring = HashRing({'a:1': 1, 'b:1': 3})
+
+        self.assertEqual(ring._nodes.count('a:1') * 3,
+                         ring._nodes.count('b:1'))
+
+    def test_get_node_empty(self):
+        self.assertIsNone(HashRing().get_node(b'key'))
+
+    def test_get_node_stable(self):
+        for key in self.keys:
+            self.assertEqual(self.ring.get_node(key),
+                             self.ring.get_node(key))
+            self.assertIn(self.ring.get_node(key), self.nodes)
+
+    def test_get_node_wraps_around(self):
+        ring = HashRing({'a:1': 1})
+        ring._points[-1] = 0
+
+        self.assertEqual(ring.get_node(b'key'), 'a:1')
+
+    def test_add_node_remaps_part_of_keys(self):
+        before = dict((key, self.ring.get_node(key)) for key in self.keys)
+        self.ring.add_node('10.0.0.5:11211')
+
+        moved = [key for key in self.keys
+                 if self.ring.get_node(key) != before[key]]
+
+        self.assertTrue(0 < len(moved) < len(self.keys) / 3)
+        for key in moved:
+            self.assertEqual(self.ring.get_node(key), '10.0.0.5:11211')
+
+    def test_remove_node(self):
+        before = dict((key, self.ring.get_node(key)) for key in self.keys)
+        self.ring.remove_node(self.nodes[0])
+
+        self.assertEqual(len(self.ring), 3)
+        self.assertNotIn(self.nodes[0], self.ring)
+        for key in self.keys:
+            if before[key] != self.nodes[0]:
+                self.assertEqual(self.ring.get_node(key), before[key])
+
+    def test_get_nodes(self):
+        for key in self.keys[:200]:
+            nodes = self.ring.get_nodes(key, 3)
+
+            self.assertEqual(len(set(nodes)), 3)
+            self.assertEqual(nodes[0], self.ring.get_node(key))
+
+    def test_get_nodes_more_than_ring(self):
+        self.assertEqual(sorted(self.ring.get_nodes(b'key', 10)),
+                         sorted(self.nodes))
+        self.assertEqual(HashRing().get_nodes(b'key', 2), [])
+
+    def test_get_nodes_successors_keep_position(self):
+        # replicas of keys not stored on the removed node stay in place
+        before = dict((key, self.ring.get_nodes(key, 2))
+                      for key in self.keys[:200])
+        self.ring.remove_node(self.nodes[0])
+
+        for key, nodes in before.items():
+            if self.nodes[0] not in nodes:
+                self.assertEqual(self.ring.get_nodes(key, 2), nodes)
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from mock import Mock
+
+from dsmcache.client import Client
+from dsmcache.metrics import (
+    Histogram, Metrics, MetricsHook, POOL_WAIT, SEND, READ, CONNECT,
+    FIRST_BYTE, BYTES_IN, BYTES_OUT, ERRORS)
+from dsmcache.testing import FakeMemcachedServer
+
+
+class HistogramTestCase(TestCase):
+
+    def test_empty(self):
+        histogram = Histogram()
+
+        self.assertIsNone(histogram.percentile(50))
+        self.assertEqual(histogram.snapshot()['count'], 0)
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for _ in range(98):
+            histogram.record(0.0001)
+        histogram.record(0.01)
+        histogram.record(0.5)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(50), 128e-6)
+        self.assertAlmostEqual(histogram.percentile(99), 16384e-6)
+        self.assertEqual(histogram.percentile(99.9), 0.5)
+        self.assertEqual(histogram.max, 0.5)
+
+    def test_huge_sample(self):
+        histogram = Histogram()
+        histogram.record(10 ** 6)
+
+        self.assertEqual(histogram.buckets[-1], 1)
+
+
+class MetricsTestCase(TestCase):
+
+    def test_measure_calls_hooks(self):
+        hook = Mock(spec=MetricsHook)
+        metrics = Metrics(hooks=[hook])
+
+        with self.assertRaises(ValueError):
+            with metrics.measure('get', b'key'):
+                raise ValueError()
+
+        hook.before.assert_called_once_with('get', b'key')
+        args = hook.after.call_args[0]
+        self.assertEqual(args[:2], ('get', b'key'))
+        self.assertIsInstance(args[3], ValueError)
+        self.assertEqual(metrics.commands['get'].count, 1)
+        self.assertEqual(metrics.counters[ERRORS], 1)
+
+    def test_client_phases(self):
+        metrics = Metrics()
+        with FakeMemcachedServer() as server:
+            client = Client(server.address, metrics=metrics)
+            client.set('a', 'val')
+            client.get('a')
+            client.get_many(['a', 'b'])
+            client.disconnect()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            sorted(snapshot['commands']), ['get', 'get_many', 'set'])
+        self.assertEqual(snapshot['phases'][POOL_WAIT]['count'], 3)
+        for phase in (SEND, READ, FIRST_BYTE):
+            self.assertEqual(snapshot['phases'][phase]['count'], 3)
+        self.assertEqual(snapshot['phases'][CONNECT]['count'], 1)
+        self.assertEqual(snapshot['counters'][BYTES_OUT],
+                         len(b'set a 1 0 3\r\nval\r\n') +
+                         len(b'get a\r\n') + len(b'get a b\r\n'))
+        self.assertGreater(snapshot['counters'][BYTES_IN], 0)
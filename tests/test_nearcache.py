@@ -0,0 +1,102 @@
+from mock import patch
+
+from unittest import TestCase
+
+from dsmcache.nearcache import NearCache, MAX_RELATIVE_TTL
+
+
+class NearCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = NearCache(max_entries=2, max_bytes=10, ttl=5)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get(b'a'))
+        self.cache.set(b'a', 'val')
+
+        self.assertEqual(self.cache.get(b'a'), 'val')
+        self.assertEqual(self.cache.stats, {
+            'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1,
+            'bytes': 3})
+
+    def test_lru_eviction_by_entries(self):
+        self.cache.set(b'a', 'a')
+        self.cache.set(b'b', 'b')
+        self.cache.get(b'a')
+        self.cache.set(b'c', 'c')
+
+        self.assertIn(b'a', self.cache)
+        self.assertNotIn(b'b', self.cache)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_eviction_by_bytes(self):
+        self.cache.set(b'a', 'aaaaaa')
+        self.cache.set(b'b', 'bbbbbb')
+
+        self.assertEqual(len(self.cache), 1)
+        self.assertIn(b'b', self.cache)
+        self.assertEqual(self.cache.stats['bytes'], 6)
+
+    def test_value_larger_than_cache(self):
+        self.cache.set(b'a', 'a')
+        self.cache.set(b'a', 'x' * 11)
+
+        self.assertNotIn(b'a', self.cache)
+        self.assertEqual(self.cache.stats['bytes'], 0)
+
+    @patch('dsmcache.nearcache._now')
+    def test_ttl(self, now_mock):
+        now_mock.return_value = 100
+        self.cache.set(b'a', 'a')
+
+        now_mock.return_value = 104
+        self.assertEqual(self.cache.get(b'a'), 'a')
+
+        now_mock.return_value = 105
+        self.assertIsNone(self.cache.get(b'a'))
+        self.assertEqual(len(self.cache), 0)
+
+    @patch('dsmcache.nearcache._now')
+    def test_ttl_capped(self, now_mock):
+        now = now_mock.return_value = MAX_RELATIVE_TTL + 100
+        cache = NearCache(ttl=5)
+        cache.set(b'a', 'a', time=60)
+        cache.set(b'b', 'b', time=2)
+        cache.set(b'c', 'c', time=now + 3)
+        cache.set(b'd', 'd', time=now - 1)
+
+        now_mock.return_value = now + 2
+        self.assertIsNone(cache.get(b'b'))
+        self.assertEqual(cache.get(b'c'), 'c')
+        self.assertNotIn(b'd', cache)
+
+        now_mock.return_value = now + 3
+        self.assertEqual(cache.get(b'a'), 'a')
+        self.assertIsNone(cache.get(b'c'))
+
+    def test_mutable_values_copied(self):
+        cache = NearCache()
+        value = {'a': [1]}
+        cache.set(b'a', value)
+        value['a'].append(2)
+        cache.get(b'a')['a'].append(3)
+
+        self.assertEqual(cache.get(b'a'), {'a': [1]})
+
+    def test_bytearray_stored_as_bytes(self):
+        value = bytearray(b'val')
+        self.cache.set(b'a', value)
+        value[0:1] = b'x'
+
+        self.assertEqual(self.cache.get(b'a'), b'val')
+        self.assertIsInstance(self.cache.get(b'a'), bytes)
+
+    def test_delete_and_clear(self):
+        self.cache.set(b'a', 'a')
+        self.cache.set(b'b', 'b')
+        self.cache.delete(b'a')
+        self.cache.delete(b'missing')
+
+        self.assertNotIn(b'a', self.cache)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats['entries'], 0)
@@ -1 +1,158 @@
-# TODO
+from unittest import TestCase
+
+from mock import patch, Mock
+
+from dsmcache.connection import Host
+from dsmcache.breaker import OPEN, CLOSED
+from dsmcache.exceptions import (
+    ClosedPoolError, EmptyPoolError, CircuitOpenError)
+from dsmcache.pool import ConnectionPool
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.connection_patch = patch('dsmcache.pool.Connection')
+        self.connection_mock = self.connection_patch.start()
+        self.connection_mock.side_effect = lambda *args, **kwargs: Mock()
+        self.pool = ConnectionPool(Host('127.0.0.1:11211'), max_size=2,
+                                   timeout=0.01, max_idle_time=None)
+
+    def tearDown(self):
+        self.connection_patch.stop()
+
+    def connection(self):
+        self.connection_mock.side_effect = None
+        return self.connection_mock.return_value
+
+    def test_request(self):
+        connection = self.connection()
+        connection.read.return_value = 'response'
+
+        self.assertEqual(self.pool.request(b'get a\r\n'), 'response')
+        connection.connect.assert_called_once_with()
+        connection.send.assert_called_once_with(b'get a\r\n')
+
+    def test_request_many(self):
+        connection = self.connection()
+        connection.read.side_effect = ['first', 'second']
+
+        responses = self.pool.request_many([b'get a\r\n', b'get b\r\n'])
+
+        self.assertEqual(responses, ['first', 'second'])
+        connection.send.assert_called_once_with(b'get a\r\nget b\r\n')
+
+    def test_request_many_noreply(self):
+        connection = self.connection()
+
+        responses = self.pool.request_many([b'delete a noreply\r\n'],
+                                           noreply=True)
+
+        self.assertEqual(responses, [])
+        self.assertFalse(connection.read.called)
+
+    def test_request_many_quiet(self):
+        connection = self.connection()
+        connection.read.return_value = 'response'
+
+        responses = self.pool.request_many(
+            [b'delete a noreply\r\n', b'delete b noreply\r\n',
+             b'mn\r\n'], quiet=True)
+
+        self.assertEqual(responses, ['response'])
+        connection.read.assert_called_once_with(quiet=True)
+
+    def test_request_closed_pool(self):
+        self.pool.close()
+
+        with self.assertRaises(ClosedPoolError):
+            self.pool.request(b'get a\r\n')
+
+    def test_connections_created_on_demand(self):
+        self.assertEqual(self.pool.size, 0)
+        self.pool.request(b'get a\r\n')
+        self.pool.request(b'get b\r\n')
+
+        self.assertEqual(self.connection_mock.call_count, 1)
+        self.assertEqual((self.pool.size, self.pool.idle), (1, 1))
+
+    def test_max_size_blocks_until_timeout(self):
+        self.pool._get_connection()
+        self.pool._get_connection()
+
+        with self.assertRaises(EmptyPoolError):
+            self.pool._get_connection()
+
+    def test_max_size_fail_fast(self):
+        pool = ConnectionPool(Host('127.0.0.1:11211'), max_size=1,
+                              timeout=None, block=False, max_idle_time=None)
+        connection = pool._get_connection()
+
+        with self.assertRaises(EmptyPoolError):
+            pool._get_connection()
+
+        pool._put_connection(connection)
+        self.assertIs(pool._get_connection(), connection)
+
+    @patch('dsmcache.pool.time')
+    def test_reap(self, time_mock):
+        pool = ConnectionPool(Host('127.0.0.1:11211'), max_size=3,
+                              min_idle=1, max_idle_time=60)
+        self.addCleanup(pool.close)
+        time_mock.time.return_value = 100
+        connections = [pool._get_connection() for _ in range(3)]
+        for connection in connections:
+            pool._put_connection(connection)
+
+        time_mock.time.return_value = 161
+        pool.reap()
+
+        self.assertEqual((pool.size, pool.idle), (1, 1))
+        connections[0].close.assert_called_once_with()
+        connections[1].close.assert_called_once_with()
+        self.assertFalse(connections[2].close.called)
+
+    def test_prewarm(self):
+        pool = ConnectionPool(Host('127.0.0.1:11211'), max_size=5,
+                              min_idle=2, prewarm=True, max_idle_time=None)
+
+        self.assertEqual((pool.size, pool.idle), (2, 2))
+        for connection, _ in pool._idle:
+            connection.connect.assert_called_once_with()
+
+    def test_close(self):
+        idle = self.pool._get_connection()
+        in_use = self.pool._get_connection()
+        self.pool._put_connection(idle)
+        self.pool.close()
+
+        idle.close.assert_called_once_with()
+        self.assertFalse(in_use.close.called)
+        self.pool._put_connection(in_use)
+        in_use.close.assert_called_once_with()
+        self.assertEqual(self.pool.size, 0)
+
+    def test_breaker_opens_on_dead_server(self):
+        pool = ConnectionPool(Host('127.0.0.1:11211'), max_idle_time=None,
+                              breaker_options={'failure_threshold': 2})
+        connection = self.connection()
+        connection.connected = False
+
+        pool.request(b'get a\r\n')
+        pool.request(b'get a\r\n')
+
+        self.assertEqual(pool.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            pool.request(b'get a\r\n')
+        self.assertEqual(connection.send.call_count, 2)
+        self.assertEqual(self.connection_mock.call_args[1]['retry_timeout'],
+                         0)
+
+    def test_breaker_ignores_exhausted_pool(self):
+        pool = ConnectionPool(Host('127.0.0.1:11211'), max_size=0,
+                              block=False, max_idle_time=None,
+                              breaker_options={'failure_threshold': 1})
+
+        with self.assertRaises(EmptyPoolError):
+            pool.request(b'get a\r\n')
+        self.assertEqual(pool.breaker.state, CLOSED)
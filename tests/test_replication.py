@@ -0,0 +1,351 @@
+from __future__ import unicode_literals
+
+import io
+import threading
+from unittest import TestCase
+
+from mock import patch
+
+from dsmcache.client import Client
+from dsmcache.exceptions import CircuitOpenError
+from dsmcache.metrics import HEDGES, HEDGE_WINS, Metrics
+from dsmcache.replication import ReplicatedClient, MIN_HEDGE_SAMPLES
+from dsmcache.response import Response, ResponseParser
+from dsmcache.testing import FakeMemcachedServer
+
+
+def make_response(data):
+    parser = ResponseParser()
+    parser.feed(data)
+    response = Response()
+    response.add(parser.next_result())
+    return response
+
+
+class ReplicatedClientTestCase(TestCase):
+    """
+    Runs against bundled fake servers.
+    """
+
+    def setUp(self):
+        self.servers = [FakeMemcachedServer() for _ in range(3)]
+        for server in self.servers:
+            server.start()
+            self.addCleanup(server.stop)
+        self.addresses = [server.address for server in self.servers]
+        self.metrics = Metrics()
+        self.client = self.make_client(self.addresses)
+
+    def make_client(self, servers, **kwargs):
+        kwargs.setdefault('metrics', self.metrics)
+        client = ReplicatedClient(servers, **kwargs)
+        self.addCleanup(client.disconnect)
+        return client
+
+    def stored_on(self, key):
+        """
+        Return addresses of servers storing the key.
+        """
+        stored = []
+        for address in self.addresses:
+            client = Client(address)
+            if client.get(key) is not None:
+                stored.append(address)
+            client.disconnect()
+        return stored
+
+    def replicas(self, key):
+        return self.client._get_replicas(key.encode('ascii'))
+
+    def slow_request(self, pool, release):
+        request = pool.request
+
+        def slow(cmd):
+            release.wait(1)
+            return request(cmd)
+
+        return patch.object(pool, 'request', side_effect=slow)
+
+    def hedged_get(self, key):
+        """
+        Get the key while the primary is slow, so the second replica
+        answers first.
+        """
+        client = self.make_client(self.addresses, max_hedge_rate=1.0,
+                                  hedge_delay=0)
+        release = threading.Event()
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with self.slow_request(client._get_replicas(key.encode('ascii'))[0],
+                               release):
+            value = client.get(key)
+        self.assertEqual(client.hedge_stats['hedges'], 1)
+        return value
+
+    def delete_from_replica(self, key):
+        client = Client(str(self.replicas(key)[1]._host))
+        client.delete(key)
+        client.disconnect()
+
+    def test_set_replicated(self):
+        for i in range(20):
+            key = 'key{}'.format(i)
+            self.assertTrue(self.client.set(key, 'val'))
+
+            stored = self.stored_on(key)
+            self.assertEqual(len(stored), 2)
+            self.assertEqual(
+                sorted(str(pool._host) for pool in self.replicas(key)),
+                sorted(stored))
+
+    def test_delete_replicated(self):
+        self.client.set('key', 'val')
+
+        self.assertTrue(self.client.delete('key'))
+        self.assertEqual(self.stored_on('key'), [])
+
+    def test_append_prepend_replicated(self):
+        self.client.set('key', 'b')
+
+        self.assertTrue(self.client.append('key', 'c'))
+        self.assertTrue(self.client.prepend('key', 'a'))
+        self.assertEqual(len(self.stored_on('key')), 2)
+        self.assertEqual(self.hedged_get('key'), 'abc')
+
+    def test_append_replica_missed(self):
+        self.client.set('key', 'a')
+        self.delete_from_replica('key')
+
+        self.assertTrue(self.client.append('key', 'b'))
+        self.assertEqual(self.stored_on('key'),
+                         [str(self.replicas('key')[0]._host)])
+        self.assertEqual(self.hedged_get('key'), 'ab')
+
+    def test_set_from_replicated(self):
+        self.client.set('key', b'old')
+
+        self.assertTrue(self.client.set_from('key', io.BytesIO(b'new'), 3))
+        self.assertEqual(len(self.stored_on('key')), 2)
+        self.assertEqual(self.hedged_get('key'), b'new')
+
+    def test_set_from_not_seekable(self):
+        self.client.set('key', b'old')
+        body = io.BytesIO(b'new')
+
+        class Pipe(object):
+            read = body.read
+
+        self.assertTrue(self.client.set_from('key', Pipe(), 3))
+        self.assertEqual(self.stored_on('key'),
+                         [str(self.replicas('key')[0]._host)])
+        self.assertEqual(self.hedged_get('key'), b'new')
+
+    def test_cas_deletes_replicas(self):
+        self.client.set('key', 'old')
+        _, cas = self.client.gets('key')
+
+        self.assertTrue(self.client.cas('key', 'new', cas))
+        self.assertEqual(self.stored_on('key'),
+                         [str(self.replicas('key')[0]._host)])
+        self.assertEqual(self.hedged_get('key'), 'new')
+
+    def test_cas_update_deletes_replicas(self):
+        self.client.set('key', 1)
+
+        self.assertEqual(self.client.cas_update('key', lambda x: x + 1), 2)
+        self.assertEqual(self.hedged_get('key'), 2)
+
+    def test_incr_decr_delete_replicas(self):
+        self.client.set('key', b'10')
+
+        self.assertEqual(self.client.incr('key', 5), 15)
+        self.assertEqual(self.stored_on('key'),
+                         [str(self.replicas('key')[0]._host)])
+        self.assertEqual(self.hedged_get('key'), b'15')
+
+        self.client.set('key', b'10')
+        self.assertEqual(self.client.decr('key', 5), 5)
+        self.assertEqual(self.hedged_get('key'), b'5')
+
+    def test_meta_commands(self):
+        # fake server doesn't know meta commands
+        primary, secondary = self.replicas('key')
+        answer = make_response(b'HD\r\n')
+        with patch.object(primary, 'request', return_value=answer):
+            with patch.object(secondary, 'request',
+                              return_value=answer) as request:
+                self.client.meta_set('key', b'val')
+                self.assertTrue(request.call_args[0][0].startswith(b'ms '))
+
+                self.client.meta_delete('key')
+                self.assertTrue(request.call_args[0][0].startswith(b'md '))
+
+                self.client.meta_arithmetic('key')
+                self.assertEqual(request.call_args[0][0], b'delete key\r\n')
+        self.assertEqual(request.call_count, 3)
+
+    def test_meta_set_replica_failed_cas(self):
+        primary, secondary = self.replicas('key')
+        with patch.object(primary, 'request',
+                          return_value=make_response(b'HD\r\n')):
+            with patch.object(secondary, 'request',
+                              return_value=make_response(b'EX\r\n')
+                              ) as request:
+                self.client.meta_set('key', b'val', cas=1)
+
+        self.assertEqual(request.call_args[0][0], b'delete key\r\n')
+
+    def test_set_many_replicated(self):
+        values = dict(('key{}'.format(i), i) for i in range(20))
+
+        self.assertEqual(self.client.set_many(values), [])
+        for key in values:
+            self.assertEqual(len(self.stored_on(key)), 2)
+        self.assertEqual(self.client.get_many(list(values)), values)
+
+    def test_replicas_limited_by_servers(self):
+        client = self.make_client(self.addresses[:1], replicas=3)
+
+        self.assertTrue(client.set('key', 'val'))
+        self.assertEqual(client.get('key'), 'val')
+
+    def test_groups(self):
+        groups = [self.addresses[:2], self.addresses[2:]]
+        client = self.make_client(None, groups=groups)
+
+        for i in range(20):
+            key = 'key{}'.format(i)
+            client.set(key, 'val')
+            self.assertIn(self.stored_on(key), groups)
+
+    def test_get(self):
+        self.client.set('key', 'val')
+
+        self.assertEqual(self.client.get('key'), 'val')
+        self.assertEqual(self.client.hedge_stats,
+                         {'reads': 1, 'hedges': 0, 'hedge_wins': 0})
+
+    def test_get_hedged(self):
+        client = self.make_client(self.addresses, max_hedge_rate=1.0)
+        client.set('key', 'val')
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        with self.slow_request(client._get_replicas(b'key')[0], release):
+            self.assertEqual(client.get('key'), 'val')
+
+        self.assertEqual(client.hedge_stats,
+                         {'reads': 1, 'hedges': 1, 'hedge_wins': 1})
+        self.assertEqual(self.metrics.counters[HEDGES], 1)
+        self.assertEqual(self.metrics.counters[HEDGE_WINS], 1)
+
+    def test_get_hedge_loses(self):
+        client = self.make_client(self.addresses, max_hedge_rate=1.0,
+                                  hedge_delay=0)
+        client.set('key', 'val')
+        release = threading.Event()
+        self.addCleanup(release.set)
+        primary, secondary = client._get_replicas(b'key')[:2]
+
+        def release_primary(cmd):
+            release.set()
+            threading.Event().wait(0.2)
+
+        with self.slow_request(primary, release):
+            with patch.object(secondary, 'request',
+                              side_effect=release_primary):
+                self.assertEqual(client.get('key'), 'val')
+
+        self.assertEqual(client.hedge_stats['hedges'], 1)
+        self.assertEqual(client.hedge_stats['hedge_wins'], 0)
+
+    def test_get_hedge_rate_limited(self):
+        client = self.make_client(self.addresses, max_hedge_rate=0.5,
+                                  hedge_delay=0)
+        client.set('key', 'val')
+        release = threading.Event()
+        release.set()
+
+        with self.slow_request(client._get_replicas(b'key')[0], release):
+            for _ in range(10):
+                self.assertEqual(client.get('key'), 'val')
+
+        self.assertTrue(client.hedge_stats['hedges'] <= 5)
+
+    def test_get_without_hedges(self):
+        client = self.make_client(self.addresses, max_hedge_rate=0)
+        client.set('key', 'val')
+        release = threading.Event()
+        threading.Timer(0.05, release.set).start()
+
+        with self.slow_request(client._get_replicas(b'key')[0], release):
+            self.assertEqual(client.get('key'), 'val')
+        self.assertEqual(client.hedge_stats['hedges'], 0)
+
+    def test_get_without_hedges_on_calling_thread(self):
+        client = self.make_client(self.addresses, max_hedge_rate=0)
+        client.set('key', 'val')
+        primary = client._get_replicas(b'key')[0]
+        request = primary.request
+        threads = []
+
+        def record_thread(cmd):
+            threads.append(threading.current_thread())
+            return request(cmd)
+
+        with patch.object(primary, 'request', side_effect=record_thread):
+            self.assertEqual(client.get('key'), 'val')
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_get_without_hedges_primary_failed(self):
+        client = self.make_client(self.addresses, max_hedge_rate=0)
+        client.set('key', 'val')
+
+        with patch.object(client._get_replicas(b'key')[0], 'request',
+                          side_effect=CircuitOpenError):
+            self.assertEqual(client.get('key'), 'val')
+        self.assertEqual(client.hedge_stats,
+                         {'reads': 1, 'hedges': 1, 'hedge_wins': 1})
+
+    def test_get_hedge_delay_excludes_queue_time(self):
+        client = self.make_client(self.addresses, max_hedge_rate=1.0,
+                                  hedge_delay=0.05, workers=1)
+        client.set('key', 'val')
+        release = threading.Event()
+        self.addCleanup(release.set)
+        busy = client._workers.submit(release.wait, 0.2)
+
+        self.assertEqual(client.get('key'), 'val')
+        self.assertTrue(busy.done.is_set())
+        self.assertEqual(client.hedge_stats['hedges'], 0)
+
+    def test_get_primary_failed(self):
+        self.client.set('key', 'val')
+        primary = self.replicas('key')[0]
+
+        with patch.object(primary, 'request', side_effect=CircuitOpenError):
+            self.assertEqual(self.client.get('key'), 'val')
+        self.assertEqual(self.client.hedge_stats['hedges'], 1)
+
+    def test_get_all_replicas_failed(self):
+        with patch.object(self.replicas('key')[0], 'request',
+                          side_effect=CircuitOpenError):
+            with patch.object(self.replicas('key')[1], 'request',
+                              side_effect=CircuitOpenError):
+                self.assertRaises(CircuitOpenError, self.client.get, 'key')
+
+    def test_set_replica_failed(self):
+        with patch.object(self.replicas('key')[1], 'request',
+                          side_effect=CircuitOpenError):
+            self.assertTrue(self.client.set('key', 'val'))
+        self.assertEqual(len(self.stored_on('key')), 1)
+
+    def test_hedge_delay(self):
+        client = self.make_client(self.addresses, hedge_delay=0.5,
+                                  hedge_percentile=95)
+        self.assertEqual(client.hedge_delay, 0.5)
+
+        for _ in range(MIN_HEDGE_SAMPLES):
+            client._latency.record(0.001)
+        self.assertTrue(client.hedge_delay <= 0.001)
@@ -0,0 +1,174 @@
+import io
+from unittest import TestCase
+
+from dsmcache.response import (
+    Response, ResponseParser, Result, BufferSink, FileSink, VALUE, END,
+    STORED, NOT_STORED, EXISTS, NOT_FOUND, DELETED, NUMERIC, ERROR, META_OK,
+    META_VALUE, META_MISS, parse_meta_flags)
+
+
+class ResponseTestCase(TestCase):
+
+    def test_add_value(self):
+        response = Response()
+        response.add(Result(VALUE, b'key', b'value', 3, 10))
+
+        self.assertEqual(response[b'key'], b'value')
+        self.assertEqual(response.data, {b'key': b'value'})
+        self.assertEqual(response.values[b'key'].flags, 3)
+        self.assertIsNone(response.status)
+
+    def test_add_status(self):
+        response = Response()
+        response.add(Result(STORED))
+
+        self.assertEqual(response.status, STORED)
+        self.assertTrue(response.is_valid())
+        self.assertIsNone(response.error)
+
+    def test_add_error(self):
+        response = Response()
+        response.add(Result(ERROR, value=b'SERVER_ERROR out of memory'))
+
+        self.assertFalse(response.is_valid())
+        self.assertEqual(response.error, b'SERVER_ERROR out of memory')
+
+    def test_value_containing_error_is_valid(self):
+        response = Response()
+        response.add(Result(VALUE, b'key', b'ERROR'))
+        response.add(Result(END))
+
+        self.assertTrue(response.is_valid())
+
+
+class ResponseParserTestCase(TestCase):
+
+    def setUp(self):
+        self.parser = ResponseParser()
+
+    def results(self):
+        results = []
+        result = self.parser.next_result()
+        while result:
+            results.append(result)
+            result = self.parser.next_result()
+        return results
+
+    def test_status_lines(self):
+        self.parser.feed(b'STORED\r\nDELETED\r\n42\r\n')
+
+        self.assertEqual(self.results(), [
+            Result(STORED), Result(DELETED), Result(NUMERIC, value=42)])
+
+    def test_errors(self):
+        self.parser.feed(b'ERROR\r\nCLIENT_ERROR bad data chunk\r\n')
+
+        self.assertEqual(self.results(), [
+            Result(ERROR, value=b'ERROR'),
+            Result(ERROR, value=b'CLIENT_ERROR bad data chunk')])
+
+    def test_values(self):
+        self.parser.feed(b'VALUE a 1 3\r\nfoo\r\nVALUE b 2 5 77\r\n'
+                         b'b\r\nar\r\nEND\r\n')
+
+        self.assertEqual(self.results(), [
+            Result(VALUE, b'a', b'foo', 1, None),
+            Result(VALUE, b'b', b'b\r\nar', 2, 77),
+            Result(END)])
+
+    def test_meta_value(self):
+        self.parser.feed(b'VA 3 f1 c77 t-1 W\r\nfoo\r\n')
+
+        result = self.parser.next_result()
+        self.assertEqual(result.type, META_VALUE)
+        self.assertEqual(result.value, b'foo')
+        self.assertEqual((result.flags, result.cas), (1, 77))
+        self.assertEqual(result.meta, {'f': 1, 'c': 77, 't': -1, 'W': True})
+        self.assertTrue(result.final)
+
+    def test_meta_status_lines(self):
+        self.parser.feed(b'HD c5\r\nEN\r\nNF\r\nNS\r\nEX\r\nMN\r\n')
+
+        self.assertEqual([result.type for result in self.results()], [
+            META_OK, META_MISS, NOT_FOUND, NOT_STORED, EXISTS, END])
+
+    def test_meta_opaque(self):
+        self.parser.feed(b'VA 1 O3 kb\r\nx\r\nHD O4\r\nMN\r\n')
+        results = self.results()
+
+        self.assertEqual([(r.key, r.opaque) for r in results],
+                         [(b'b', 3), (None, 4), (None, None)])
+        self.assertEqual([r.final for r in results], [False, False, True])
+
+    def test_parse_meta_flags(self):
+        self.assertEqual(
+            parse_meta_flags([b'h0', b'k123', b'Oabc', b'X', b'Z']),
+            {'h': 0, 'k': b'123', 'O': b'abc', 'X': True, 'Z': True})
+
+    def test_byte_by_byte(self):
+        data = b'VALUE a 0 3\r\nfoo\r\nEND\r\n'
+        for i in range(len(data)):
+            self.parser.feed(data[i:i + 1])
+
+        self.assertEqual(self.results(), [
+            Result(VALUE, b'a', b'foo'), Result(END)])
+
+    def test_value_larger_than_buffer(self):
+        parser = ResponseParser(buffer_size=16)
+        parser.feed(b'VALUE a 0 40\r\n0123456789')
+
+        buf = parser.get_buffer()
+        self.assertEqual(len(buf), 30)
+        buf[:] = b'abcdefghij' * 3
+        parser.buffer_updated(30)
+
+        result = parser.next_result()
+        self.assertEqual(result.value, b'0123456789' + b'abcdefghij' * 3)
+        self.assertIsInstance(result.value, bytearray)
+
+        parser.feed(b'\r\nEND\r\n')
+        self.assertEqual(parser.next_result(), Result(END))
+
+    def test_value_into_buffer_sink(self):
+        target = bytearray(8)
+        self.parser.sink = BufferSink(target)
+        self.parser.feed(b'VALUE a 0 3\r\nfoo\r\nEND\r\n')
+
+        self.assertEqual(self.results(), [
+            Result(VALUE, b'a', 3), Result(END)])
+        self.assertEqual(target[:3], b'foo')
+
+    def test_value_larger_than_buffer_sink(self):
+        self.parser.sink = BufferSink(bytearray(2))
+        self.parser.feed(b'VALUE a 0 3\r\nfoo\r\nEND\r\n')
+
+        self.assertEqual(self.results(), [
+            Result(VALUE, b'a', None), Result(END)])
+
+    def test_value_into_file_sink(self):
+        parser = ResponseParser(buffer_size=16)
+        target = io.BytesIO()
+        parser.sink = FileSink(target, chunk_size=4)
+        parser.feed(b'VALUE a 0 10\r\n01')
+
+        while parser.next_result() is None:
+            buf = parser.get_buffer()
+            self.assertLessEqual(len(buf), 4)
+            buf[:2] = b'xy'
+            parser.buffer_updated(2)
+
+        self.assertEqual(target.getvalue(), b'01xyxyxyxy')
+
+    def test_long_line_grows_buffer(self):
+        parser = ResponseParser(buffer_size=4)
+        parser.feed(b'SERVER_ERROR out of memory\r\n')
+
+        self.assertEqual(parser.next_result(),
+                         Result(ERROR, value=b'SERVER_ERROR out of memory'))
+
+    def test_reset(self):
+        self.parser.feed(b'STORED\r\nVALUE a 0 3\r\nf')
+        self.parser.reset()
+        self.parser.feed(b'END\r\n')
+
+        self.assertEqual(self.results(), [Result(END)])
@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from unittest import TestCase
+
+from dsmcache.serializers import (
+    Serializer, FLAG_BYTES, FLAG_TEXT, FLAG_INTEGER, FLAG_PICKLE, FLAG_JSON)
+
+
+class SerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.serializer = Serializer()
+
+    def assertRoundTrip(self, value, type_flag):
+        data, flags = self.serializer.serialize(value)
+
+        self.assertEqual(flags, type_flag)
+        self.assertEqual(self.serializer.deserialize(data, flags), value)
+
+    def test_bytes_pass_through(self):
+        value = bytearray(b'\xff\x00binary')
+        data, flags = self.serializer.serialize(value)
+
+        self.assertIs(data, value)
+        self.assertEqual(flags, FLAG_BYTES)
+        self.assertIs(self.serializer.deserialize(value, FLAG_BYTES), value)
+
+    def test_text(self):
+        self.assertRoundTrip('zaż\xf3łć', FLAG_TEXT)
+
+    def test_integer(self):
+        self.assertEqual(self.serializer.serialize(42), (b'42', FLAG_INTEGER))
+        self.assertRoundTrip(-7, FLAG_INTEGER)
+        self.assertEqual(
+            self.serializer.deserialize(bytearray(b'43'), FLAG_INTEGER), 43)
+
+    def test_pickle(self):
+        self.assertRoundTrip({'a': [1, 2]}, FLAG_PICKLE)
+        self.assertRoundTrip(True, FLAG_PICKLE)
+
+    def test_json(self):
+        self.serializer = Serializer(fallback=FLAG_JSON)
+
+        self.assertRoundTrip({'a': [1, 2]}, FLAG_JSON)
+
+    def test_user_flags_are_ignored(self):
+        self.assertEqual(
+            self.serializer.deserialize(b'text', FLAG_TEXT | 0x100), 'text')
+
+    def test_register(self):
+        self.serializer.register(
+            16, Decimal, lambda value: str(value).encode('ascii'),
+            lambda data: Decimal(data.decode('ascii')))
+
+        self.assertRoundTrip(Decimal('1.50'), 16)
+
+    def test_register_builtin_flag(self):
+        with self.assertRaises(ValueError):
+            self.serializer.register(FLAG_TEXT, Decimal, str, Decimal)
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            self.serializer.deserialize(b'data', 99)
@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+import threading
+from unittest import TestCase
+
+from dsmcache.singleflight import SingleFlight
+
+
+class SingleFlightTestCase(TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def run_concurrently(self, func, count=4):
+        results = []
+
+        def worker():
+            try:
+                results.append(self.single_flight.do('key', func))
+            except Exception as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        # wait until followers are blocked on the leader's call
+        while self.single_flight.coalesced < count - 1:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_do(self):
+        self.assertEqual(self.single_flight.do('key', lambda: 1), (1, False))
+        self.assertEqual(self.single_flight.do('key', lambda: 2), (2, False))
+        self.assertEqual(self.single_flight.coalesced, 0)
+
+    def test_concurrent_calls_are_coalesced(self):
+        def func():
+            self.calls.append(1)
+            self.release.wait(5)
+            return 'value'
+
+        results = self.run_concurrently(func)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, [('value', True)] * 4)
+
+    def test_error_is_shared(self):
+        def func():
+            self.calls.append(1)
+            self.release.wait(5)
+            raise KeyError('boom')
+
+        results = self.run_concurrently(func)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(isinstance(exc, KeyError) for exc in results))
+        # failed call isn't cached
+        self.assertEqual(self.single_flight.do('key', lambda: 1), (1, False))
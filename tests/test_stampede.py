@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from mock import patch
+
+from dsmcache.stampede import (
+    FLAG_STAMPED, stamp, unstamp, expires_at, should_recompute, lease_key)
+
+
+class StampTestCase(TestCase):
+
+    def test_stamp_unstamp(self):
+        data, flags = stamp(b'value', 1, 0.5, 1000.0)
+
+        self.assertEqual(flags, 1 | FLAG_STAMPED)
+        self.assertEqual(unstamp(data, flags), (b'value', 1, 0.5, 1000.0))
+
+    def test_expires_at(self):
+        self.assertEqual(expires_at(0), 0)
+        self.assertEqual(expires_at(10, now=100), 110)
+        self.assertEqual(expires_at(2000000000), 2000000000)
+
+    def test_lease_key(self):
+        self.assertEqual(lease_key(b'key'), b'key:lease')
+        self.assertLessEqual(len(lease_key(b'k' * 250)), 250)
+
+
+class ShouldRecomputeTestCase(TestCase):
+
+    def test_never_expires(self):
+        self.assertFalse(should_recompute(10, 0))
+
+    def test_expired(self):
+        self.assertTrue(should_recompute(0, 100, now=100))
+
+    @patch('dsmcache.stampede.random.random')
+    def test_early(self, random_mock):
+        # -log(1 - 0.9) is about 2.3
+        random_mock.return_value = 0.9
+
+        self.assertTrue(should_recompute(1, 102, now=100))
+        self.assertFalse(should_recompute(1, 103, now=100))
+        self.assertFalse(should_recompute(1, 102, beta=0, now=100))
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+
+import threading
+from unittest import TestCase
+
+from six.moves import queue
+
+from dsmcache.workers import WorkerPool
+
+
+class WorkerPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(max_workers=2)
+        self.addCleanup(self.pool.close)
+
+    def test_submit(self):
+        task = self.pool.submit(lambda a, b: a + b, 1, 2)
+
+        self.assertEqual(task.get(1), 3)
+        self.assertFalse(task.failed)
+
+    def test_submit_raises(self):
+        def fail():
+            raise KeyError('key')
+
+        task = self.pool.submit(fail)
+
+        self.assertRaises(KeyError, task.get, 1)
+        self.assertTrue(task.failed)
+
+    def test_get_timeout(self):
+        release = threading.Event()
+        task = self.pool.submit(release.wait)
+
+        self.assertRaises(queue.Empty, task.get, 0.01)
+        release.set()
+        self.assertTrue(task.get(1))
+
+    def test_done_queue(self):
+        release = threading.Event()
+        done = queue.Queue()
+        slow = self.pool.submit(release.wait, done_queue=done)
+        fast = self.pool.submit(lambda: 1, done_queue=done)
+
+        self.assertIs(done.get(timeout=1), fast)
+        release.set()
+        self.assertIs(done.get(timeout=1), slow)
+
+    def test_max_workers(self):
+        release = threading.Event()
+        tasks = [self.pool.submit(release.wait) for _ in range(4)]
+        release.set()
+
+        for task in tasks:
+            self.assertTrue(task.get(1))
+        self.assertEqual(len(self.pool._workers), 2)
+
+    def test_workers_are_reused(self):
+        for i in range(5):
+            self.assertEqual(self.pool.submit(lambda: i).get(1), i)
+        self.assertEqual(len(self.pool._workers), 1)
+
+    def test_close(self):
+        self.pool.close()
+
+        self.assertRaises(ValueError, self.pool.submit, lambda: 1)